@@ -1,3 +1,3 @@
 @echo off
 cd :: Введите путь до папки с ботом полностью
-python main.py
+python -c "import main; main.run_bot()"
@@ -0,0 +1,179 @@
+import argparse
+import atexit
+import collections
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+
+from fake_bot_api import FakeBotApi
+
+BENCH_TOKEN = "100000:FAKE-BENCHMARK-TOKEN"
+BENCH_CHAT_ID = 424242
+
+DEFAULT_SCRIPT = [
+    {"text": "/start"},
+    {"text": "/menu"},
+    {"data": "main_menu"},
+    {"data": "file_manager"},
+    {"data": "folder_{home}"},
+    {"data": "file_manager_sort"},
+    {"data": "file_manager_next"},
+    {"data": "file_manager_prev"},
+    {"data": "kill_menu"},
+    {"data": "process_sort"},
+    {"data": "volume_control"},
+    {"data": "key_emulation"},
+    {"data": "special_keys"},
+    {"data": "key_combinations"},
+    {"data": "mouse_emulation"},
+    {"text": "/log 5"},
+    {"data": "cmdlist"}
+]
+
+
+def use_state_dir():
+    state_dir = tempfile.mkdtemp(prefix="controlpc_bench_")
+    atexit.register(shutil.rmtree, state_dir, ignore_errors=True)
+    os.chdir(state_dir)
+
+
+def load_main():
+    use_state_dir()
+    config = types.ModuleType("config")
+    config.TOKEN = BENCH_TOKEN
+    config.CHAT_ID = BENCH_CHAT_ID
+    sys.modules["config"] = config
+    import main
+    return main
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class HandlerTimer:
+    def __init__(self, main):
+        self.main = main
+        self.latencies = collections.defaultdict(list)
+        self.handled = 0
+        self.condition = threading.Condition()
+
+    def label(self, update):
+        data = getattr(update, "data", None)
+        if data is not None:
+            resolved = self.main.router.resolve(data)
+            return resolved[0].__name__.replace("action_", "") if resolved else data
+        text = getattr(update, "text", None) or ""
+        return text.split()[0] if text.startswith("/") else update.content_type
+
+    def wrap(self, function):
+        def timed(update):
+            started = time.perf_counter()
+            try:
+                return function(update)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.condition:
+                    self.latencies[self.label(update)].append(elapsed)
+                    self.handled += 1
+                    self.condition.notify_all()
+        return timed
+
+    def install(self, bot):
+        for handlers in (bot.message_handlers, bot.callback_query_handlers):
+            for handler in handlers:
+                handler["function"] = self.wrap(handler["function"])
+
+    def wait(self, count, timeout):
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.handled < count and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            return self.handled
+
+
+def expand(entry, main):
+    home = main.path_token(BENCH_CHAT_ID, os.path.expanduser("~"))
+    return {key: value.replace("{home}", home) if isinstance(value, str) else value for key, value in entry.items()}
+
+
+def replay(api, main, script, rounds):
+    for _ in range(rounds):
+        for entry in script:
+            entry = expand(entry, main)
+            if "data" in entry:
+                api.push_callback(BENCH_CHAT_ID, entry["data"])
+            elif "document" in entry:
+                with open(entry["document"], "rb") as f:
+                    api.push_document(BENCH_CHAT_ID, f.read(), os.path.basename(entry["document"]),
+                                      entry.get("caption"))
+            else:
+                api.push_message(BENCH_CHAT_ID, entry["text"])
+    return rounds * len(script)
+
+
+def run(script, rounds, latency, timeout, rate_limit=False):
+    script = [dict(entry, document=os.path.abspath(entry["document"])) if "document" in entry else entry
+              for entry in script]
+    api = FakeBotApi(latency=latency).start()
+    api.install()
+    main = load_main()
+    main.bot.outbound.limited = rate_limit
+    timer = HandlerTimer(main)
+    timer.install(main.bot)
+
+    polling = threading.Thread(target=main.bot.infinity_polling,
+                               kwargs={"timeout": 5, "long_polling_timeout": 1}, daemon=True)
+    polling.start()
+
+    started = time.perf_counter()
+    total = replay(api, main, script, rounds)
+    handled = timer.wait(total, timeout)
+    elapsed = time.perf_counter() - started
+
+    main.bot.stop_polling()
+    api.stop()
+    return timer, api, total, handled, elapsed
+
+
+def report(timer, api, total, handled, elapsed):
+    print(f"{'action':<24}{'count':>8}{'p50, ms':>10}{'p99, ms':>10}{'mean, ms':>10}")
+    all_latencies = []
+    for label, latencies in sorted(timer.latencies.items()):
+        all_latencies += latencies
+        print(f"{label:<24}{len(latencies):>8}{percentile(latencies, 0.5) * 1000:>10.2f}"
+              f"{percentile(latencies, 0.99) * 1000:>10.2f}{sum(latencies) / len(latencies) * 1000:>10.2f}")
+    if all_latencies:
+        print(f"\n{'all':<24}{len(all_latencies):>8}{percentile(all_latencies, 0.5) * 1000:>10.2f}"
+              f"{percentile(all_latencies, 0.99) * 1000:>10.2f}"
+              f"{sum(all_latencies) / len(all_latencies) * 1000:>10.2f}")
+
+    print(f"\nupdates: {handled}/{total} in {elapsed:.2f}s ({handled / elapsed:.1f} updates/s)")
+    print("api calls: " + ", ".join(f"{method}={count}" for method, count in sorted(api.calls.items())))
+    if handled < total:
+        print(f"warning: {total - handled} updates were not handled before the timeout")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay scripted updates through the bot against a local fake "
+                                                 "Bot API and report handler latency")
+    parser.add_argument("--rounds", type=int, default=20, help="how many times to replay the script")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated Bot API latency per call, ms")
+    parser.add_argument("--script", help="JSON file with a list of {\"text\": ...}, {\"data\": ...} "
+                                         "or {\"document\": path} entries")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for all updates")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the outbound Telegram rate limits enabled")
+    args = parser.parse_args()
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+
+    report(*run(script, args.rounds, args.latency / 1000, args.timeout, args.rate_limit))
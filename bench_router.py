@@ -0,0 +1,79 @@
+import sys
+import time
+import types
+
+config = types.ModuleType("config")
+config.TOKEN = "100000:FAKE-BENCHMARK-TOKEN"
+config.CHAT_ID = 424242
+sys.modules["config"] = config
+
+import main
+
+LEGACY_CHAIN = [
+    ("main_menu", False), ("autostart", False), ("shutdown", False), ("shutdown_confirm", False),
+    ("shutdown_cancel", False), ("reboot", False), ("reboot_confirm", False), ("reboot_cancel", False),
+    ("screenshot", False), ("file_manager", False), ("folder_", True), ("file_", True), ("upload_here", False),
+    ("archive_folder", False), ("get_file_here", False), ("enter_path", False), ("file_manager_prev", False),
+    ("file_manager_next", False), ("file_manager_sort", False), ("log", False), ("kill_menu", False),
+    ("toggle_system", False), ("volume_control", False), ("volume_mute", False), ("volume_up", False),
+    ("volume_down", False), ("key_emulation", False), ("emulate_text", False), ("special_keys", False),
+    ("key_combinations", False), ("key_", True), ("comb_", True), ("mouse_emulation", False), ("mouse_up", False),
+    ("mouse_down", False), ("mouse_left", False), ("mouse_right", False), ("mouse_left_click", False),
+    ("mouse_right_click", False), ("mouse_middle_click", False), ("mouse_scroll_up", False),
+    ("mouse_scroll_down", False), ("lock_screen", False), ("cmdlist", False), ("noop", False)
+]
+
+
+def legacy_dispatch(action):
+    for name, is_prefix in LEGACY_CHAIN:
+        if is_prefix:
+            if action.startswith(name):
+                return name
+        elif action == name:
+            return name
+    return None
+
+
+def sample_actions():
+    actions = list(main.router.exact)
+    actions += ["folder_1a", "file_2b", "key_Enter", "comb_alt_tab", "unknown_action"]
+    return actions
+
+
+def measure(dispatch, actions, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for action in actions:
+            dispatch(action)
+    return (time.perf_counter() - started) / (rounds * len(actions)) * 1e9
+
+
+def measure_scaling(rounds):
+    results = []
+    for count in (10, 100, 1000, 10000):
+        router = main.ActionRouter()
+        for index in range(count):
+            router.action(f"bench_action_{index}")(lambda call: None)
+        router.prefix("folder_")(lambda call, value: None)
+        actions = [f"bench_action_{count - 1}", "bench_action_0", "folder_1a", "missing"]
+        results.append((count, measure(router.resolve, actions, rounds)))
+    return results
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    actions = sample_actions()
+
+    print(f"{'action':<24}{'elif chain, ns':>16}{'router, ns':>14}")
+    for action in actions:
+        legacy = measure(legacy_dispatch, [action], rounds)
+        routed = measure(main.router.resolve, [action], rounds)
+        print(f"{action:<24}{legacy:>16.0f}{routed:>14.0f}")
+
+    legacy = measure(legacy_dispatch, actions, rounds)
+    routed = measure(main.router.resolve, actions, rounds)
+    print(f"\n{'average':<24}{legacy:>16.0f}{routed:>14.0f}  ({legacy / routed:.1f}x)")
+
+    print(f"\n{'registered actions':<24}{'router, ns':>14}")
+    for count, routed in measure_scaling(rounds // 4 or 1):
+        print(f"{count:<24}{routed:>14.0f}")
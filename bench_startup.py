@@ -0,0 +1,66 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+STARTUP_BUDGET_MS = 400
+EAGER_IMPORT_BLACKLIST = ("pyautogui", "win10toast", "psutil", "PIL.ImageGrab")
+IMPORT_SNIPPET = (
+    "import sys, types\n"
+    "config = types.ModuleType('config')\n"
+    "config.TOKEN = '100000:FAKE-BENCHMARK-TOKEN'\n"
+    "config.CHAT_ID = 424242\n"
+    "sys.modules['config'] = config\n"
+    "import main\n"
+)
+
+
+def measure_import():
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_SNIPPET],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        if not self_time.strip().isdigit():
+            continue
+        imports[name.strip()] = (int(self_time) / 1000, int(cumulative) / 1000)
+    return imports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how long importing main takes with -X importtime")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreter runs")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_MS, help="allowed import time of main, ms")
+    parser.add_argument("--top", type=int, default=15, help="how many of the slowest imports to show")
+    args = parser.parse_args()
+
+    measure_import()
+    runs = [measure_import() for _ in range(args.runs)]
+    totals = [imports["main"][1] for imports in runs]
+    median = statistics.median(totals)
+    last = runs[-1]
+
+    print(f"{'module':<40}{'self, ms':>10}{'cumulative, ms':>16}")
+    for name, (self_time, cumulative) in sorted(last.items(), key=lambda item: item[1][0], reverse=True)[:args.top]:
+        print(f"{name:<40}{self_time:>10.1f}{cumulative:>16.1f}")
+
+    print(f"\nimport main: median {median:.1f} ms, min {min(totals):.1f} ms, max {max(totals):.1f} ms "
+          f"over {args.runs} runs (budget {args.budget:.0f} ms)")
+
+    failures = []
+    if median > args.budget:
+        failures.append(f"import time {median:.1f} ms is over the {args.budget:.0f} ms budget")
+    eager = [name for name in EAGER_IMPORT_BLACKLIST if name in last]
+    if eager:
+        failures.append("imported at startup but should be lazy: " + ", ".join(eager))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,225 @@
+import collections
+import itertools
+import json
+import threading
+import time
+import uuid
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from telebot import apihelper
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "ControlPCbotV2", "username": "controlpc_fake_bot"}
+
+
+class FakeBotApi:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.latency = latency
+        self.updates = []
+        self.condition = threading.Condition()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.files = {}
+        self.calls = collections.Counter()
+        self.calls_lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.create_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def install(self):
+        apihelper.API_URL = self.url + "/bot{0}/{1}"
+        apihelper.FILE_URL = self.url + "/file/bot{0}/{1}"
+
+    def create_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self.dispatch()
+
+            def do_POST(self):
+                self.dispatch()
+
+            def dispatch(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                parts = url.path.strip("/").split("/")
+
+                if parts[0] == "file" and len(parts) >= 3:
+                    data = api.files.get("/".join(parts[2:]), (None, None))[1]
+                    if data is None:
+                        self.reply(404, b"Not Found", "text/plain")
+                    else:
+                        self.reply(200, data, "application/octet-stream")
+                    return
+
+                params = dict(parse_qsl(url.query))
+                files = {}
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("multipart/form-data"):
+                    parse_multipart(content_type, body, params, files)
+                elif content_type.startswith("application/x-www-form-urlencoded"):
+                    params.update(parse_qsl(body.decode("utf-8")))
+
+                method = parts[-1] if parts else ""
+                try:
+                    result = api.handle(method, params, files)
+                    payload = {"ok": True, "result": result}
+                except KeyError as e:
+                    payload = {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}
+                self.reply(200 if payload["ok"] else 400, json.dumps(payload).encode("utf-8"), "application/json")
+
+            def reply(self, status, data, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def record(self, method):
+        with self.calls_lock:
+            self.calls[method] += 1
+
+    def message(self, chat_id, **fields):
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": BOT_USER
+        }
+        message.update(fields)
+        return message
+
+    def store_file(self, data, file_name, folder="documents"):
+        file_id = uuid.uuid4().hex
+        self.files[f"{folder}/{file_id}"] = (file_name, data)
+        return {"file_id": file_id, "file_unique_id": file_id[:16], "file_name": file_name, "file_size": len(data)}
+
+    def file_meta(self, file_id):
+        for path, (file_name, data) in self.files.items():
+            if path.endswith("/" + file_id):
+                return path, file_name, data
+        raise KeyError(f"file {file_id} not found")
+
+    def push(self, update):
+        with self.condition:
+            update["update_id"] = next(self.update_ids)
+            self.updates.append(update)
+            self.condition.notify_all()
+        return update["update_id"]
+
+    def push_message(self, chat_id, text):
+        return self.push({"message": self.message(chat_id, text=text, **{"from": self.user(chat_id)})})
+
+    def push_callback(self, chat_id, data, message_id=1):
+        message = self.message(chat_id, text="menu")
+        message["message_id"] = message_id
+        return self.push({"callback_query": {
+            "id": uuid.uuid4().hex,
+            "from": self.user(chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": message
+        }})
+
+    def push_document(self, chat_id, data, file_name, caption=None):
+        fields = {"document": self.store_file(data, file_name), "from": self.user(chat_id)}
+        if caption:
+            fields["caption"] = caption
+        return self.push({"message": self.message(chat_id, **fields)})
+
+    def user(self, chat_id):
+        return {"id": int(chat_id), "is_bot": False, "first_name": "Benchmark"}
+
+    def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.time() + float(params.get("timeout") or 0)
+        with self.condition:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+            while not self.updates and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            return self.updates[:limit]
+
+    def handle(self, method, params, files):
+        self.record(method)
+        if method == "getUpdates":
+            return self.get_updates(params)
+        if self.latency:
+            time.sleep(self.latency)
+
+        chat_id = params.get("chat_id", 0)
+        if method == "getMe":
+            return BOT_USER
+        if method == "sendMessage":
+            return self.message(chat_id, text=params["text"])
+        if method == "editMessageText":
+            message = self.message(chat_id, text=params["text"])
+            message["message_id"] = int(params.get("message_id") or 0)
+            return message
+        if method == "sendDocument":
+            if "document" in files:
+                document = self.store_file(files["document"][1], files["document"][0])
+            else:
+                path, file_name, data = self.file_meta(params["document"])
+                document = {"file_id": params["document"], "file_unique_id": params["document"][:16],
+                            "file_name": file_name, "file_size": len(data)}
+            return self.message(chat_id, document=document, caption=params.get("caption", ""))
+        if method == "sendPhoto":
+            if "photo" in files:
+                photo = self.store_file(files["photo"][1], files["photo"][0], "photos")
+            else:
+                photo = {"file_id": params["photo"], "file_unique_id": params["photo"][:16], "file_size": 0}
+            photo.pop("file_name", None)
+            photo.update(width=1280, height=720)
+            return self.message(chat_id, photo=[photo], caption=params.get("caption", ""))
+        if method == "editMessageMedia":
+            message = self.message(chat_id, photo=[{"file_id": "edited", "file_unique_id": "edited",
+                                                    "width": 1280, "height": 720}])
+            message["message_id"] = int(params.get("message_id") or 0)
+            return message
+        if method == "getFile":
+            path, file_name, data = self.file_meta(params["file_id"])
+            return {"file_id": params["file_id"], "file_unique_id": params["file_id"][:16],
+                    "file_size": len(data), "file_path": path}
+        return True
+
+
+def parse_multipart(content_type, body, params, files):
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        file_name = part.get_filename()
+        data = part.get_payload(decode=True) or b""
+        if file_name is None:
+            params[name] = data.decode("utf-8")
+        else:
+            files[name] = (file_name, data)
@@ -1,46 +1,1453 @@
 import os
+import io
+import importlib
+import itertools
+import json
 import logging
+import atexit
+import bisect
+import functools
+import hashlib
+import html
+import heapq
+import mmap
+import queue
+import re
+import shlex
+import struct
+import shutil
 import subprocess
+import threading
 import time
+import requests
 import telebot
-import psutil
-import pyautogui
+import sys
 import tempfile
-import winreg
-import ctypes
+import uuid
 import zipfile
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-from win10toast import ToastNotifier
+import zlib
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from telebot import apihelper
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
 import config
 
-bot = telebot.TeleBot(config.TOKEN)
 logger = telebot.logger
 logger.setLevel(logging.INFO)
-toaster = ToastNotifier()
-
-user_state = {
-    "process_page": 0,
-    "selected_process": None,
-    "waiting_for_path": None,
-    "upload_path": None,
-    "show_system_processes": False,
-    "current_directory": os.path.expanduser("~"),
-    "waiting_for_emulation_text": False,
-    "waiting_for_process_kill": False,
-    "process_list": [],
-    "file_manager_page": 0
+
+
+class LazyModule:
+    def __init__(self, name):
+        self.__dict__["name"] = name
+        self.__dict__["module"] = None
+
+    def __getattr__(self, attribute):
+        module = self.__dict__["module"]
+        if module is None:
+            module = self.__dict__["module"] = importlib.import_module(self.__dict__["name"])
+        return getattr(module, attribute)
+
+
+psutil = LazyModule("psutil")
+pyautogui = LazyModule("pyautogui")
+ctypes = LazyModule("ctypes")
+winreg = LazyModule("winreg")
+Image = LazyModule("PIL.Image")
+ImageChops = LazyModule("PIL.ImageChops")
+ImageDraw = LazyModule("PIL.ImageDraw")
+ImageFont = LazyModule("PIL.ImageFont")
+ImageGrab = LazyModule("PIL.ImageGrab")
+http_server = LazyModule("http.server")
+cProfile = LazyModule("cProfile")
+pstats = LazyModule("pstats")
+
+AUTOSTART_NAME = "ControlPCbotV2"
+NOTIFY_DURATION = 5
+
+
+class UnavailableBackend:
+    def __init__(self, reason):
+        self.reason = reason
+
+    def __getattr__(self, name):
+        raise RuntimeError(self.reason)
+
+
+class PyAutoGuiInput:
+    def press(self, key, presses=1):
+        pyautogui.press(key, presses=presses)
+
+    def hotkey(self, *keys):
+        pyautogui.hotkey(*keys)
+
+    def write(self, text):
+        pyautogui.write(text)
+
+    def move(self, x, y):
+        pyautogui.move(x, y)
+
+    def move_to(self, x, y):
+        pyautogui.moveTo(x, y)
+
+    def click(self, button="left", clicks=1):
+        pyautogui.click(button=button, clicks=clicks)
+
+    def scroll(self, clicks):
+        pyautogui.scroll(clicks)
+
+    def screen_size(self):
+        return tuple(pyautogui.size())
+
+    def key_names(self):
+        return pyautogui.KEYBOARD_KEYS
+
+
+class ImageGrabScreen:
+    def capture(self, region=None):
+        if region is None:
+            return ImageGrab.grab()
+        x, y, width, height = region
+        return ImageGrab.grab(bbox=(x, y, x + width, y + height))
+
+
+class ToastNotifications:
+    def __init__(self):
+        self.toaster = importlib.import_module("win10toast").ToastNotifier()
+
+    def show(self, title, message):
+        self.toaster.show_toast(title, message, duration=NOTIFY_DURATION, threaded=False)
+
+
+class NotifySendNotifications:
+    def show(self, title, message):
+        subprocess.run(["notify-send", "-t", str(NOTIFY_DURATION * 1000), title, message],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class LogNotifications:
+    def show(self, title, message):
+        logger.info(f"{title}: {message}")
+
+
+class RegistryAutostart:
+    key_path = r"Software\Microsoft\Windows\CurrentVersion\Run"
+
+    def enabled(self):
+        try:
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, self.key_path, 0, winreg.KEY_READ) as key:
+                try:
+                    winreg.QueryValueEx(key, AUTOSTART_NAME)
+                    return True
+                except FileNotFoundError:
+                    return False
+        except:
+            return False
+
+    def enable(self):
+        try:
+            script_dir = os.path.dirname(os.path.abspath(__file__))
+            bat_path = os.path.join(script_dir, "start.bat")
+
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, self.key_path, 0, winreg.KEY_SET_VALUE) as key:
+                winreg.SetValueEx(key, AUTOSTART_NAME, 0, winreg.REG_SZ, f'"{bat_path}"')
+
+            return True
+        except Exception as e:
+            return False
+
+    def disable(self):
+        try:
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, self.key_path, 0, winreg.KEY_SET_VALUE) as key:
+                winreg.DeleteValue(key, AUTOSTART_NAME)
+
+            return True
+        except Exception as e:
+            return False
+
+
+class XdgAutostart:
+    def __init__(self):
+        config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+        self.path = os.path.join(config_home, "autostart", f"{AUTOSTART_NAME}.desktop")
+
+    def enabled(self):
+        return os.path.exists(self.path)
+
+    def enable(self):
+        try:
+            script_path = os.path.abspath(__file__)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write("[Desktop Entry]\nType=Application\n"
+                        f"Name={AUTOSTART_NAME}\n"
+                        f'Exec="{sys.executable}" "{script_path}"\n'
+                        f'Path={os.path.dirname(script_path)}\n'
+                        "X-GNOME-Autostart-enabled=true\n")
+            return True
+        except OSError:
+            return False
+
+    def disable(self):
+        try:
+            os.unlink(self.path)
+            return True
+        except OSError:
+            return False
+
+
+class WindowsLock:
+    def lock(self):
+        ctypes.windll.user32.LockWorkStation()
+
+
+class SessionLock:
+    def lock(self):
+        for command in (["loginctl", "lock-session"], ["xdg-screensaver", "lock"]):
+            if shutil.which(command[0]) and subprocess.run(command).returncode == 0:
+                return
+        raise RuntimeError("Не удалось заблокировать сеанс")
+
+
+def has_display():
+    return os.name == 'nt' or bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+def create_notifications_backend():
+    if os.name == 'nt':
+        return ToastNotifications()
+    if has_display() and shutil.which("notify-send"):
+        return NotifySendNotifications()
+    return LogNotifications()
+
+
+PLATFORM_BACKENDS = {
+    "input": lambda: PyAutoGuiInput() if has_display() else UnavailableBackend(
+        "Эмуляция ввода недоступна: нет графического сеанса"),
+    "screen": lambda: ImageGrabScreen() if has_display() else UnavailableBackend(
+        "Скриншоты недоступны: нет графического сеанса"),
+    "notifications": create_notifications_backend,
+    "autostart": lambda: RegistryAutostart() if os.name == 'nt' else XdgAutostart(),
+    "lock": lambda: WindowsLock() if os.name == 'nt' else SessionLock()
+}
+
+
+class Backends:
+    def __init__(self, factories=PLATFORM_BACKENDS):
+        self.factories = factories
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name not in self.factories:
+            raise AttributeError(name)
+        with self.lock:
+            if name not in self.__dict__:
+                self.__dict__[name] = self.factories[name]()
+            return self.__dict__[name]
+
+
+backends = Backends()
+
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = getattr(config, "METRICS_PORT", None)
+STATS_TOP = 12
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+        histogram.max = self.max
+        return histogram
+
+    def quantile(self, fraction):
+        rank = fraction * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if index == len(self.buckets):
+                    return self.max
+                lower = self.buckets[index - 1] if index else 0
+                upper = min(self.buckets[index], self.max)
+                return lower + (upper - lower) * max(0, rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+
+def metric_key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def register(self, name, function, kind="gauge", **labels):
+        self.collectors[metric_key(name, labels)] = (kind, function)
+
+    def collect(self):
+        values = []
+        for (name, labels), (kind, function) in list(self.collectors.items()):
+            try:
+                values.append((name, labels, kind, function()))
+            except Exception:
+                pass
+        return values
+
+    def total(self, name):
+        with self.lock:
+            return sum(value for (key, labels), value in self.counters.items() if key == name)
+
+    def series(self, name):
+        with self.lock:
+            return {labels: histogram.copy() for (key, labels), histogram in self.histograms.items() if key == name}
+
+    def exposition(self):
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        def format_labels(labels, extra=()):
+            pairs = [f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+                     for key, value in tuple(labels) + tuple(extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            histograms = [(key, list(histogram.counts), histogram.count, histogram.sum, histogram.buckets)
+                          for key, histogram in histograms]
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for name, labels, kind, value in sorted(self.collect(), key=lambda item: item[:2]):
+            header(name, kind)
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), counts, count, total, buckets in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def timed_handler(function):
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        session = profiler.session
+        started = time.perf_counter()
+        try:
+            if session is not None and session.mode == "cprofile" and function is not handle_profile:
+                return session.run_profiled(function, args, kwargs)
+            return function(*args, **kwargs)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", handler=function.__name__)
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", time.perf_counter() - started, handler=function.__name__)
+    return run
+
+
+def upload_size(value):
+    value = getattr(value, "media", value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, io.BytesIO):
+        return value.getbuffer().nbytes - value.tell()
+    if isinstance(value, FileSlice):
+        return value.remaining
+    try:
+        return os.fstat(value.fileno()).st_size - value.tell()
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    class MetricsHandler(http_server.BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = metrics.exposition().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = http_server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Metrics endpoint: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+PROFILE_DEFAULT_SECONDS = 60
+PROFILE_MAX_SECONDS = 600
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_MAX_DEPTH = 64
+PROFILE_REPORT_LINES = 30
+PROFILE_MESSAGE_LINES = 20
+PROFILE_MODES = ("sample", "cprofile")
+
+
+def profile_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileSession:
+    def __init__(self, chat_id, mode=PROFILE_MODES[0], seconds=PROFILE_DEFAULT_SECONDS):
+        self.chat_id = chat_id
+        self.mode = mode
+        self.seconds = seconds
+        self.started = time.time()
+        self.stopped = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.stacks = Counter()
+        self.samples = 0
+        self.busy = 0
+        self.threads = 0
+        self.profiles = []
+        self.skipped = 0
+        self.sampler = None
+        self.timer = None
+
+    def start(self, on_timeout):
+        if self.mode == "sample":
+            self.sampler = threading.Thread(target=self.sample_forever, daemon=True)
+            self.sampler.start()
+        self.timer = threading.Timer(self.seconds, on_timeout, args=(self,))
+        self.timer.daemon = True
+        self.timer.start()
+
+    def stop(self):
+        self.stopped = time.time()
+        self.stop_event.set()
+        self.timer.cancel()
+        if self.sampler is not None and self.sampler is not threading.current_thread():
+            self.sampler.join()
+
+    def sample_forever(self):
+        while not self.stop_event.wait(PROFILE_SAMPLE_INTERVAL):
+            workers = {worker.ident for worker in getattr(bot.worker_pool, "workers", ())}
+            self.threads = max(self.threads, len(workers))
+            for ident, frame in sys._current_frames().items():
+                if ident not in workers:
+                    continue
+                stack = []
+                while frame is not None and frame.f_code is not handle_profile.__code__:
+                    if len(stack) < PROFILE_MAX_DEPTH:
+                        stack.append(frame.f_code)
+                    frame = frame.f_back
+                if frame is not None:
+                    continue
+                self.samples += 1
+                if any(code.co_filename == __file__ for code in stack):
+                    self.busy += 1
+                    self.stacks[tuple(reversed(stack))] += 1
+
+    def run_profiled(self, function, args, kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            self.skipped += 1
+            return function(*args, **kwargs)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self.lock:
+                self.profiles.append(profile)
+
+    def elapsed(self):
+        return (self.stopped or time.time()) - self.started
+
+    def sample_report(self):
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.stacks.items():
+            self_counts[stack[-1]] += count
+            for code in set(stack):
+                total_counts[code] += count
+
+        busy = self.busy or 1
+        lines = [f"Сэмплирование потоков обработчиков за {self.elapsed():.0f} с: {self.samples} сэмплов "
+                 f"с {self.threads} рабочих потоков, в обработчиках {self.busy} "
+                 f"({self.busy * 100 / (self.samples or 1):.0f}% сэмплов рабочих потоков, без /profile)", "",
+                 "Собственное время (% занятых сэмплов):"]
+        lines += [f"{count * 100 / busy:6.1f}%  {profile_label(code)}"
+                  for code, count in self_counts.most_common(PROFILE_REPORT_LINES)]
+        lines += ["", "Включая вложенные вызовы:"]
+        lines += [f"{count * 100 / busy:6.1f}%  {profile_label(code)}"
+                  for code, count in total_counts.most_common(PROFILE_REPORT_LINES)]
+        return "\n".join(lines)
+
+    def collapsed_stacks(self):
+        return "\n".join(";".join(profile_label(code) for code in stack) + f" {count}"
+                         for stack, count in self.stacks.most_common()) + "\n"
+
+    def cprofile_report(self):
+        with self.lock:
+            profiles = list(self.profiles)
+        header = f"cProfile обработчиков за {self.elapsed():.0f} с: {len(profiles)} вызовов"
+        if self.skipped:
+            header += f", без профилирования (параллельно): {self.skipped}"
+        if not profiles:
+            return header
+        stream = io.StringIO()
+        stats = pstats.Stats(*profiles, stream=stream)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+        return header + "\n" + stream.getvalue().strip()
+
+    def report(self):
+        return self.sample_report() if self.mode == "sample" else self.cprofile_report()
+
+
+class Profiler:
+    def __init__(self):
+        self.session = None
+        self.lock = threading.Lock()
+
+    def start(self, chat_id, mode, seconds):
+        with self.lock:
+            if self.session is not None:
+                return None
+            session = self.session = ProfileSession(chat_id, mode, seconds)
+        session.start(self.finish)
+        return session
+
+    def stop(self, session=None):
+        with self.lock:
+            if self.session is None or (session is not None and self.session is not session):
+                return None
+            session, self.session = self.session, None
+        session.stop()
+        return session
+
+    def finish(self, session):
+        if self.stop(session) is not None:
+            send_profile_report(session)
+
+
+profiler = Profiler()
+
+
+def send_profile_report(session):
+    try:
+        report = session.report()
+        lines = report.splitlines()
+        text = "\n".join(lines[:PROFILE_MESSAGE_LINES + 3])
+        if len(lines) > PROFILE_MESSAGE_LINES + 3:
+            text += "\n..."
+        bot.send_message(session.chat_id, "⏱ " + text[:3900])
+
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(session.started))
+        document = io.BytesIO(report.encode("utf-8"))
+        document.name = f"profile_{session.mode}_{stamp}.txt"
+        bot.send_document(session.chat_id, document, caption="📄 Полный отчет профилирования")
+        if session.mode == "sample" and session.stacks:
+            document = io.BytesIO(session.collapsed_stacks().encode("utf-8"))
+            document.name = f"profile_{stamp}.folded"
+            bot.send_document(session.chat_id, document, caption="🔥 Стеки для flamegraph.pl / speedscope")
+        log_command("Profile", f"{session.mode}, {session.elapsed():.0f}s")
+    except Exception as e:
+        logger.error(f"Failed to send profile report: {e}")
+        try:
+            bot.send_message(session.chat_id, f"❌ Ошибка отчета профилирования: {str(e)}")
+        except:
+            pass
+
+
+OUTBOUND_URGENT = 0
+OUTBOUND_NORMAL = 1
+OUTBOUND_BULK = 2
+OUTBOUND_WORKERS = {OUTBOUND_URGENT: 2, OUTBOUND_NORMAL: 1, OUTBOUND_BULK: 3}
+OUTBOUND_GLOBAL_RATE = 30
+OUTBOUND_GLOBAL_BURST = 30
+OUTBOUND_CHAT_RATE = 1
+OUTBOUND_CHAT_BURST = 5
+OUTBOUND_BULK_RESERVE = 2
+OUTBOUND_RETRIES = 3
+OUTBOUND_SUPERSEDED = "superseded"
+OUTBOUND_LANE_NAMES = {OUTBOUND_URGENT: "urgent", OUTBOUND_NORMAL: "normal", OUTBOUND_BULK: "bulk"}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def delay(self, reserve=0):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1 + reserve:
+            return 0
+        return (1 + reserve - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class OutboundTask:
+    __slots__ = ("function", "args", "kwargs", "chat_id", "lane", "key", "future", "attempts", "created")
+
+    def __init__(self, function, args, kwargs, chat_id, lane, key):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.lane = lane
+        self.key = key
+        self.future = Future()
+        self.attempts = 0
+        self.created = time.perf_counter()
+
+
+class OutboundDispatcher:
+    def __init__(self, workers=OUTBOUND_WORKERS):
+        self.workers = workers
+        self.lanes = {lane: deque() for lane in workers}
+        self.pending = {}
+        self.global_bucket = TokenBucket(OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_BURST)
+        self.chat_buckets = {}
+        self.limited = True
+        self.condition = threading.Condition()
+        self.started = False
+
+    def start(self):
+        self.started = True
+        for lane, count in self.workers.items():
+            for _ in range(count):
+                threading.Thread(target=self.run, args=(lane,), daemon=True).start()
+
+    def submit(self, lane, function, args, kwargs, chat_id=None, key=None):
+        task = OutboundTask(function, args, kwargs, chat_id, lane, key)
+        with self.condition:
+            if not self.started:
+                self.start()
+            previous = self.pending.pop(key, None) if key else None
+            if previous is not None:
+                self.lanes[lane].remove(previous)
+                previous.future.set_result(OUTBOUND_SUPERSEDED)
+            if key:
+                self.pending[key] = task
+            self.lanes[lane].append(task)
+            self.condition.notify_all()
+        return task.future
+
+    def call(self, lane, function, args, kwargs, chat_id=None):
+        return self.submit(lane, function, args, kwargs, chat_id).result()
+
+    def post(self, lane, function, args, kwargs, chat_id=None, key=None):
+        future = self.submit(lane, function, args, kwargs, chat_id, key)
+        future.add_done_callback(log_outbound_failure)
+        return future
+
+    def buckets(self, task):
+        buckets = [self.global_bucket]
+        if task.chat_id is not None and task.lane != OUTBOUND_URGENT:
+            bucket = self.chat_buckets.get(task.chat_id)
+            if bucket is None:
+                bucket = self.chat_buckets[task.chat_id] = TokenBucket(OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST)
+            buckets.append(bucket)
+        return buckets
+
+    def next_task(self, lane):
+        queue = self.lanes[lane]
+        while True:
+            if not queue:
+                self.condition.wait()
+                continue
+            task = queue[0]
+            buckets = self.buckets(task) if self.limited else []
+            reserve = OUTBOUND_BULK_RESERVE if lane == OUTBOUND_BULK else 0
+            delay = max([bucket.delay(reserve if bucket is not self.global_bucket else 0) for bucket in buckets] or [0])
+            if delay > 0:
+                self.condition.wait(delay)
+                continue
+            queue.popleft()
+            if task.key and self.pending.get(task.key) is task:
+                del self.pending[task.key]
+            for bucket in buckets:
+                bucket.take()
+            return task
+
+    def run(self, lane):
+        while True:
+            with self.condition:
+                task = self.next_task(lane)
+            method = task.function.__name__
+            started = time.perf_counter()
+            metrics.observe("telegram_queue_seconds", started - task.created, lane=OUTBOUND_LANE_NAMES[lane])
+            try:
+                result = task.function(*task.args, **task.kwargs)
+                metrics.observe("telegram_request_seconds", time.perf_counter() - started, method=method)
+                task.future.set_result(result)
+            except apihelper.ApiTelegramException as e:
+                metrics.observe("telegram_request_seconds", time.perf_counter() - started, method=method)
+                metrics.inc("telegram_request_errors_total", method=method, code=str(e.error_code))
+                if e.error_code != 429 or task.attempts >= OUTBOUND_RETRIES:
+                    task.future.set_exception(e)
+                    continue
+                metrics.inc("telegram_retries_total", method=method)
+                retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+                with self.condition:
+                    self.buckets(task)[-1].pause(retry_after)
+                    task.attempts += 1
+                    if task.key and task.key in self.pending:
+                        task.future.set_result(OUTBOUND_SUPERSEDED)
+                    else:
+                        if task.key:
+                            self.pending[task.key] = task
+                        self.lanes[lane].appendleft(task)
+                    self.condition.notify_all()
+            except Exception as e:
+                metrics.inc("telegram_request_errors_total", method=method, code=type(e).__name__)
+                task.future.set_exception(e)
+
+
+def log_outbound_failure(future):
+    error = future.exception()
+    if error is None:
+        return
+    if isinstance(error, apihelper.ApiTelegramException) and error.error_code == 400:
+        logger.debug(f"Outbound request rejected: {error}")
+    else:
+        logger.error(f"Outbound request failed: {error}")
+
+
+class QueuedTeleBot(telebot.TeleBot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbound = OutboundDispatcher()
+
+    def add_message_handler(self, handler_dict):
+        handler_dict["function"] = timed_handler(handler_dict["function"])
+        super().add_message_handler(handler_dict)
+
+    def add_callback_query_handler(self, handler_dict):
+        handler_dict["function"] = timed_handler(handler_dict["function"])
+        super().add_callback_query_handler(handler_dict)
+
+    def upload(self, lane, function, chat_id, args, kwargs, field):
+        size = upload_size(args[0] if args else kwargs.get(field))
+        result = self.outbound.call(lane, function, (chat_id,) + args, kwargs, chat_id)
+        metrics.inc("telegram_upload_bytes_total", size, method=function.__name__)
+        return result
+
+    def answer_callback_query(self, *args, **kwargs):
+        return self.outbound.post(OUTBOUND_URGENT, super().answer_callback_query, args, kwargs)
+
+    def send_message(self, chat_id, *args, **kwargs):
+        return self.outbound.call(OUTBOUND_NORMAL, super().send_message, (chat_id,) + args, kwargs, chat_id)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, *args, **kwargs):
+        return self.outbound.post(OUTBOUND_NORMAL, super().edit_message_text, (text, chat_id, message_id) + args,
+                                  kwargs, chat_id, ("edit_message_text", chat_id, message_id))
+
+    def edit_message_caption(self, caption, chat_id=None, message_id=None, *args, **kwargs):
+        return self.outbound.post(OUTBOUND_NORMAL, super().edit_message_caption,
+                                  (caption, chat_id, message_id) + args, kwargs, chat_id,
+                                  ("edit_message_caption", chat_id, message_id))
+
+    def edit_message_reply_markup(self, chat_id=None, message_id=None, *args, **kwargs):
+        return self.outbound.post(OUTBOUND_NORMAL, super().edit_message_reply_markup,
+                                  (chat_id, message_id) + args, kwargs, chat_id,
+                                  ("edit_message_reply_markup", chat_id, message_id))
+
+    def edit_message_media(self, media, chat_id=None, *args, **kwargs):
+        size = upload_size(media)
+        result = self.outbound.call(OUTBOUND_BULK, super().edit_message_media, (media, chat_id) + args, kwargs,
+                                    chat_id)
+        metrics.inc("telegram_upload_bytes_total", size, method="edit_message_media")
+        return result
+
+    def send_document(self, chat_id, *args, **kwargs):
+        return self.upload(OUTBOUND_BULK, super().send_document, chat_id, args, kwargs, "document")
+
+    def send_photo(self, chat_id, *args, **kwargs):
+        return self.upload(OUTBOUND_BULK, super().send_photo, chat_id, args, kwargs, "photo")
+
+
+bot = QueuedTeleBot(config.TOKEN, num_threads=4)
+
+SESSION_TTL = 7 * 24 * 60 * 60
+SESSION_LIMIT = 256
+SESSION_STRIPES = 16
+SESSION_SNAPSHOT_FILE = "sessions.json"
+SESSION_SNAPSHOT_INTERVAL = 30
+
+
+def is_count(value, minimum=0, maximum=None):
+    return type(value) is int and value >= minimum and (maximum is None or value <= maximum)
+
+
+SESSION_FIELD_CHECKS = {
+    "show_system_processes": lambda value: isinstance(value, bool),
+    "process_sort": lambda value: isinstance(value, str) and value in PROCESS_SORT_MODES,
+    "current_directory": lambda value: isinstance(value, str),
+    "file_manager_page": lambda value: is_count(value),
+    "file_manager_sort": lambda value: isinstance(value, str) and value in LISTING_SORT_MODES,
+    "screenshot_format": lambda value: isinstance(value, str) and value in SCREENSHOT_FORMATS,
+    "screenshot_quality": lambda value: is_count(value, 1, 100),
+    "screenshot_max_size": lambda value: is_count(value, 1)
+}
+
+
+class ChatSession:
+    __slots__ = (
+        "chat_id", "lock", "last_access", "path_tokens",
+        "waiting_for_path", "upload_path", "waiting_for_emulation_text", "waiting_for_process_kill",
+        "process_list", "show_system_processes", "process_sort",
+        "current_directory", "file_manager_page", "file_manager_sort",
+        "screenshot_format", "screenshot_quality", "screenshot_max_size",
+        "find_query", "find_results", "find_page", "disk_usage", "macro_recording", "waiting_for_macro_name",
+        "target"
+    )
+    PERSISTENT_FIELDS = (
+        "show_system_processes", "process_sort", "current_directory", "file_manager_page", "file_manager_sort",
+        "screenshot_format", "screenshot_quality", "screenshot_max_size"
+    )
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.lock = threading.RLock()
+        self.last_access = time.time()
+        self.path_tokens = PathTokenRegistry()
+        self.waiting_for_path = None
+        self.upload_path = None
+        self.waiting_for_emulation_text = False
+        self.waiting_for_process_kill = False
+        self.process_list = []
+        self.show_system_processes = False
+        self.process_sort = "memory"
+        self.current_directory = os.path.expanduser("~")
+        self.file_manager_page = 0
+        self.file_manager_sort = "name"
+        self.screenshot_format = SCREENSHOT_FORMAT
+        self.screenshot_quality = SCREENSHOT_QUALITY
+        self.screenshot_max_size = SCREENSHOT_MAX_SIZE
+        self.find_query = None
+        self.find_results = []
+        self.find_page = 0
+        self.disk_usage = None
+        self.macro_recording = None
+        self.waiting_for_macro_name = None
+        self.target = None
+
+    def consume(self, field, empty=None):
+        with self.lock:
+            value = getattr(self, field)
+            setattr(self, field, empty)
+            return value
+
+    def snapshot(self):
+        data = {field: getattr(self, field) for field in self.PERSISTENT_FIELDS}
+        data["last_access"] = self.last_access
+        return data
+
+    def restore(self, data):
+        for field in self.PERSISTENT_FIELDS:
+            if field in data and SESSION_FIELD_CHECKS[field](data[field]):
+                setattr(self, field, data[field])
+        if not os.path.isdir(self.current_directory):
+            self.current_directory = os.path.expanduser("~")
+            self.file_manager_page = 0
+
+
+class SessionStore:
+    def __init__(self, stripes=SESSION_STRIPES, limit=SESSION_LIMIT, ttl=SESSION_TTL,
+                 snapshot_path=SESSION_SNAPSHOT_FILE):
+        self.stripes = [(threading.Lock(), OrderedDict()) for _ in range(stripes)]
+        self.stripe_limit = max(1, limit // stripes)
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.saved = None
+        self.pending = {}
+        self.started = False
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        with self.start_lock:
+            if self.started:
+                return
+            self.started = True
+            if self.snapshot_path:
+                self.load()
+                threading.Thread(target=self.save_forever, daemon=True).start()
+                atexit.register(self.save)
+
+    def load(self):
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict):
+            return
+        now = time.time()
+        self.pending = {key: value for key, value in data.items()
+                        if isinstance(value, dict) and isinstance(value.get("last_access"), (int, float))
+                        and now - value["last_access"] <= self.ttl}
+
+    def save(self):
+        data = dict(self.pending)
+        for lock, sessions in self.stripes:
+            with lock:
+                for chat_id, session in sessions.items():
+                    data[str(chat_id)] = session.snapshot()
+        serialized = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        if serialized == self.saved:
+            return
+        temp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(serialized)
+            os.replace(temp_path, self.snapshot_path)
+            self.saved = serialized
+        except OSError as e:
+            logger.error(f"Failed to save sessions: {e}")
+
+    def save_forever(self):
+        while True:
+            time.sleep(SESSION_SNAPSHOT_INTERVAL)
+            self.save()
+
+    def get(self, chat_id):
+        if not self.started:
+            self.start()
+        lock, sessions = self.stripes[hash(chat_id) % len(self.stripes)]
+        now = time.time()
+        with lock:
+            session = sessions.get(chat_id)
+            if session is not None and now - session.last_access > self.ttl:
+                del sessions[chat_id]
+                session = None
+            if session is None:
+                session = ChatSession(chat_id)
+                saved = self.pending.pop(str(chat_id), None)
+                if saved:
+                    session.restore(saved)
+                sessions[chat_id] = session
+                while len(sessions) > self.stripe_limit:
+                    sessions.popitem(last=False)
+            else:
+                sessions.move_to_end(chat_id)
+            session.last_access = now
+            return session
+
+
+sessions = SessionStore()
+
+
+def get_session(chat_id):
+    return sessions.get(chat_id)
+
+TRANSFER_LIMIT = 49 * 1024 * 1024
+ARCHIVE_WORKERS = os.cpu_count() or 2
+ARCHIVE_COMPRESS_LEVEL = 6
+ARCHIVE_PREFETCH_BYTES = 2 * TRANSFER_LIMIT
+ARCHIVE_MAX_ENTRIES = 65535
+ARCHIVE_STORED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic",
+    ".zip", ".rar", ".7z", ".gz", ".bz2", ".xz", ".cab",
+    ".mp4", ".mkv", ".avi", ".mov", ".webm", ".mp3", ".aac", ".ogg", ".flac",
+    ".docx", ".xlsx", ".pptx", ".pdf", ".jar", ".apk"
 }
+ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+ZIP_CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+ZIP_END_RECORD = struct.Struct("<4s4H2LH")
+ZIP_UTF8_FLAG = 0x800
+
+LISTING_CACHE_MAX_ENTRIES = 200000
+LISTING_SORT_MODES = {"name": "имя", "size": "размер", "mtime": "дата"}
+
+
+class DirectoryListingCache:
+    def __init__(self, max_entries=LISTING_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.listings = OrderedDict()
+        self.total_entries = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def scan(path):
+        entries = []
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                try:
+                    is_dir = entry.is_dir()
+                    stat = entry.stat()
+                    entries.append((entry.name, is_dir, 0 if is_dir else stat.st_size, stat.st_mtime))
+                except OSError:
+                    entries.append((entry.name, False, 0, 0))
+        return entries
+
+    @staticmethod
+    def sort_key(sort):
+        if sort == "size":
+            return lambda item: (not item[1], -item[2], item[0].lower())
+        if sort == "mtime":
+            return lambda item: (not item[1], -item[3], item[0].lower())
+        return lambda item: (not item[1], item[0].lower())
+
+    def view(self, listing, sort):
+        entries = listing["views"].get(sort)
+        if entries is None:
+            entries = sorted(listing["entries"], key=self.sort_key(sort))
+            listing["views"][sort] = entries
+        return entries
+
+    def get(self, path, sort="name"):
+        key = os.path.normcase(os.path.abspath(path))
+        mtime_ns = os.stat(path).st_mtime_ns
+
+        with self.lock:
+            listing = self.listings.get(key)
+            if listing is not None and listing["mtime_ns"] == mtime_ns:
+                self.listings.move_to_end(key)
+                return self.view(listing, sort)
+
+        entries = self.scan(path)
+
+        with self.lock:
+            previous = self.listings.pop(key, None)
+            if previous is not None:
+                self.total_entries -= len(previous["entries"])
+            listing = {"mtime_ns": mtime_ns, "entries": entries, "views": {}}
+            self.listings[key] = listing
+            self.total_entries += len(entries)
+            while self.total_entries > self.max_entries and len(self.listings) > 1:
+                _, evicted = self.listings.popitem(last=False)
+                self.total_entries -= len(evicted["entries"])
+            return self.view(listing, sort)
+
+    def page(self, path, page, items_per_page, sort="name"):
+        entries = self.get(path, sort)
+        return entries[page * items_per_page:(page + 1) * items_per_page], len(entries)
+
+    def invalidate(self, path):
+        key = os.path.normcase(os.path.abspath(path))
+        with self.lock:
+            listing = self.listings.pop(key, None)
+            if listing is not None:
+                self.total_entries -= len(listing["entries"])
+
+
+listing_cache = DirectoryListingCache()
+
+PATH_TOKEN_LIMIT = 4096
+BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def to_base36(number):
+    if number == 0:
+        return "0"
+    digits = []
+    while number:
+        number, remainder = divmod(number, 36)
+        digits.append(BASE36_DIGITS[remainder])
+    return "".join(reversed(digits))
+
+
+PATH_TOKEN_EPOCH = to_base36(int.from_bytes(os.urandom(4), "big"))
+
+
+class PathTokenRegistry:
+    def __init__(self, limit=PATH_TOKEN_LIMIT, epoch=PATH_TOKEN_EPOCH):
+        self.limit = limit
+        self.epoch = epoch
+        self.paths = OrderedDict()
+        self.tokens = {}
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def token(self, path):
+        with self.lock:
+            token = self.tokens.get(path)
+            if token is not None:
+                self.paths.move_to_end(token)
+                return token
+            self.counter += 1
+            token = f"{self.epoch}.{to_base36(self.counter)}"
+            self.paths[token] = path
+            self.tokens[path] = token
+            if len(self.paths) > self.limit:
+                _, evicted = self.paths.popitem(last=False)
+                del self.tokens[evicted]
+            return token
+
+    def resolve(self, token):
+        if token.partition(".")[0] != self.epoch:
+            return None
+        with self.lock:
+            path = self.paths.get(token)
+            if path is not None:
+                self.paths.move_to_end(token)
+            return path
+
+
+def path_token(chat_id, path):
+    return get_session(chat_id).path_tokens.token(path)
+
+
+def resolve_path_token(chat_id, token):
+    return get_session(chat_id).path_tokens.resolve(token)
+
+
+LOG_FILE = "command_log.txt"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 5
+LOG_FLUSH_INTERVAL = 1.0
+LOG_FLUSH_RECORDS = 100
+LOG_QUERY_LIMIT = 20
+LOG_QUERY_MAX = 500
+LOG_INDEX_RECORD = struct.Struct("<dQ")
+LOG_RECORD_PATTERN = re.compile(rb"^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] Command: ", re.M)
+
+
+def log_paths(generation=0):
+    base, ext = os.path.splitext(LOG_FILE)
+    if generation:
+        base = f"{base}.{generation}"
+    return base + ext, base + ".idx"
+
+
+def format_log_record(timestamp, command, output):
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+    return f"[{stamp}] Command: {command}\nOutput: {output}\n\n".encode("utf-8")
+
+
+def rebuild_log_index(log_path, index_path):
+    entries = []
+    with open(log_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for match in LOG_RECORD_PATTERN.finditer(mm):
+                    timestamp = time.mktime(time.strptime(match.group(1).decode(), "%Y-%m-%d %H:%M:%S"))
+                    entries.append(LOG_INDEX_RECORD.pack(timestamp, match.start()))
+    with open(index_path, 'wb') as f:
+        f.write(b"".join(entries))
+
+
+def load_log_index(index_path):
+    try:
+        with open(index_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return [], []
+    timestamps = []
+    offsets = []
+    for timestamp, offset in LOG_INDEX_RECORD.iter_unpack(data[:len(data) - len(data) % LOG_INDEX_RECORD.size]):
+        timestamps.append(timestamp)
+        offsets.append(offset)
+    return timestamps, offsets
+
+
+def rotate_log():
+    for generation in range(LOG_BACKUPS, 0, -1):
+        for source, target in zip(log_paths(generation - 1), log_paths(generation)):
+            if os.path.exists(source):
+                os.replace(source, target)
+    for path in log_paths():
+        open(path, 'ab').close()
+
+
+class CommandLogWriter:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            log_path, index_path = log_paths()
+            if os.path.exists(log_path) and not os.path.exists(index_path):
+                try:
+                    rebuild_log_index(log_path, index_path)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Failed to rebuild command log index: {e}")
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+            atexit.register(self.flush)
+
+    def log(self, command, output):
+        self.start()
+        self.queue.put((time.time(), command, output))
+
+    def flush(self, timeout=5):
+        if self.thread is None:
+            return
+        event = threading.Event()
+        self.queue.put(event)
+        event.wait(timeout)
+
+    def run(self):
+        pending = []
+        events = []
+        deadline = 0
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0, deadline - time.monotonic()) if pending else None)
+                if isinstance(item, threading.Event):
+                    events.append(item)
+                else:
+                    if not pending:
+                        deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+                    pending.append(item)
+                    if len(pending) < LOG_FLUSH_RECORDS:
+                        continue
+            except queue.Empty:
+                pass
+
+            if pending:
+                try:
+                    self.write(pending)
+                except OSError as e:
+                    logger.error(f"Failed to write command log: {e}")
+                pending = []
+            for event in events:
+                event.set()
+            events = []
+
+    @staticmethod
+    def write(records):
+        log_path, index_path = log_paths()
+        with open(log_path, 'ab') as log_file, open(index_path, 'ab') as index_file:
+            offset = log_file.tell()
+            chunks = []
+            entries = []
+            for timestamp, command, output in records:
+                data = format_log_record(timestamp, command, output)
+                chunks.append(data)
+                entries.append(LOG_INDEX_RECORD.pack(timestamp, offset))
+                offset += len(data)
+            log_file.write(b"".join(chunks))
+            index_file.write(b"".join(entries))
+
+        if offset >= LOG_MAX_BYTES:
+            rotate_log()
+
+
+command_log = CommandLogWriter()
 
 
 def log_command(command, output):
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    with open("command_log.txt", "a", encoding="utf-8") as f:
-        f.write(f"[{timestamp}] Command: {command}\n")
-        f.write(f"Output: {output}\n\n")
+    command_log.log(command, output)
+
+
+def query_command_log(start=None, end=None, command_type=None, text=None, limit=LOG_QUERY_LIMIT):
+    command_log.flush()
+    matches = []
+    command_type = command_type.lower() if command_type else None
+    text = text.lower() if text else None
+
+    for generation in range(LOG_BACKUPS + 1):
+        log_path, index_path = log_paths(generation)
+        timestamps, offsets = load_log_index(index_path)
+        if not offsets or not os.path.exists(log_path):
+            continue
+
+        low = bisect.bisect_left(timestamps, start) if start is not None else 0
+        high = bisect.bisect_right(timestamps, end) if end is not None else len(timestamps)
+
+        with open(log_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size and low < high:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for i in range(high - 1, low - 1, -1):
+                        record_end = min(offsets[i + 1] if i + 1 < len(offsets) else size, size)
+                        record = mm[offsets[i]:record_end].decode("utf-8", errors="replace").rstrip()
+                        if command_type:
+                            command = record.split("\n", 1)[0].partition("] Command: ")[2]
+                            if command_type not in command.lower():
+                                continue
+                        if text and text not in record.lower():
+                            continue
+                        matches.append(record)
+                        if len(matches) >= limit:
+                            return list(reversed(matches))
+
+        if low > 0:
+            break
+
+    return list(reversed(matches))
+
+
+def parse_log_time(value, end_of_range=False):
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            parsed = time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            continue
+        if end_of_range:
+            parsed += 86399 if fmt == "%Y-%m-%d" else 59 if fmt == "%Y-%m-%dT%H:%M" else 0
+        return parsed
+    raise ValueError(f"Неверный формат даты: {value}")
+
+
+def parse_log_query(args):
+    query = {"limit": LOG_QUERY_LIMIT}
+    words = []
+    for arg in args.split():
+        key, separator, value = arg.partition(":")
+        if arg.isdigit():
+            query["limit"] = min(max(int(arg), 1), LOG_QUERY_MAX)
+        elif separator and key == "type":
+            query["command_type"] = value.replace("_", " ")
+        elif separator and key == "from":
+            query["start"] = parse_log_time(value)
+        elif separator and key == "to":
+            query["end"] = parse_log_time(value, end_of_range=True)
+        else:
+            words.append(arg)
+    if words:
+        query["text"] = " ".join(words)
+    return query
+
+
+def send_log_query(chat_id, args):
+    if args.strip() == "file":
+        command_log.flush()
+        send_path_document(chat_id, LOG_FILE, caption="📝 Лог команд")
+        return
+
+    records = query_command_log(**parse_log_query(args))
+    if not records:
+        bot.send_message(chat_id, "📝 Записи не найдены")
+        return
+
+    result = "\n\n".join(records)
+    if len(result) > 4000:
+        bot.send_document(chat_id, io.BytesIO(result.encode("utf-8")), caption=f"📝 Найдено записей: {len(records)}",
+                          visible_file_name="command_log_query.txt")
+    else:
+        bot.send_message(chat_id, f"📝 Найдено записей: {len(records)}\n\n{result}")
+
+
+NOTIFY_WINDOW = 1.0
+NOTIFY_MAX_PENDING = 100
+NOTIFY_SUMMARY_LINES = 3
+
+
+class NotificationQueue:
+    def __init__(self, backend=None, window=NOTIFY_WINDOW, max_pending=NOTIFY_MAX_PENDING):
+        self.backend = backend
+        self.window = window
+        self.pending = deque(maxlen=max_pending)
+        self.dropped = 0
+        self.shown = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def notify(self, command):
+        with self.condition:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(command)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def take_batch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+        time.sleep(self.window)
+        with self.condition:
+            batch = list(self.pending)
+            total = len(batch) + self.dropped
+            self.pending.clear()
+            self.dropped = 0
+        return batch, total
+
+    @staticmethod
+    def summarize(batch, total):
+        if total == 1:
+            return f"Executed command:\n{batch[0]}"
+        lines = batch[-NOTIFY_SUMMARY_LINES:]
+        if total > len(lines):
+            lines = ["..."] + lines
+        return f"{total} commands executed:\n" + "\n".join(lines)
+
+    def run(self):
+        while True:
+            batch, total = self.take_batch()
+            try:
+                (self.backend or backends.notifications).show("ControlPCbotV2", self.summarize(batch, total))
+                self.shown += 1
+            except Exception as e:
+                logger.error(f"Notification failed: {e}")
+
+
+notifications = NotificationQueue()
 
 
 def show_notification(command):
-    toaster.show_toast("ControlPCbotV2", f"Executed command:\n{command}", duration=5, threaded=True)
+    notifications.notify(command)
 
 
 def get_drives():
@@ -51,13 +1458,72 @@ def get_drives():
     return drives
 
 
+KEYBOARD_CACHE_SIZE = 512
+KEYBOARD_TOKEN_PREFIXES = ("folder_", "file_")
+
+
+class KeyboardCache:
+    def __init__(self, size=KEYBOARD_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build, chat_id=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is not None:
+            markup, tokens = entry
+            if all(path_token(chat_id, path) == token for path, token in tokens):
+                self.hits += 1
+                return markup
+
+        keyboard = build()
+        tokens = []
+        if chat_id is not None:
+            for row in keyboard.keyboard:
+                for button in row:
+                    data = button.callback_data or ""
+                    for prefix in KEYBOARD_TOKEN_PREFIXES:
+                        if data.startswith(prefix):
+                            path = resolve_path_token(chat_id, data[len(prefix):])
+                            if path is not None:
+                                tokens.append((path, data[len(prefix):]))
+        markup = keyboard.to_json()
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = (markup, tokens)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return markup
+
+
+keyboard_cache = KeyboardCache()
+
+
+def cached_keyboard(build):
+    def create(*args):
+        return keyboard_cache.get((build.__name__,) + args, lambda: build(*args))
+    return create
+
+
 def create_main_menu():
+    return create_main_menu_keyboard(check_autostart())
+
+
+@cached_keyboard
+def create_main_menu_keyboard(autostart_enabled):
     keyboard = InlineKeyboardMarkup(row_width=2)
-    autostart_status = "✅ Автозапуск" if check_autostart() else "❌ Автозапуск"
+    autostart_status = "✅ Автозапуск" if autostart_enabled else "❌ Автозапуск"
     buttons = [
         InlineKeyboardButton("🖥️ Выключить ПК", callback_data="shutdown"),
         InlineKeyboardButton("🔄 Перезагрузить ПК", callback_data="reboot"),
         InlineKeyboardButton("📸 Скриншот", callback_data="screenshot"),
+        InlineKeyboardButton("👁 Наблюдение", callback_data="watch_start"),
         InlineKeyboardButton("📁 Управление файлами", callback_data="file_manager"),
         InlineKeyboardButton("❌ Завершить процесс", callback_data="kill_menu"),
         InlineKeyboardButton("🔊 Управление громкостью", callback_data="volume_control"),
@@ -70,15 +1536,17 @@ def create_main_menu():
     return keyboard
 
 
-def create_file_manager_keyboard(current_path=None):
-    keyboard = InlineKeyboardMarkup()
+def create_file_manager_keyboard(chat_id):
+    drives = tuple(get_drives())
+    return keyboard_cache.get(("file_manager", chat_id, drives),
+                              lambda: build_file_manager_keyboard(chat_id, drives), chat_id)
+
 
-    if current_path is None:
-        current_path = user_state["current_directory"]
+def build_file_manager_keyboard(chat_id, drives):
+    keyboard = InlineKeyboardMarkup()
 
-    drives = get_drives()
     for drive in drives:
-        keyboard.add(InlineKeyboardButton(f"💾 Диск {drive}", callback_data=f"folder_{drive}"))
+        keyboard.add(InlineKeyboardButton(f"💾 Диск {drive}", callback_data=f"folder_{path_token(chat_id, drive)}"))
 
     keyboard.add(InlineKeyboardButton("📤 Загрузить файл сюда", callback_data="upload_here"))
     keyboard.add(InlineKeyboardButton("📥 Извлечь файл", callback_data="get_file_here"))
@@ -88,27 +1556,34 @@ def create_file_manager_keyboard(current_path=None):
     return keyboard
 
 
-def create_directory_keyboard(path):
+def create_directory_keyboard(chat_id, path):
+    session = get_session(chat_id)
+    page = session.file_manager_page
+    sort = session.file_manager_sort
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    return keyboard_cache.get(("directory", chat_id, path, mtime_ns, page, sort),
+                              lambda: build_directory_keyboard(chat_id, path, page, sort), chat_id)
+
+
+def build_directory_keyboard(chat_id, path, page, sort):
     keyboard = InlineKeyboardMarkup()
-    page = user_state["file_manager_page"]
     items_per_page = 30
 
     try:
-        items = os.listdir(path)
-        total_items = len(items)
+        items, total_items = listing_cache.page(path, page, items_per_page, sort)
         total_pages = (total_items + items_per_page - 1) // items_per_page
 
-        start_index = page * items_per_page
-        end_index = min((page + 1) * items_per_page, total_items)
-
-        for i in range(start_index, end_index):
-            item = items[i]
+        for item, is_dir, size, mtime in items:
             full_path = os.path.join(path, item)
-            if os.path.isdir(full_path):
-                keyboard.add(InlineKeyboardButton(f"📁 {item}", callback_data=f"folder_{full_path}"))
+            if is_dir:
+                keyboard.add(InlineKeyboardButton(f"📁 {item}",
+                                                  callback_data=f"folder_{path_token(chat_id, full_path)}"))
             else:
-                size = os.path.getsize(full_path) // 1024
-                keyboard.add(InlineKeyboardButton(f"📄 {item} ({size} KB)", callback_data=f"file_{full_path}"))
+                keyboard.add(InlineKeyboardButton(f"📄 {item} ({size // 1024} KB)",
+                                                  callback_data=f"file_{path_token(chat_id, full_path)}"))
 
         navigation_buttons = []
         if page > 0:
@@ -119,12 +1594,16 @@ def create_directory_keyboard(path):
         if navigation_buttons:
             keyboard.row(*navigation_buttons)
 
+        keyboard.add(InlineKeyboardButton(f"🔃 Сортировка: {LISTING_SORT_MODES[sort]}",
+                                          callback_data="file_manager_sort"))
+
         parent_dir = os.path.dirname(path)
         if parent_dir and os.path.exists(parent_dir) and parent_dir != path:
-            keyboard.add(InlineKeyboardButton("⬆️ Выше", callback_data=f"folder_{parent_dir}"))
+            keyboard.add(InlineKeyboardButton("⬆️ Выше", callback_data=f"folder_{path_token(chat_id, parent_dir)}"))
 
         keyboard.add(InlineKeyboardButton("📤 Загрузить файл сюда", callback_data="upload_here"))
         keyboard.add(InlineKeyboardButton("📦 Скачать папку архивом", callback_data="archive_folder"))
+        keyboard.add(InlineKeyboardButton("📊 Размер", callback_data="disk_usage"))
         keyboard.add(InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu"))
 
     except Exception as e:
@@ -134,6 +1613,7 @@ def create_directory_keyboard(path):
     return keyboard
 
 
+@cached_keyboard
 def create_volume_keyboard():
     keyboard = InlineKeyboardMarkup()
     keyboard.add(InlineKeyboardButton("🔇 Mute", callback_data="volume_mute"))
@@ -143,15 +1623,18 @@ def create_volume_keyboard():
     return keyboard
 
 
+@cached_keyboard
 def create_key_emulation_keyboard():
     keyboard = InlineKeyboardMarkup()
     keyboard.add(InlineKeyboardButton("Ввести текст", callback_data="emulate_text"))
     keyboard.add(InlineKeyboardButton("Специальные клавиши", callback_data="special_keys"))
     keyboard.add(InlineKeyboardButton("Сочетания клавиш", callback_data="key_combinations"))
+    keyboard.add(InlineKeyboardButton("📼 Макросы", callback_data="macro_menu"))
     keyboard.add(InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu"))
     return keyboard
 
 
+@cached_keyboard
 def create_special_keys_keyboard():
     keyboard = InlineKeyboardMarkup(row_width=3)
     keys = [
@@ -164,6 +1647,7 @@ def create_special_keys_keyboard():
     return keyboard
 
 
+@cached_keyboard
 def create_key_combinations_keyboard():
     keyboard = InlineKeyboardMarkup(row_width=2)
     combinations = {
@@ -188,6 +1672,7 @@ def create_key_combinations_keyboard():
     return keyboard
 
 
+@cached_keyboard
 def create_mouse_emulation_keyboard():
     keyboard = InlineKeyboardMarkup(row_width=3)
 
@@ -220,35 +1705,127 @@ def create_mouse_emulation_keyboard():
         InlineKeyboardButton("Скролл ▼", callback_data="mouse_scroll_down")
     )
 
+    keyboard.add(InlineKeyboardButton("🎯 Прицел по сетке", callback_data="mouse_target"))
+
     keyboard.add(InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu"))
     return keyboard
 
 
-def create_process_list_message():
-    processes = []
-    for proc in psutil.process_iter(['pid', 'name', 'memory_info']):
+PROCESS_SAMPLE_INTERVAL = 2
+PROCESS_SAMPLER_IDLE = 5 * 60
+PROCESS_LIST_SIZE = 20
+PROCESS_SORT_MODES = {"memory": "память", "cpu": "CPU", "io": "диск"}
+PROCESS_SORT_KEYS = {
+    "memory": lambda entry: entry.rss,
+    "cpu": lambda entry: entry.cpu,
+    "io": lambda entry: entry.io_rate
+}
+
+
+class ProcessEntry:
+    __slots__ = ("process", "pid", "name", "create_time", "rss", "cpu", "io_total", "io_rate")
+
+    def __init__(self, process):
+        self.process = process
+        self.pid = process.pid
+        try:
+            self.name = process.name()
+        except psutil.Error:
+            self.name = "?"
         try:
-            if not user_state["show_system_processes"] and proc.pid < 1000:
+            self.create_time = process.create_time()
+        except psutil.Error:
+            self.create_time = None
+        self.rss = 0
+        self.cpu = 0.0
+        self.io_total = None
+        self.io_rate = 0.0
+
+
+class ProcessSampler:
+    def __init__(self, interval=PROCESS_SAMPLE_INTERVAL, idle_timeout=PROCESS_SAMPLER_IDLE):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.entries = {}
+        self.sampled_at = 0
+        self.last_request = 0
+        self.thread = None
+        self.lock = threading.Lock()
+        self.cpu_count = os.cpu_count() or 1
+
+    def sample(self):
+        now = time.monotonic()
+        elapsed = now - self.sampled_at if self.sampled_at else 0
+        entries = {}
+        for pid in psutil.pids():
+            entry = self.entries.get(pid)
+            try:
+                if entry is None or not entry.process.is_running():
+                    entry = ProcessEntry(psutil.Process(pid))
+                with entry.process.oneshot():
+                    entry.rss = entry.process.memory_info().rss
+                    entry.cpu = entry.process.cpu_percent(None) / self.cpu_count
+                    try:
+                        counters = entry.process.io_counters()
+                        io_total = counters.read_bytes + counters.write_bytes
+                    except (psutil.AccessDenied, AttributeError):
+                        io_total = None
+                if io_total is not None and entry.io_total is not None and elapsed:
+                    entry.io_rate = (io_total - entry.io_total) / elapsed
+                entry.io_total = io_total
+            except psutil.NoSuchProcess:
                 continue
-            processes.append(proc)
-        except (psutil.NoSuchProcess, psutil.AccessDenied):
-            continue
+            except psutil.AccessDenied:
+                if entry is None:
+                    continue
+            entries[pid] = entry
+        self.entries = entries
+        self.sampled_at = now
+
+    def run(self):
+        while time.monotonic() - self.last_request < self.idle_timeout:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Process sampling failed: {e}")
+        with self.lock:
+            self.thread = None
+
+    def ensure_running(self):
+        self.last_request = time.monotonic()
+        with self.lock:
+            if not self.entries or time.monotonic() - self.sampled_at > 2 * self.interval:
+                self.sample()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def top(self, count=PROCESS_LIST_SIZE, sort="memory", include_system=False):
+        self.ensure_running()
+        entries = self.entries.values()
+        if not include_system:
+            entries = (entry for entry in entries if entry.pid >= 1000)
+        return heapq.nlargest(count, entries, key=PROCESS_SORT_KEYS[sort])
+
+
+process_sampler = ProcessSampler()
+
+
+def create_process_list_message(session):
+    processes = process_sampler.top(PROCESS_LIST_SIZE, session.process_sort, session.show_system_processes)
 
     if not processes:
         return "❌ Процессы не найдены", []
 
-    processes.sort(key=lambda x: x.info['memory_info'].rss if x.info['memory_info'] else 0, reverse=True)
-
-    result = "📋 Список процессов:\n\n"
+    result = f"📋 Список процессов (сортировка: {PROCESS_SORT_MODES[session.process_sort]}):\n\n"
     process_list = []
 
-    for i, proc in enumerate(processes[:20], 1):
-        try:
-            memory_mb = proc.info['memory_info'].rss // 1024 // 1024 if proc.info['memory_info'] else 0
-            result += f"{i}. {proc.info['name']} (PID: {proc.pid}) - {memory_mb} MB\n"
-            process_list.append(proc.pid)
-        except:
-            continue
+    for i, entry in enumerate(processes, 1):
+        memory_mb = entry.rss // 1024 // 1024
+        result += f"{i}. {entry.name} (PID: {entry.pid}) - {memory_mb} MB, CPU {entry.cpu:.1f}%, " \
+                  f"диск {entry.io_rate / 1024:.0f} KB/s\n"
+        process_list.append((entry.pid, entry.create_time))
 
     result += f"\n📊 Всего процессов: {len(process_list)}"
     result += "\n\n💡 Введите номер процесса для завершения:"
@@ -256,139 +1833,2458 @@ def create_process_list_message():
     return result, process_list
 
 
-def create_zip_archive(folder_path, zip_path):
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, folder_path)
-                zipf.write(file_path, arcname)
+def create_process_keyboard(session):
+    return create_process_sort_keyboard(session.show_system_processes, session.process_sort)
 
 
-def enable_autostart():
-    try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        bat_path = os.path.join(script_dir, "start.bat")
+@cached_keyboard
+def create_process_sort_keyboard(show_system_processes, sort):
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton("🔄 Обновить список", callback_data="kill_menu"))
+    system_text = "✅ Системные" if show_system_processes else "❌ Системные"
+    keyboard.add(InlineKeyboardButton(f"{system_text} процессы", callback_data="toggle_system"))
+    keyboard.add(InlineKeyboardButton(f"🔃 Сортировка: {PROCESS_SORT_MODES[sort]}", callback_data="process_sort"))
+    keyboard.add(InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu"))
+    return keyboard
 
-        key_path = r"Software\Microsoft\Windows\CurrentVersion\Run"
 
-        with winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_path, 0, winreg.KEY_SET_VALUE) as key:
-            winreg.SetValueEx(key, "ControlPCbotV2", 0, winreg.REG_SZ, f'"{bat_path}"')
+def walk_archive_files(folder_path):
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            try:
+                size = os.path.getsize(file_path)
+            except OSError:
+                continue
+            yield file_path, os.path.relpath(file_path, folder_path).replace(os.sep, "/"), size
 
-        return True
-    except Exception as e:
-        return False
 
+def dos_timestamp(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    year = min(t.tm_year, 2107) - 1980
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), (year << 9) | (t.tm_mon << 5) | t.tm_mday
 
-def disable_autostart():
+
+def compress_archive_entry(file_path, arcname):
     try:
-        key_path = r"Software\Microsoft\Windows\CurrentVersion\Run"
+        with open(file_path, 'rb') as f:
+            data = f.read()
+            mtime = os.fstat(f.fileno()).st_mtime
+    except OSError:
+        return None
+    method, payload = zipfile.ZIP_STORED, data
+    if os.path.splitext(file_path)[1].lower() not in ARCHIVE_STORED_EXTENSIONS:
+        compressor = zlib.compressobj(ARCHIVE_COMPRESS_LEVEL, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < len(data):
+            method, payload = zipfile.ZIP_DEFLATED, compressed
+    return arcname.encode("utf-8"), method, zlib.crc32(data), len(data), payload, dos_timestamp(mtime)
+
+
+def archive_entry_size(entry):
+    return ZIP_LOCAL_HEADER.size + ZIP_CENTRAL_HEADER.size + 2 * len(entry[0]) + len(entry[4])
+
+
+def write_archive_volume(entries, zip_path):
+    central = []
+    offset = 0
+    with open(zip_path, 'wb') as f:
+        for name, method, crc, size, payload, (dos_time, dos_date) in entries:
+            f.write(ZIP_LOCAL_HEADER.pack(b"PK\x03\x04", 20, ZIP_UTF8_FLAG, method, dos_time, dos_date, crc,
+                                          len(payload), size, len(name), 0) + name)
+            f.write(payload)
+            central.append(ZIP_CENTRAL_HEADER.pack(b"PK\x01\x02", 20, 20, ZIP_UTF8_FLAG, method, dos_time, dos_date,
+                                                   crc, len(payload), size, len(name), 0, 0, 0, 0, 0, offset) + name)
+            offset += ZIP_LOCAL_HEADER.size + len(name) + len(payload)
+        directory = b"".join(central)
+        f.write(directory)
+        f.write(ZIP_END_RECORD.pack(b"PK\x05\x06", 0, 0, len(entries), len(entries), len(directory), offset, 0))
+    return zip_path
+
+
+def write_large_archive_volume(file_path, arcname, zip_path):
+    if os.path.splitext(file_path)[1].lower() in ARCHIVE_STORED_EXTENSIONS:
+        compress_type = zipfile.ZIP_STORED
+    else:
+        compress_type = zipfile.ZIP_DEFLATED
+    try:
+        with zipfile.ZipFile(zip_path, 'w', compress_type, compresslevel=ARCHIVE_COMPRESS_LEVEL) as zipf:
+            zipf.write(file_path, arcname)
+    except OSError:
+        if os.path.exists(zip_path):
+            os.unlink(zip_path)
+        return None
+    return zip_path
+
+
+def iter_archive_volumes(folder_path, output_dir, volume_size=TRANSFER_LIMIT, workers=ARCHIVE_WORKERS):
+    base_name = os.path.basename(os.path.normpath(folder_path)) or "archive"
+    files = walk_archive_files(folder_path)
+    pending = deque()
+    pending_bytes = 0
+    volume = []
+    volume_bytes = ZIP_END_RECORD.size
+    ready = []
+    index = 0
+    names = itertools.count()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            while files is not None and (len(pending) < workers or pending_bytes < ARCHIVE_PREFETCH_BYTES):
+                item = next(files, None)
+                if item is None:
+                    files = None
+                    break
+                file_path, arcname, size = item
+                if size >= volume_size:
+                    temp_path = os.path.join(output_dir, f".volume{next(names)}.zip")
+                    future = executor.submit(write_large_archive_volume, file_path, arcname, temp_path)
+                else:
+                    future = executor.submit(compress_archive_entry, file_path, arcname)
+                pending.append((future, min(size, volume_size)))
+                pending_bytes += min(size, volume_size)
+
+            result = None
+            if pending:
+                future, size = pending.popleft()
+                pending_bytes -= size
+                result = future.result()
+                if result is None:
+                    continue
+
+            large = isinstance(result, str)
+            if volume and result is not None and (large or len(volume) >= ARCHIVE_MAX_ENTRIES
+                                                  or volume_bytes + archive_entry_size(result) > volume_size):
+                ready.append(write_archive_volume(volume, os.path.join(output_dir, f".volume{next(names)}.zip")))
+                volume = []
+                volume_bytes = ZIP_END_RECORD.size
+            if large:
+                ready.append(result)
+            elif result is not None:
+                volume.append(result)
+                volume_bytes += archive_entry_size(result)
+            if volume and not pending:
+                ready.append(write_archive_volume(volume, os.path.join(output_dir, f".volume{next(names)}.zip")))
+                volume = []
+
+            last = not pending
+            while len(ready) > 1 or (ready and last):
+                index += 1
+                if last and len(ready) == 1 and index == 1:
+                    zip_path = os.path.join(output_dir, f"{base_name}.zip")
+                else:
+                    zip_path = os.path.join(output_dir, f"{base_name}.part{index:03d}.zip")
+                os.replace(ready.pop(0), zip_path)
+                yield index, last and not ready, zip_path
+            if last:
+                return
 
-        with winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_path, 0, winreg.KEY_SET_VALUE) as key:
-            winreg.DeleteValue(key, "ControlPCbotV2")
 
-        return True
+def send_folder_archive(chat_id, folder_path):
+    folder_name = os.path.basename(os.path.normpath(folder_path)) or folder_path
+    status = bot.send_message(chat_id, f"📦 Архивация папки: {folder_name}...")
+    temp_dir = tempfile.mkdtemp(prefix="controlpc_")
+    sent = 0
+    try:
+        for index, last, path in iter_archive_volumes(folder_path, temp_dir):
+            if os.path.getsize(path) > TRANSFER_LIMIT:
+                send_large_file(chat_id, path)
+            else:
+                part = "" if last and index == 1 else f", часть {index}" + (f" из {index}" if last else "")
+                send_path_document(chat_id, path, temporary=True, visible_file_name=os.path.basename(path),
+                                   caption=f"📦 Архив папки: {folder_name}{part}")
+            os.unlink(path)
+            sent += 1
+            try:
+                bot.edit_message_text(f"📦 Архивация папки: {folder_name}\n\nОтправлено томов: {sent}",
+                                      chat_id, status.message_id)
+            except:
+                pass
+
+        if sent:
+            log_command("Archive Folder", f"Archived: {folder_path} ({sent} volumes)")
+        else:
+            bot.edit_message_text(f"📦 Папка {folder_name} не содержит файлов", chat_id, status.message_id)
     except Exception as e:
-        return False
+        log_command("Archive Folder Error", str(e))
+        try:
+            bot.edit_message_text(f"❌ Ошибка архивации: {str(e)}", chat_id, status.message_id)
+        except:
+            pass
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
 
-def check_autostart():
-    try:
-        key_path = r"Software\Microsoft\Windows\CurrentVersion\Run"
+TRANSFER_WORKERS = 3
+TRANSFER_RETRIES = 3
 
-        with winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_path, 0, winreg.KEY_READ) as key:
-            try:
-                winreg.QueryValueEx(key, "ControlPCbotV2")
-                return True
-            except FileNotFoundError:
-                return False
-    except:
-        return False
 
+class FileSlice:
+    def __init__(self, path, offset, length):
+        self.file = open(path, 'rb')
+        self.file.seek(offset)
+        self.remaining = length
 
-def toggle_autostart():
-    if check_autostart():
-        return disable_autostart()
-    else:
-        return enable_autostart()
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
 
+    def close(self):
+        self.file.close()
 
-def check_system_uptime():
-    uptime_seconds = time.time() - psutil.boot_time()
-    return uptime_seconds < 300
+    def __enter__(self):
+        return self
 
+    def __exit__(self, *exc_info):
+        self.close()
 
-def take_screenshot():
-    try:
-        screenshot = pyautogui.screenshot()
-        temp_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-        screenshot.save(temp_file.name, 'PNG')
-        return temp_file.name
-    except Exception as e:
-        return None
 
+def slice_sha256(path, offset, length):
+    digest = hashlib.sha256()
+    with FileSlice(path, offset, length) as part:
+        for chunk in iter(lambda: part.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-def list_directory(path):
-    try:
-        if not os.path.exists(path):
-            return "❌ Путь не существует"
-        if not os.path.isdir(path):
-            return "❌ Указанный путь не является папкой"
-        result = "📂 Содержимое папки:\n\n"
-        for item in os.listdir(path):
-            full_path = os.path.join(path, item)
-            if os.path.isdir(full_path):
-                result += f"📁 {item}/\n"
-            else:
-                size = os.path.getsize(full_path)
-                result += f"📄 {item} ({size // 1024} KB)\n"
-        return result
-    except Exception as e:
-        return f"❌ Ошибка: {str(e)}"
 
+FILE_ID_CACHE_FILE = "file_id_cache.json"
+FILE_ID_CACHE_LIMIT = 2000
+FILE_ID_STALE_ERRORS = ("file identifier", "file_id", "file reference")
 
-@bot.message_handler(func=lambda message: message.chat.id != config.CHAT_ID)
-def handle_unauthorized(message):
-    bot.reply_to(message, "⛔ Доступ запрещен")
 
+class FileIdCache:
+    def __init__(self, cache_path=FILE_ID_CACHE_FILE, limit=FILE_ID_CACHE_LIMIT):
+        self.cache_path = cache_path
+        self.limit = limit
+        self.file_ids = OrderedDict()
+        self.paths = OrderedDict()
+        self.lock = threading.Lock()
+        self.loaded = False
 
-@bot.message_handler(commands=['start', 'help', 'menu'])
-def send_welcome(message):
-    if message.chat.id != config.CHAT_ID:
-        return
+    def load(self):
+        self.loaded = True
+        atexit.register(self.save)
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.file_ids.update(data.get("file_ids", {}))
+            self.paths.update(data.get("paths", {}))
+        except (OSError, ValueError, AttributeError):
+            pass
 
-    if check_system_uptime():
-        bot.send_message(message.chat.id, "🖥️ Компьютер был запущен недавно")
+    def trim(self):
+        for entries in (self.file_ids, self.paths):
+            while len(entries) > self.limit:
+                entries.popitem(last=False)
 
-    help_text = (
-        "🤖 ControlPCbotV2 - Бот управления компьютером\n\n"
-        "Доступные команды:\n"
-        "/menu - Главное меню\n"
-        "/cmd [команда] - Выполнить команду в CMD\n\n"
-        "⚠️ Для выполнения команд требуются права администратора\n\n"
+    def save(self):
+        with self.lock:
+            serialized = json.dumps({"file_ids": self.file_ids, "paths": self.paths}, ensure_ascii=False)
+            temp_path = f"{self.cache_path}.tmp"
+            try:
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.write(serialized)
+                os.replace(temp_path, self.cache_path)
+            except OSError as e:
+                logger.error(f"Failed to save file_id cache: {e}")
+
+    def digest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            known = self.paths.get(path)
+            if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+                self.paths.move_to_end(path)
+                return known[2]
+        digest = slice_sha256(path, 0, stat.st_size)
+        with self.lock:
+            self.paths[path] = [stat.st_size, stat.st_mtime_ns, digest]
+            self.paths.move_to_end(path)
+            self.trim()
+        return digest
+
+    def get(self, digest):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            file_id = self.file_ids.get(digest)
+            if file_id:
+                self.file_ids.move_to_end(digest)
+            return file_id
+
+    def put(self, digest, file_id):
+        with self.lock:
+            self.file_ids[digest] = file_id
+            self.file_ids.move_to_end(digest)
+            self.trim()
+        self.save()
+
+    def discard(self, digest):
+        with self.lock:
+            self.file_ids.pop(digest, None)
+
+
+file_id_cache = FileIdCache()
+
+
+def is_stale_file_id_error(error):
+    description = (error.description or "").lower()
+    return error.error_code == 400 and any(text in description for text in FILE_ID_STALE_ERRORS)
+
+
+def send_cached_document(chat_id, digest, open_document, **kwargs):
+    if kwargs.get("visible_file_name"):
+        digest = f"{digest}:{kwargs['visible_file_name']}"
+    file_id = file_id_cache.get(digest)
+    if file_id:
+        try:
+            return bot.send_document(chat_id, file_id, **kwargs)
+        except apihelper.ApiTelegramException as e:
+            if not is_stale_file_id_error(e):
+                raise
+            file_id_cache.discard(digest)
+    with open_document() as document:
+        message = bot.send_document(chat_id, document, **kwargs)
+    if message.document:
+        file_id_cache.put(digest, message.document.file_id)
+    return message
+
+
+def send_path_document(chat_id, path, temporary=False, **kwargs):
+    digest = slice_sha256(path, 0, os.path.getsize(path)) if temporary else file_id_cache.digest(path)
+    return send_cached_document(chat_id, digest, lambda: open(path, 'rb'), **kwargs)
+
+
+def send_file_part(chat_id, path, offset, length, part_name):
+    digest = slice_sha256(path, offset, length)
+    for attempt in range(TRANSFER_RETRIES):
+        try:
+            send_cached_document(chat_id, digest, lambda: FileSlice(path, offset, length),
+                                 visible_file_name=part_name)
+            return digest
+        except Exception as e:
+            if attempt == TRANSFER_RETRIES - 1:
+                raise
+            result = getattr(e, "result_json", None) or {}
+            time.sleep(result.get("parameters", {}).get("retry_after") or 2 ** attempt)
+
+
+def build_transfer_manifest(name, size, parts, digests):
+    lines = [
+        f"Файл: {name}",
+        f"Размер: {size} байт",
+        f"Частей: {len(parts)}",
+        "",
+        "Части (имя, размер, SHA-256):"
+    ]
+    for offset, length, part_name in parts:
+        lines.append(f"{part_name}  {length}  {digests[part_name]}")
+    part_names = " + ".join(f'"{part_name}"' for offset, length, part_name in parts)
+    lines += [
+        "",
+        "Сборка в Windows:",
+        f'copy /b {part_names} "{name}"',
+        "",
+        "Сборка в Linux/macOS:",
+        f'cat "{name}".[0-9][0-9][0-9] > "{name}"'
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def send_large_file(chat_id, path):
+    name = os.path.basename(path)
+    size = os.path.getsize(path)
+    parts = [(offset, min(TRANSFER_LIMIT, size - offset), f"{name}.{index:03d}")
+             for index, offset in enumerate(range(0, size, TRANSFER_LIMIT), 1)]
+    status = bot.send_message(chat_id, f"📤 Файл {name} ({size // 1024 // 1024} MB) больше лимита Telegram, "
+                                       f"отправка частями: 0/{len(parts)}")
+    digests = {}
+    try:
+        with ThreadPoolExecutor(max_workers=TRANSFER_WORKERS) as executor:
+            futures = {executor.submit(send_file_part, chat_id, path, offset, length, part_name): part_name
+                       for offset, length, part_name in parts}
+            try:
+                for future in as_completed(futures):
+                    digests[futures[future]] = future.result()
+                    try:
+                        bot.edit_message_text(f"📤 Отправка файла {name} частями: {len(digests)}/{len(parts)}",
+                                              chat_id, status.message_id)
+                    except:
+                        pass
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        manifest = build_transfer_manifest(name, size, parts, digests)
+        bot.send_document(chat_id, io.BytesIO(manifest.encode("utf-8")), visible_file_name=f"{name}.manifest.txt",
+                          caption=f"🧩 {name}: {len(parts)} частей, инструкция по сборке внутри")
+        log_command("Send File", f"Sent {path} in {len(parts)} parts")
+    except Exception as e:
+        log_command("Send File Error", f"{path}: {str(e)}")
+        try:
+            bot.edit_message_text(f"❌ Ошибка отправки файла {name}: {str(e)}", chat_id, status.message_id)
+        except:
+            pass
+
+
+def send_file(chat_id, path):
+    if os.path.getsize(path) > TRANSFER_LIMIT:
+        threading.Thread(target=send_large_file, args=(chat_id, path), daemon=True).start()
+        return
+    send_path_document(chat_id, path, caption=f"📄 {os.path.basename(path)}")
+
+
+def enable_autostart():
+    return backends.autostart.enable()
+
+
+def disable_autostart():
+    return backends.autostart.disable()
+
+
+autostart_state = {}
+
+
+def read_autostart():
+    return backends.autostart.enabled()
+
+
+def check_autostart():
+    if "enabled" not in autostart_state:
+        autostart_state["enabled"] = read_autostart()
+    return autostart_state["enabled"]
+
+
+def toggle_autostart():
+    try:
+        if check_autostart():
+            return disable_autostart()
+        else:
+            return enable_autostart()
+    finally:
+        autostart_state.clear()
+
+
+def check_system_uptime():
+    uptime_seconds = time.time() - psutil.boot_time()
+    return uptime_seconds < 300
+
+
+SCREENSHOT_FORMATS = {"jpeg": ("JPEG", ".jpg"), "webp": ("WEBP", ".webp"), "png": ("PNG", ".png")}
+SCREENSHOT_PHOTO_LIMIT = 10 * 1024 * 1024
+SCREENSHOT_FORMAT = "jpeg"
+SCREENSHOT_QUALITY = 80
+SCREENSHOT_MAX_SIZE = 1920
+
+screenshot_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def encode_image(image, image_format="jpeg", quality=80, max_size=None):
+    if max_size and max(image.size) > max_size:
+        image = image.copy()
+        image.thumbnail((max_size, max_size), Image.Resampling.BILINEAR)
+
+    pil_format, extension = SCREENSHOT_FORMATS[image_format]
+    if pil_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    if pil_format == "PNG":
+        image.save(buffer, pil_format, compress_level=3)
+    elif pil_format == "WEBP":
+        image.save(buffer, pil_format, quality=quality, method=3)
+    else:
+        image.save(buffer, pil_format, quality=quality)
+    buffer.name = f"screenshot{extension}"
+    buffer.seek(0)
+    return buffer, image.size
+
+
+def take_screenshot(image_format=SCREENSHOT_FORMAT, quality=SCREENSHOT_QUALITY, max_size=SCREENSHOT_MAX_SIZE,
+                    region=None):
+    try:
+        started = time.perf_counter()
+        screenshot = backends.screen.capture(region)
+        captured = time.perf_counter()
+        buffer, size = encode_image(screenshot, image_format, quality, max_size)
+        encoded = time.perf_counter()
+        logger.info(f"Screenshot {screenshot.width}x{screenshot.height} -> {size[0]}x{size[1]} {image_format} "
+                    f"q={quality}: capture {(captured - started) * 1000:.0f} ms, "
+                    f"encode {(encoded - captured) * 1000:.0f} ms, {len(buffer.getbuffer()) // 1024} KB")
+        return buffer
+    except Exception as e:
+        logger.error(f"Screenshot failed: {e}")
+        return None
+
+
+def send_screenshot(chat_id, **options):
+    session = get_session(chat_id)
+    options.setdefault("image_format", session.screenshot_format)
+    options.setdefault("quality", session.screenshot_quality)
+    options.setdefault("max_size", session.screenshot_max_size)
+    try:
+        screenshot = take_screenshot(**options)
+        if screenshot is None:
+            bot.send_message(chat_id, "❌ Ошибка создания скриншота")
+            return
+        if len(screenshot.getbuffer()) > SCREENSHOT_PHOTO_LIMIT:
+            bot.send_document(chat_id, screenshot, caption="📸 Скриншот выполнен успешно")
+        else:
+            bot.send_photo(chat_id, screenshot, caption="📸 Скриншот выполнен успешно")
+        log_command("Screenshot", "Taken")
+    except Exception as e:
+        bot.send_message(chat_id, f"❌ Ошибка: {str(e)}")
+
+
+def parse_screenshot_options(args):
+    options = {}
+    for arg in args.lower().split():
+        key, separator, value = arg.partition("=")
+        if arg == "jpg":
+            options["image_format"] = "jpeg"
+        elif arg in SCREENSHOT_FORMATS:
+            options["image_format"] = arg
+        elif separator and key in ("q", "quality") and value.isdigit():
+            options["quality"] = min(max(int(value), 1), 100)
+        elif separator and key == "max" and value.isdigit():
+            options["max_size"] = int(value)
+        elif separator and key == "region":
+            region = tuple(int(part) for part in value.split(","))
+            if len(region) != 4 or region[2] <= 0 or region[3] <= 0:
+                raise ValueError("region=x,y,ширина,высота")
+            options["region"] = region
+        else:
+            raise ValueError(f"Неизвестный параметр: {arg}")
+    return options
+
+
+WATCH_INTERVAL = 3
+WATCH_MIN_INTERVAL = 1
+WATCH_IDLE_TIMEOUT = 10 * 60
+WATCH_MAX_FRAMES = 200
+WATCH_MAX_BYTES = 30 * 1024 * 1024
+WATCH_GRID = (16, 9)
+WATCH_SAMPLE = 4
+WATCH_THRESHOLD = 24
+WATCH_MAX_SIZE = 1280
+WATCH_QUALITY = 60
+
+screen_watches = {}
+screen_watches_lock = threading.Lock()
+
+
+def frame_signature(image, grid=WATCH_GRID, sample=WATCH_SAMPLE):
+    return image.resize((grid[0] * sample, grid[1] * sample), Image.Resampling.BOX).convert("L")
+
+
+def changed_tiles(previous, current, grid=WATCH_GRID, threshold=WATCH_THRESHOLD):
+    if previous is None:
+        return None
+    diff = ImageChops.difference(previous, current)
+    if diff.getbbox() is None:
+        return set()
+    mask = diff.point(lambda value: 255 if value > threshold else 0).resize(grid, Image.Resampling.BOX)
+    return {(index % grid[0], index // grid[0]) for index, value in enumerate(mask.getdata()) if value}
+
+
+def group_tiles(tiles):
+    boxes = []
+    remaining = set(tiles)
+    while remaining:
+        stack = [remaining.pop()]
+        left, top = right, bottom = stack[0]
+        while stack:
+            col, row = stack.pop()
+            left, top, right, bottom = min(left, col), min(top, row), max(right, col), max(bottom, row)
+            for neighbour in ((col + 1, row), (col - 1, row), (col, row + 1), (col, row - 1)):
+                if neighbour in remaining:
+                    remaining.discard(neighbour)
+                    stack.append(neighbour)
+        boxes.append((left, top, right + 1, bottom + 1))
+    return boxes
+
+
+def render_watch_frame(frame, tiles, grid=WATCH_GRID):
+    frame = frame.convert("RGB")
+    frame.thumbnail((WATCH_MAX_SIZE, WATCH_MAX_SIZE), Image.Resampling.BILINEAR)
+    if tiles:
+        draw = ImageDraw.Draw(frame)
+        tile_width = frame.width / grid[0]
+        tile_height = frame.height / grid[1]
+        for left, top, right, bottom in group_tiles(tiles):
+            draw.rectangle((left * tile_width, top * tile_height, right * tile_width - 1, bottom * tile_height - 1),
+                           outline=(255, 0, 0), width=3)
+    buffer, size = encode_image(frame, "jpeg", WATCH_QUALITY)
+    return buffer
+
+
+@cached_keyboard
+def create_watch_keyboard():
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    keyboard.add(
+        InlineKeyboardButton("⏹ Остановить", callback_data="watch_stop"),
+        InlineKeyboardButton("⏱ Продлить", callback_data="watch_extend")
+    )
+    return keyboard
+
+
+class ScreenWatch:
+    def __init__(self, chat_id, capture=None, interval=WATCH_INTERVAL):
+        self.chat_id = chat_id
+        self.capture = capture or backends.screen.capture
+        self.interval = max(interval, WATCH_MIN_INTERVAL)
+        self.stop_event = threading.Event()
+        self.last_activity = time.monotonic()
+        self.message_id = None
+        self.signature = None
+        self.frames = 0
+        self.bytes_sent = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def run(self):
+        reason = "⏹ Наблюдение остановлено"
+        try:
+            while not self.stop_event.is_set():
+                if time.monotonic() - self.last_activity > WATCH_IDLE_TIMEOUT:
+                    reason = "⏹ Наблюдение остановлено из-за неактивности"
+                    break
+                if self.frames >= WATCH_MAX_FRAMES or self.bytes_sent >= WATCH_MAX_BYTES:
+                    reason = f"⏹ Наблюдение остановлено: лимит кадров или трафика ({self.frames} кадров, " \
+                             f"{self.bytes_sent // 1024} KB)"
+                    break
+                started = time.monotonic()
+                self.step()
+                self.stop_event.wait(max(0, self.interval - (time.monotonic() - started)))
+        except Exception as e:
+            reason = f"❌ Ошибка наблюдения: {str(e)}"
+        finally:
+            with screen_watches_lock:
+                if screen_watches.get(self.chat_id) is self:
+                    del screen_watches[self.chat_id]
+            self.finish(reason)
+
+    def step(self):
+        frame = self.capture()
+        signature = frame_signature(frame)
+        tiles = changed_tiles(self.signature, signature)
+        if tiles is not None and not tiles:
+            return False
+
+        self.signature = signature
+        buffer = render_watch_frame(frame, tiles)
+        self.frames += 1
+        self.bytes_sent += len(buffer.getbuffer())
+        changed = "весь экран" if tiles is None else f"{len(group_tiles(tiles))} обл."
+        caption = f"👁 Наблюдение: кадр {self.frames}, изменено: {changed}\n🕒 {time.strftime('%H:%M:%S')}"
+
+        if self.message_id is None:
+            message = bot.send_photo(self.chat_id, buffer, caption=caption, reply_markup=create_watch_keyboard())
+            self.message_id = message.message_id
+        else:
+            bot.edit_message_media(InputMediaPhoto(buffer, caption=caption), self.chat_id, self.message_id,
+                                   reply_markup=create_watch_keyboard())
+        return True
+
+    def finish(self, reason):
+        try:
+            if self.message_id is None:
+                bot.send_message(self.chat_id, reason)
+            else:
+                bot.edit_message_caption(reason, self.chat_id, self.message_id)
+        except:
+            pass
+        log_command("Screen Watch", f"Stopped after {self.frames} frames, {self.bytes_sent // 1024} KB")
+
+
+def start_screen_watch(chat_id, interval=WATCH_INTERVAL):
+    watch = ScreenWatch(chat_id, interval=interval)
+    with screen_watches_lock:
+        previous = screen_watches.get(chat_id)
+        screen_watches[chat_id] = watch
+    if previous is not None:
+        previous.stop()
+    watch.start()
+    log_command("Screen Watch", f"Started, interval {watch.interval} s")
+    return watch
+
+
+def stop_screen_watch(chat_id):
+    with screen_watches_lock:
+        watch = screen_watches.pop(chat_id, None)
+    if watch is not None:
+        watch.stop()
+    return watch is not None
+
+
+TARGET_GRID = (12, 8)
+TARGET_IMAGE_SIZE = 1280
+TARGET_QUALITY = 70
+TARGET_MIN_CELL = 4
+TARGET_OVERLAY_CACHE_SIZE = 16
+TARGET_TTL = 10 * 60
+TARGET_CELL_PATTERN = re.compile(r"\s*([a-z])\s*(\d{1,2})\s*(\+|[a-z]+)?\s*", re.IGNORECASE)
+TARGET_ACTIONS = {
+    None: ("click", "left", 1),
+    "left": ("click", "left", 1),
+    "right": ("click", "right", 1),
+    "middle": ("click", "middle", 1),
+    "double": ("click", "left", 2),
+    "move": ("move",),
+    "zoom": ("zoom",),
+    "+": ("zoom",)
+}
+
+target_overlays = OrderedDict()
+target_overlays_lock = threading.Lock()
+
+
+class ScreenTarget:
+    def __init__(self, region, scale=(1.0, 1.0), grid=TARGET_GRID, message_id=None):
+        self.region = region
+        self.scale = scale
+        self.grid = grid
+        self.message_id = message_id
+        self.shown = time.monotonic()
+
+    def parse_cell(self, cell):
+        column = ord(cell[0].upper()) - ord("A")
+        row = int(cell[1:]) - 1
+        if not (0 <= column < self.grid[0] and 0 <= row < self.grid[1]):
+            raise ValueError(f"клетки {cell.upper()} нет на сетке {target_cell_name(0, 0)}–"
+                             f"{target_cell_name(self.grid[0] - 1, self.grid[1] - 1)}")
+        return column, row
+
+    def cell_box(self, column, row):
+        x, y, width, height = self.region
+        left = x + width * column // self.grid[0]
+        top = y + height * row // self.grid[1]
+        right = x + width * (column + 1) // self.grid[0]
+        bottom = y + height * (row + 1) // self.grid[1]
+        return left, top, right - left, bottom - top
+
+    def point(self, column, row):
+        left, top, width, height = self.cell_box(column, row)
+        return round((left + width / 2) * self.scale[0]), round((top + height / 2) * self.scale[1])
+
+    def zoom(self, column, row):
+        region = self.cell_box(column, row)
+        if min(region[2], region[3]) < TARGET_MIN_CELL * min(self.grid):
+            return None
+        return ScreenTarget(region, self.scale, self.grid, self.message_id)
+
+
+def target_cell_name(column, row):
+    return f"{chr(ord('A') + column)}{row + 1}"
+
+
+def create_target_overlay(size, grid):
+    key = (size, grid)
+    with target_overlays_lock:
+        overlay = target_overlays.get(key)
+        if overlay is not None:
+            target_overlays.move_to_end(key)
+            return overlay
+
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    cell_height = size[1] / grid[1]
+    try:
+        font = ImageFont.truetype("arial.ttf", max(10, int(cell_height / 4)))
+    except OSError:
+        font = ImageFont.load_default()
+
+    for column in range(1, grid[0]):
+        x = size[0] * column // grid[0]
+        draw.line([(x, 0), (x, size[1])], fill=(255, 230, 0, 170), width=1)
+    for row in range(1, grid[1]):
+        y = size[1] * row // grid[1]
+        draw.line([(0, y), (size[0], y)], fill=(255, 230, 0, 170), width=1)
+    for column in range(grid[0]):
+        for row in range(grid[1]):
+            x = size[0] * column // grid[0] + 2
+            y = size[1] * row // grid[1] + 2
+            label = target_cell_name(column, row)
+            left, top, right, bottom = draw.textbbox((x, y), label, font=font)
+            draw.rectangle((left - 2, top - 1, right + 2, bottom + 1), fill=(0, 0, 0, 140))
+            draw.text((x, y), label, fill=(255, 230, 0, 255), font=font)
+
+    with target_overlays_lock:
+        target_overlays[key] = overlay
+        while len(target_overlays) > TARGET_OVERLAY_CACHE_SIZE:
+            target_overlays.popitem(last=False)
+    return overlay
+
+
+def render_target_frame(frame, grid=TARGET_GRID, max_size=TARGET_IMAGE_SIZE):
+    ratio = max_size / max(frame.size)
+    size = (max(1, round(frame.width * ratio)), max(1, round(frame.height * ratio)))
+    resample = Image.Resampling.NEAREST if ratio > 1 else Image.Resampling.BILINEAR
+    frame = frame.convert("RGBA").resize(size, resample)
+    frame = Image.alpha_composite(frame, create_target_overlay(size, grid))
+    return encode_image(frame, "jpeg", TARGET_QUALITY)[0]
+
+
+@cached_keyboard
+def create_target_keyboard():
+    keyboard = InlineKeyboardMarkup(row_width=3)
+    keyboard.add(
+        InlineKeyboardButton("🔄 Обновить", callback_data="target_refresh"),
+        InlineKeyboardButton("🖥 Весь экран", callback_data="target_full"),
+        InlineKeyboardButton("❌ Закрыть", callback_data="target_close")
+    )
+    return keyboard
+
+
+def send_screen_target(chat_id, target=None, message_id=None):
+    session = get_session(chat_id)
+    try:
+        if target is None:
+            frame = backends.screen.capture()
+            screen_width, screen_height = backends.input.screen_size()
+            target = ScreenTarget((0, 0, frame.width, frame.height),
+                                  (screen_width / frame.width, screen_height / frame.height), message_id=message_id)
+        else:
+            frame = backends.screen.capture(target.region)
+        buffer = render_target_frame(frame, target.grid)
+        first, last = target_cell_name(0, 0), target_cell_name(target.grid[0] - 1, target.grid[1] - 1)
+        x, y, width, height = target.region
+        caption = (f"🎯 Область {width}x{height} в точке {x},{y}. Ответьте клеткой {first}–{last}:\n"
+                   f"C4 - клик, C4 right / middle / double - другая кнопка или двойной клик, "
+                   f"C4 move - навести, C4+ - увеличить клетку")
+        if target.message_id is None:
+            message = bot.send_photo(chat_id, buffer, caption=caption, reply_markup=create_target_keyboard())
+            target.message_id = message.message_id
+        else:
+            bot.edit_message_media(InputMediaPhoto(buffer, caption=caption), chat_id, target.message_id,
+                                   reply_markup=create_target_keyboard())
+        target.shown = time.monotonic()
+        session.target = target
+    except Exception as e:
+        bot.send_message(chat_id, f"❌ Ошибка прицела: {str(e)}")
+
+
+def is_screen_target_reply(message):
+    session = get_session(message.chat.id)
+    target = session.target
+    if target is None:
+        return False
+    if time.monotonic() - target.shown > TARGET_TTL:
+        session.target = None
+        return False
+    reply = message.reply_to_message
+    return reply is not None and reply.message_id == target.message_id
+
+
+def apply_screen_target(chat_id, text):
+    session = get_session(chat_id)
+    target = session.target
+    match = TARGET_CELL_PATTERN.fullmatch(text)
+    action = TARGET_ACTIONS.get(match.group(3).lower() if match.group(3) else None)
+    if action is None:
+        raise ValueError(f"неизвестное действие '{match.group(3)}'")
+    cell = match.group(1) + match.group(2)
+    column, row = target.parse_cell(cell)
+    cell = target_cell_name(column, row)
+
+    if action[0] == "zoom":
+        zoomed = target.zoom(column, row)
+        if zoomed is None:
+            return f"ℹ️ Клетка {cell} уже максимально увеличена"
+        screenshot_executor.submit(send_screen_target, chat_id, zoomed)
+        return None
+
+    x, y = target.point(column, row)
+    backends.input.move_to(x, y)
+    record_macro_step(chat_id, "moveto", x, y)
+    if action[0] == "move":
+        log_command("Mouse Control", f"Target move {cell} to {x},{y}")
+        return f"✅ Курсор наведен на {cell} ({x}, {y})"
+    backends.input.click(button=action[1], clicks=action[2])
+    record_macro_step(chat_id, "click", action[1], action[2])
+    log_command("Mouse Control", f"Target click {cell} at {x},{y}, {action[1]} x{action[2]}")
+    return f"✅ Клик в {cell} ({x}, {y})"
+
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_TIMEOUT = 60
+UPLOAD_EXTRACT_CAPTIONS = {"unzip", "распаковать"}
+UPLOAD_EXTRACT_MAX_FILES = 10000
+UPLOAD_EXTRACT_MAX_BYTES = 4 * 1024 * 1024 * 1024
+UPLOAD_SHA256_PATTERN = re.compile(r"\b[0-9a-f]{64}\b")
+
+
+def get_file_url(file_path):
+    if apihelper.FILE_URL is None:
+        return f"https://api.telegram.org/file/bot{bot.token}/{file_path}"
+    return apihelper.FILE_URL.format(bot.token, file_path)
+
+
+def create_placeholder(path):
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+
+
+def reserve_path(path, create=create_placeholder):
+    base, ext = os.path.splitext(path)
+    for index in itertools.count():
+        candidate = f"{base} ({index}){ext}" if index else path
+        try:
+            create(candidate)
+            return candidate
+        except FileExistsError:
+            continue
+
+
+def parse_upload_caption(caption):
+    caption = (caption or "").strip().lower()
+    extract = any(word in UPLOAD_EXTRACT_CAPTIONS for word in caption.split())
+    match = UPLOAD_SHA256_PATTERN.search(caption)
+    return extract, match.group(0) if match else None
+
+
+def check_archive_limits(archive):
+    entries = archive.infolist()
+    if len(entries) > UPLOAD_EXTRACT_MAX_FILES:
+        raise IOError(f"В архиве {len(entries)} файлов, допустимо не больше {UPLOAD_EXTRACT_MAX_FILES}")
+    total = sum(entry.file_size for entry in entries)
+    if total > UPLOAD_EXTRACT_MAX_BYTES:
+        raise IOError(f"Архив распаковывается в {total // 1024 // 1024} MB, "
+                      f"допустимо не больше {UPLOAD_EXTRACT_MAX_BYTES // 1024 // 1024} MB")
+
+
+def download_to_temp(url, directory, expected_size=None, chunk_size=UPLOAD_CHUNK_SIZE):
+    fd, temp_path = tempfile.mkstemp(prefix=".upload_", suffix=".part", dir=directory)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with requests.get(url, stream=True, timeout=UPLOAD_TIMEOUT, proxies=apihelper.proxy) as response:
+                if response.status_code != 200:
+                    raise IOError(f"Сервер вернул код {response.status_code}")
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if expected_size is not None and size != expected_size:
+            raise IOError(f"Размер не совпадает: получено {size} из {expected_size} байт")
+        return temp_path, digest.hexdigest(), size
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def receive_upload(file_info, target_path, extract=False, expected_sha256=None):
+    directory = os.path.dirname(target_path)
+    temp_path, digest, size = download_to_temp(get_file_url(file_info.file_path), directory, file_info.file_size)
+    try:
+        if expected_sha256 and digest != expected_sha256:
+            raise IOError(f"SHA-256 не совпадает: получено {digest}, ожидалось {expected_sha256}")
+
+        if extract and zipfile.is_zipfile(temp_path):
+            with zipfile.ZipFile(temp_path) as archive:
+                check_archive_limits(archive)
+                extract_dir = reserve_path(os.path.splitext(target_path)[0], os.mkdir)
+                try:
+                    archive.extractall(extract_dir)
+                except BaseException:
+                    shutil.rmtree(extract_dir, ignore_errors=True)
+                    raise
+            os.unlink(temp_path)
+            return extract_dir, digest, size, True
+
+        final_path = reserve_path(target_path)
+        try:
+            os.replace(temp_path, final_path)
+        except BaseException:
+            os.unlink(final_path)
+            raise
+        return final_path, digest, size, False
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+FIND_INDEX_FILE = "find_index.json"
+FIND_WORKERS = 8
+FIND_REFRESH_INTERVAL = 10 * 60
+FIND_MAX_RESULTS = 300
+FIND_PAGE_SIZE = 10
+FIND_SKIP_FILESYSTEMS = {
+    "squashfs", "tmpfs", "devtmpfs", "proc", "sysfs", "devfs", "autofs", "cgroup", "cgroup2", "iso9660", "udf"
+}
+
+
+def get_search_roots():
+    roots = []
+    for partition in psutil.disk_partitions():
+        if 'cdrom' in partition.opts or partition.fstype.lower() in FIND_SKIP_FILESYSTEMS:
+            continue
+        if partition.mountpoint not in roots:
+            roots.append(partition.mountpoint)
+    return roots or [os.path.abspath(os.sep)]
+
+
+class FilenameIndex:
+    def __init__(self, index_path=FIND_INDEX_FILE, workers=FIND_WORKERS):
+        self.index_path = index_path
+        self.workers = workers
+        self.dirs = {}
+        self.paths = []
+        self.names = []
+        self.kinds = bytearray()
+        self.trigrams = {}
+        self.refreshed = 0
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def ensure_loaded(self):
+        with self.load_lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.build(data["dirs"])
+                self.dirs = data["dirs"]
+                self.refreshed = data["refreshed"]
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+    def save(self):
+        temp_path = f"{self.index_path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"refreshed": self.refreshed, "dirs": self.dirs}, f, ensure_ascii=False,
+                          separators=(",", ":"))
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            logger.error(f"Failed to save filename index: {e}")
+
+    def scan_directory(self, path, previous, device=None):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if device is not None and stat.st_dev != device:
+            return None
+        mtime = stat.st_mtime_ns
+        if previous and previous[0] == mtime:
+            return previous
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if getattr(entry, "is_junction", lambda: False)() or entry.is_symlink():
+                            continue
+                        if entry.is_dir():
+                            subdirs.append(entry.name)
+                        else:
+                            files.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return [mtime, files, subdirs]
+
+    def crawl(self, roots):
+        previous = self.dirs
+        dirs = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {}
+            for root in roots:
+                try:
+                    device = os.stat(root).st_dev
+                except OSError:
+                    continue
+                pending[executor.submit(self.scan_directory, root, previous.get(root))] = (root, device)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, device = pending.pop(future)
+                    entry = future.result()
+                    if entry is None:
+                        continue
+                    dirs[path] = entry
+                    for name in entry[2]:
+                        child = os.path.join(path, name)
+                        pending[executor.submit(self.scan_directory, child, previous.get(child), device)] = \
+                            (child, device)
+        return dirs
+
+    def build(self, dirs):
+        paths = []
+        names = []
+        kinds = bytearray()
+        for directory, (mtime, files, subdirs) in dirs.items():
+            for is_dir, children in ((1, subdirs), (0, files)):
+                for name in children:
+                    paths.append(os.path.join(directory, name))
+                    names.append(name.lower())
+                    kinds.append(is_dir)
+
+        postings = {}
+        for index, name in enumerate(names):
+            for trigram in {name[i:i + 3] for i in range(len(name) - 2)}:
+                postings.setdefault(trigram, []).append(index)
+        trigrams = {trigram: array("I", indexes) for trigram, indexes in postings.items()}
+
+        with self.lock:
+            self.paths = paths
+            self.names = names
+            self.kinds = kinds
+            self.trigrams = trigrams
+
+    def refresh(self):
+        if not self.refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self.ensure_loaded()
+            started = time.time()
+            dirs = self.crawl(get_search_roots())
+            self.build(dirs)
+            self.dirs = dirs
+            self.refreshed = started
+            self.save()
+            logger.info(f"Filename index refreshed: {len(self.paths)} entries in {time.time() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"Failed to refresh filename index: {e}")
+        finally:
+            self.refresh_lock.release()
+
+    def refresh_async(self, max_age=FIND_REFRESH_INTERVAL):
+        if time.time() - self.refreshed > max_age and not self.refresh_lock.locked():
+            threading.Thread(target=self.refresh, daemon=True).start()
+
+    def ready(self):
+        self.ensure_loaded()
+        return self.refreshed > 0
+
+    def search(self, query, limit=FIND_MAX_RESULTS):
+        query = query.lower()
+        with self.lock:
+            paths = self.paths
+            names = self.names
+            kinds = self.kinds
+            trigrams = self.trigrams
+
+        if len(query) >= 3:
+            postings = sorted((trigrams.get(query[i:i + 3], ()) for i in range(len(query) - 2)), key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(posting)
+            candidates = sorted(candidates)
+        else:
+            candidates = range(len(names))
+
+        matches = (index for index in candidates if query in names[index])
+        matches = heapq.nsmallest(limit, matches, key=lambda index: (names[index] != query,
+                                                                     not names[index].startswith(query),
+                                                                     len(paths[index]), index))
+        return [(paths[index], bool(kinds[index])) for index in matches]
+
+
+file_index = FilenameIndex()
+
+
+def create_find_message(session):
+    results = session.find_results
+    start = session.find_page * FIND_PAGE_SIZE
+    lines = [f"🔍 Поиск: {session.find_query}", f"Найдено: {len(results)}"
+             + (" (показаны первые)" if len(results) >= FIND_MAX_RESULTS else ""), ""]
+    for number, (path, is_dir) in enumerate(results[start:start + FIND_PAGE_SIZE], start + 1):
+        lines.append(f"{number}. {'📁' if is_dir else '📄'} {path}")
+    return "\n".join(lines)
+
+
+def create_find_keyboard(chat_id):
+    keyboard = InlineKeyboardMarkup()
+    session = get_session(chat_id)
+    results = session.find_results
+    page = session.find_page
+    start = page * FIND_PAGE_SIZE
+    total_pages = (len(results) + FIND_PAGE_SIZE - 1) // FIND_PAGE_SIZE
+
+    for number, (path, is_dir) in enumerate(results[start:start + FIND_PAGE_SIZE], start + 1):
+        name = os.path.basename(path) or path
+        if is_dir:
+            keyboard.add(InlineKeyboardButton(f"{number}. 📁 {name}",
+                                              callback_data=f"folder_{path_token(chat_id, path)}"))
+        else:
+            keyboard.add(InlineKeyboardButton(f"{number}. 📄 {name}",
+                                              callback_data=f"file_{path_token(chat_id, path)}"))
+
+    navigation_buttons = []
+    if page > 0:
+        navigation_buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data="find_prev"))
+    if page < total_pages - 1:
+        navigation_buttons.append(InlineKeyboardButton("Вперед ➡️", callback_data="find_next"))
+    if navigation_buttons:
+        keyboard.row(*navigation_buttons)
+
+    keyboard.add(InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu"))
+    return keyboard
+
+
+DU_WORKERS = 8
+DU_TOP = 15
+DU_CACHE_MAX_ENTRIES = 500000
+DU_PROGRESS_INTERVAL = 3
+DU_TREEMAP_SIZE = (1280, 800)
+DU_TREEMAP_COLORS = [
+    (78, 121, 167), (242, 142, 43), (225, 87, 89), (118, 183, 178), (89, 161, 79),
+    (237, 201, 72), (176, 122, 161), (255, 157, 167), (156, 117, 95), (186, 176, 172)
+]
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+class DiskUsageAnalyzer:
+    def __init__(self, workers=DU_WORKERS, max_entries=DU_CACHE_MAX_ENTRIES):
+        self.workers = workers
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def scan_directory(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        with self.lock:
+            cached = self.cache.get(path)
+            if cached and cached[0] == mtime:
+                self.cache.move_to_end(path)
+                return cached
+
+        files_size = 0
+        file_count = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if getattr(entry, "is_junction", lambda: False)() or entry.is_symlink():
+                            continue
+                        if entry.is_dir():
+                            subdirs.append(entry.name)
+                        else:
+                            files_size += entry.stat(follow_symlinks=False).st_size
+                            file_count += 1
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+
+        result = (mtime, files_size, file_count, subdirs)
+        with self.lock:
+            self.cache[path] = result
+            self.cache.move_to_end(path)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return result
+
+    def summarize(self, root, root_entry, totals, file_count, dir_count, errors, started, complete):
+        items = [(name, size, True) for name, size in totals.items()]
+        try:
+            files = [(name, size, False) for name, is_dir, size, mtime in listing_cache.get(root, "size") if not is_dir]
+            items += heapq.nlargest(DU_TOP, files, key=lambda item: item[1])
+        except OSError:
+            pass
+        items.sort(key=lambda item: item[1], reverse=True)
+        return {
+            "path": root,
+            "total": root_entry[1] + sum(totals.values()),
+            "files": file_count,
+            "dirs": dir_count,
+            "errors": errors,
+            "items": items[:DU_TOP],
+            "elapsed": time.perf_counter() - started,
+            "complete": complete
+        }
+
+    def analyze(self, root, on_progress=None, interval=DU_PROGRESS_INTERVAL):
+        started = time.perf_counter()
+        root_entry = self.scan_directory(root)
+        if root_entry is None:
+            raise OSError(f"Нет доступа к папке {root}")
+
+        totals = {name: 0 for name in root_entry[3]}
+        file_count = root_entry[2]
+        dir_count = 0
+        errors = 0
+        next_progress = started + interval
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {}
+            for name in root_entry[3]:
+                path = os.path.join(root, name)
+                pending[executor.submit(self.scan_directory, path)] = (path, name)
+            while pending:
+                done, _ = wait(pending, timeout=interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, top = pending.pop(future)
+                    entry = future.result()
+                    if entry is None:
+                        errors += 1
+                        continue
+                    dir_count += 1
+                    file_count += entry[2]
+                    totals[top] += entry[1]
+                    for name in entry[3]:
+                        child = os.path.join(path, name)
+                        pending[executor.submit(self.scan_directory, child)] = (child, top)
+                if on_progress and pending and time.perf_counter() >= next_progress:
+                    next_progress = time.perf_counter() + interval
+                    on_progress(self.summarize(root, root_entry, totals, file_count, dir_count, errors, started,
+                                               False))
+
+        return self.summarize(root, root_entry, totals, file_count, dir_count, errors, started, True)
+
+
+disk_usage_analyzer = DiskUsageAnalyzer()
+
+
+def worst_aspect_ratio(row, side):
+    total = sum(row)
+    return max(max(side * side * area / (total * total), total * total / (side * side * area)) for area in row)
+
+
+def layout_treemap(values, x, y, width, height):
+    scale = width * height / sum(values)
+    areas = [value * scale for value in values]
+    rects = []
+    while areas:
+        side = min(width, height)
+        if side <= 0:
+            break
+        row = [areas[0]]
+        while len(row) < len(areas) and \
+                worst_aspect_ratio(row + [areas[len(row)]], side) <= worst_aspect_ratio(row, side):
+            row.append(areas[len(row)])
+        thickness = sum(row) / side
+        offset = 0
+        for area in row:
+            length = area / thickness
+            if width >= height:
+                rects.append((x, y + offset, thickness, length))
+            else:
+                rects.append((x + offset, y, length, thickness))
+            offset += length
+        if width >= height:
+            x += thickness
+            width -= thickness
+        else:
+            y += thickness
+            height -= thickness
+        areas = areas[len(row):]
+    return rects
+
+
+def render_treemap(summary, size=DU_TREEMAP_SIZE):
+    items = [(name, item_size) for name, item_size, is_dir in summary["items"] if item_size > 0]
+    rest = summary["total"] - sum(item_size for name, item_size in items)
+    if rest > 0:
+        items.append((None, rest))
+
+    image = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.truetype("arial.ttf", 14)
+    except OSError:
+        font = ImageFont.load_default()
+    if not items:
+        return encode_image(image, "png")[0]
+
+    rects = layout_treemap([item_size for name, item_size in items], 0, 0, size[0], size[1])
+    for index, ((name, item_size), (x, y, width, height)) in enumerate(zip(items, rects)):
+        color = (200, 200, 200) if name is None else DU_TREEMAP_COLORS[index % len(DU_TREEMAP_COLORS)]
+        draw.rectangle([x, y, x + width, y + height], fill=color, outline=(255, 255, 255), width=2)
+        label = f"{name or 'Остальное'}\n{format_size(item_size)}"
+        left, top, right, bottom = draw.multiline_textbbox((0, 0), label, font=font)
+        if right - left + 8 <= width and bottom - top + 8 <= height:
+            draw.multiline_text((x + 4, y + 4), label, fill=(0, 0, 0), font=font)
+    return encode_image(image, "png")[0]
+
+
+def format_disk_usage(summary):
+    total = summary["total"]
+    lines = [
+        f"📊 Размер папки: {summary['path']}",
+        f"Всего: {format_size(total)}, файлов: {summary['files']}, папок: {summary['dirs']}"
+    ]
+    if summary["errors"]:
+        lines.append(f"⚠️ Нет доступа к папкам: {summary['errors']}")
+    if summary["complete"]:
+        lines.append(f"⏱ {summary['elapsed']:.1f} с")
+    else:
+        lines.append(f"⏳ Подсчёт продолжается ({summary['elapsed']:.0f} с)...")
+    lines.append("")
+    for name, size, is_dir in summary["items"]:
+        share = size * 100 / total if total else 0
+        lines.append(f"{'📁' if is_dir else '📄'} {name} — {format_size(size)} ({share:.0f}%)")
+    return "\n".join(lines)
+
+
+def create_disk_usage_keyboard(chat_id, summary):
+    keyboard = InlineKeyboardMarkup()
+    for name, size, is_dir in summary["items"]:
+        if is_dir:
+            full_path = os.path.join(summary["path"], name)
+            keyboard.add(InlineKeyboardButton(f"📁 {name} ({format_size(size)})",
+                                              callback_data=f"folder_{path_token(chat_id, full_path)}"))
+    keyboard.add(InlineKeyboardButton("🗺 Карта размеров", callback_data="disk_usage_map"))
+    keyboard.add(InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu"))
+    return keyboard
+
+
+def send_disk_usage(chat_id, path):
+    status = bot.send_message(chat_id, f"📊 Подсчёт размера папки: {path}...")
+
+    def show_progress(summary):
+        try:
+            bot.edit_message_text(format_disk_usage(summary), chat_id, status.message_id)
+        except:
+            pass
+
+    try:
+        summary = disk_usage_analyzer.analyze(path, on_progress=show_progress)
+        get_session(chat_id).disk_usage = summary
+        bot.edit_message_text(format_disk_usage(summary), chat_id, status.message_id,
+                              reply_markup=create_disk_usage_keyboard(chat_id, summary))
+        log_command("Disk Usage", f"{path}: {summary['total']} bytes in {summary['elapsed']:.1f}s")
+    except Exception as e:
+        log_command("Disk Usage Error", f"{path}: {str(e)}")
+        try:
+            bot.edit_message_text(f"❌ Ошибка подсчёта размера: {str(e)}", chat_id, status.message_id)
+        except:
+            pass
+
+
+def list_directory(path):
+    try:
+        if not os.path.exists(path):
+            return "❌ Путь не существует"
+        if not os.path.isdir(path):
+            return "❌ Указанный путь не является папкой"
+        result = "📂 Содержимое папки:\n\n"
+        for item, is_dir, size, mtime in listing_cache.get(path):
+            if is_dir:
+                result += f"📁 {item}/\n"
+            else:
+                result += f"📄 {item} ({size // 1024} KB)\n"
+        return result
+    except Exception as e:
+        return f"❌ Ошибка: {str(e)}"
+
+
+CMD_TIMEOUT = 30
+CMD_MAX_TIMEOUT = 3600
+CMD_MAX_JOBS = 4
+CMD_EDIT_INTERVAL = 1.5
+CMD_MESSAGE_LIMIT = 4000
+CMD_COMMAND_PREVIEW = 200
+CMD_OUTPUT_MIN = 500
+SHELL_IDLE_TIMEOUT = 15 * 60
+SHELL_KILL_GRACE = 3
+SHELL_ENCODING = 'cp866' if os.name == 'nt' else 'utf-8'
+
+cmd_executor = ThreadPoolExecutor(max_workers=CMD_MAX_JOBS)
+cmd_jobs = {}
+cmd_jobs_lock = threading.Lock()
+cmd_job_ids = itertools.count(1)
+
+
+def parse_cmd_timeout(command):
+    parts = command.split(maxsplit=2)
+    if len(parts) == 3 and parts[0] == "-t" and parts[1].isdigit():
+        return min(max(int(parts[1]), 1), CMD_MAX_TIMEOUT), parts[2]
+    return CMD_TIMEOUT, command
+
+
+def kill_process_tree(pid, include_parent=True):
+    try:
+        parent = psutil.Process(pid)
+        for child in parent.children(recursive=True):
+            try:
+                child.kill()
+            except psutil.Error:
+                pass
+        if include_parent:
+            parent.kill()
+    except psutil.Error:
+        pass
+
+
+class ShellSession:
+    def __init__(self, cwd=None):
+        if os.name == 'nt':
+            args = ["cmd.exe", "/Q", "/K"]
+        else:
+            args = ["/bin/sh"]
+        self.process = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            encoding=SHELL_ENCODING,
+            errors='replace',
+            cwd=cwd or os.path.expanduser("~")
+        )
+        self.lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        self.reserved = False
+        self.running = None
+        self.interrupted = False
+        self.cancelled = set()
+        self.cwd = cwd or os.path.expanduser("~")
+        self.last_used = time.monotonic()
+        self.run("")
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def busy(self):
+        return self.reserved or self.running is not None
+
+    def reserve(self):
+        with self.state_lock:
+            if self.reserved:
+                return False
+            self.reserved = True
+            return True
+
+    @staticmethod
+    def build_script(script_path, marker):
+        if os.name == 'nt':
+            return (f'call "{script_path}" < NUL\nset CONTROLPC_RC=%ERRORLEVEL%\n'
+                    f'echo.\necho {marker} %CONTROLPC_RC% %CD%\n')
+        return f'. "{script_path}" < /dev/null\nCONTROLPC_RC=$?\necho\necho "{marker} $CONTROLPC_RC $PWD"\n'
+
+    @staticmethod
+    def write_command(command):
+        fd, script_path = tempfile.mkstemp(prefix="controlpc_", suffix=".cmd" if os.name == 'nt' else ".sh")
+        with open(fd, "w", encoding=SHELL_ENCODING, errors="replace") as f:
+            f.write(f"@echo off\n{command}\n" if os.name == 'nt' else f"{command}\n")
+        return script_path
+
+    def run(self, command, tag=None, on_output=None, timeout=None):
+        with self.lock:
+            if tag is not None and tag in self.cancelled:
+                self.cancelled.discard(tag)
+                self.reserved = False
+                return None, True
+
+            marker = f"__CONTROLPC_{uuid.uuid4().hex}__"
+            self.running = tag or marker
+            self.interrupted = False
+            timer = None
+            if timeout:
+                timer = threading.Timer(timeout, self.interrupt, args=(self.running,))
+                timer.daemon = True
+                timer.start()
+
+            returncode = None
+            script_path = None
+            try:
+                script_path = self.write_command(command)
+                self.process.stdin.write(self.build_script(script_path, marker))
+                self.process.stdin.flush()
+                for line in self.process.stdout:
+                    if line.startswith(marker):
+                        code, separator, cwd = line[len(marker):].strip().partition(" ")
+                        returncode = int(code) if code.lstrip('-').isdigit() else None
+                        self.cwd = cwd or self.cwd
+                        break
+                    if on_output is not None:
+                        on_output(line)
+            except (OSError, ValueError):
+                pass
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                if script_path is not None:
+                    try:
+                        os.remove(script_path)
+                    except OSError:
+                        pass
+                self.running = None
+                self.reserved = False
+                self.last_used = time.monotonic()
+            return returncode, self.interrupted
+
+    def interrupt(self, tag):
+        if self.running != tag:
+            self.cancelled.add(tag)
+            return
+        self.interrupted = True
+        kill_process_tree(self.process.pid, include_parent=False)
+        timer = threading.Timer(SHELL_KILL_GRACE, self.kill_if_running, args=(tag,))
+        timer.daemon = True
+        timer.start()
+
+    def kill_if_running(self, tag):
+        if self.running == tag:
+            self.close()
+
+    def close(self):
+        kill_process_tree(self.process.pid)
+
+
+class OneShotCommand:
+    def __init__(self, cwd=None):
+        self.cwd = cwd if cwd and os.path.isdir(cwd) else os.path.expanduser("~")
+        self.process = None
+        self.interrupted = False
+        self.lock = threading.Lock()
+
+    def run(self, command, tag=None, on_output=None, timeout=None):
+        with self.lock:
+            if self.interrupted:
+                return None, True
+            self.process = subprocess.Popen(
+                command,
+                shell=True,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                encoding=SHELL_ENCODING,
+                errors='replace',
+                cwd=self.cwd
+            )
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self.interrupt, args=(tag,))
+            timer.daemon = True
+            timer.start()
+        try:
+            for line in self.process.stdout:
+                if on_output is not None:
+                    on_output(line)
+            return self.process.wait(), self.interrupted
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def interrupt(self, tag):
+        with self.lock:
+            self.interrupted = True
+            if self.process is None:
+                return
+        kill_process_tree(self.process.pid)
+
+
+class ShellSessionManager:
+    def __init__(self, idle_timeout=SHELL_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def get(self, chat_id):
+        with self.lock:
+            if self.reaper is None:
+                self.reaper = threading.Thread(target=self.reap_forever, daemon=True)
+                self.reaper.start()
+            session = self.sessions.get(chat_id)
+            if session is None or not session.alive():
+                session = self.sessions[chat_id] = ShellSession()
+            return session
+
+    def reap(self):
+        now = time.monotonic()
+        with self.lock:
+            for chat_id, session in list(self.sessions.items()):
+                if not session.alive() or (not session.busy() and now - session.last_used > self.idle_timeout):
+                    session.close()
+                    del self.sessions[chat_id]
+
+    def reap_forever(self):
+        while True:
+            time.sleep(60)
+            self.reap()
+
+    def reset(self, chat_id):
+        with self.lock:
+            session = self.sessions.pop(chat_id, None)
+        if session is not None:
+            session.close()
+        return session is not None
+
+
+shell_sessions = ShellSessionManager()
+
+
+def create_cmd_keyboard(job_id):
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton("⛔ Отменить", callback_data=f"cmd_cancel_{job_id}"))
+    return keyboard
+
+
+def format_cmd_output(job, output, status, markup=True):
+    command = job["command"]
+    if len(command) > CMD_COMMAND_PREVIEW:
+        command = command[:CMD_COMMAND_PREVIEW] + "..."
+    escape = html.escape if markup else str
+    head = f"{status}\n<pre>&gt; {escape(command)}\n\n" if markup else f"{status}\n> {command}\n\n"
+    tail = "</pre>" if markup else ""
+    limit = max(CMD_MESSAGE_LIMIT - len(head) - len(tail), CMD_OUTPUT_MIN)
+    body = escape(output)
+    keep = limit
+    while len(body) > limit:
+        body = "...\n" + escape(output[-keep:])
+        keep = keep * limit // len(body)
+    return head + body + tail
+
+
+def edit_cmd_message(job, output, status, reply_markup=None):
+    def fall_back_to_plain_text(future):
+        error = future.exception()
+        if error is None or "message is not modified" in str(error):
+            return
+        try:
+            bot.edit_message_text(format_cmd_output(job, output, status, False), job["chat_id"], job["message_id"],
+                                  reply_markup=reply_markup)
+        except:
+            pass
+
+    try:
+        bot.edit_message_text(format_cmd_output(job, output, status), job["chat_id"], job["message_id"],
+                              reply_markup=reply_markup, parse_mode="HTML").add_done_callback(fall_back_to_plain_text)
+    except:
+        pass
+
+
+def finish_cmd_job(job, output):
+    if job["cancelled"]:
+        status = "⛔ Команда отменена"
+    elif job["timed_out"]:
+        status = f"⌛ Превышено время ожидания ({job['timeout']} с)"
+    else:
+        status = f"✅ Команда выполнена (код {job['returncode']})"
+
+    output = output or "Команда выполнена"
+    log_command(job["command"], output)
+
+    edit_cmd_message(job, output, status)
+
+    if len(output) > CMD_MESSAGE_LIMIT:
+        bot.send_document(job["chat_id"], io.BytesIO(output.encode("utf-8")), visible_file_name="output.txt")
+
+
+def run_cmd_job(job):
+    chunks = []
+    lock = threading.Lock()
+    progress = {"last_edit": time.monotonic(), "timer": None, "done": False}
+
+    def edit_progress():
+        with lock:
+            progress["timer"] = None
+            if progress["done"]:
+                return
+            progress["last_edit"] = time.monotonic()
+            edit_cmd_message(job, "".join(chunks), "⏳ Выполняется...", create_cmd_keyboard(job["id"]))
+
+    def on_output(line):
+        with lock:
+            chunks.append(line)
+            if progress["timer"] is not None:
+                return
+            delay = CMD_EDIT_INTERVAL - (time.monotonic() - progress["last_edit"])
+            if delay > 0:
+                progress["timer"] = threading.Timer(delay, edit_progress)
+                progress["timer"].daemon = True
+                progress["timer"].start()
+                return
+        edit_progress()
+
+    def stop_progress():
+        with lock:
+            progress["done"] = True
+            if progress["timer"] is not None:
+                progress["timer"].cancel()
+
+    try:
+        session = shell_sessions.get(job["chat_id"])
+        if not session.reserve():
+            session = OneShotCommand(session.cwd)
+        job["session"] = session
+        if job["cancelled"]:
+            session.interrupt(job["id"])
+        job["returncode"], interrupted = session.run(job["command"], job["id"], on_output, job["timeout"])
+        job["timed_out"] = interrupted and not job["cancelled"]
+        stop_progress()
+        finish_cmd_job(job, "".join(chunks).rstrip())
+    except Exception as e:
+        log_command(job["command"], f"Error: {str(e)}")
+        try:
+            bot.send_message(job["chat_id"], f"⚠️ Ошибка: {str(e)}")
+        except:
+            pass
+    finally:
+        stop_progress()
+        with cmd_jobs_lock:
+            cmd_jobs.pop(job["id"], None)
+
+
+def start_cmd_job(chat_id, command, timeout):
+    with cmd_jobs_lock:
+        if len(cmd_jobs) >= CMD_MAX_JOBS:
+            return None
+        job = {
+            "id": to_base36(next(cmd_job_ids)),
+            "command": command,
+            "timeout": timeout,
+            "chat_id": chat_id,
+            "message_id": None,
+            "session": None,
+            "returncode": None,
+            "cancelled": False,
+            "timed_out": False
+        }
+        cmd_jobs[job["id"]] = job
+    return job
+
+
+KEY_COMBINATION_HOTKEYS = {
+    "alt_tab": ("Alt+Tab", ('alt', 'tab')),
+    "ctrl_c": ("Ctrl+C", ('ctrl', 'c')),
+    "ctrl_v": ("Ctrl+V", ('ctrl', 'v')),
+    "ctrl_z": ("Ctrl+Z", ('ctrl', 'z')),
+    "ctrl_a": ("Ctrl+A", ('ctrl', 'a')),
+    "ctrl_s": ("Ctrl+S", ('ctrl', 's')),
+    "win_e": ("Win+E", ('win', 'e')),
+    "win_r": ("Win+R", ('win', 'r')),
+    "win_d": ("Win+D", ('win', 'd')),
+    "ctrl_shift_esc": ("Ctrl+Shift+Esc", ('ctrl', 'shift', 'esc')),
+    "alt_f4": ("Alt+F4", ('alt', 'f4'))
+}
+
+MACRO_FILE = "macros.json"
+MACRO_MAX_STEPS = 200
+MACRO_MAX_TEXT = 1000
+MACRO_MAX_REPEAT = 50
+MACRO_MAX_WAIT = 10
+MACRO_MAX_DURATION = 120
+MACRO_MENU_LIMIT = 40
+MACRO_NAME_MAX_BYTES = 48
+MACRO_NAME_PATTERN = re.compile(r"[\w-]+")
+MACRO_MOUSE_BUTTONS = ("left", "right", "middle")
+
+
+def split_macro(text):
+    statements = []
+    current = []
+    quote = None
+    for char in text:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in ";\n":
+            statements.append("".join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    if quote:
+        raise ValueError("незакрытая кавычка")
+    statements.append("".join(current).strip())
+    return [statement for statement in statements if statement]
+
+
+def parse_macro_int(value, number, minimum=None, maximum=None):
+    try:
+        result = int(value)
+    except ValueError:
+        raise ValueError(f"шаг {number}: '{value}' не является целым числом")
+    if minimum is not None and result < minimum:
+        raise ValueError(f"шаг {number}: {result} меньше {minimum}")
+    if maximum is not None and result > maximum:
+        raise ValueError(f"шаг {number}: {result} больше {maximum}")
+    return result
+
+
+def parse_macro_point(args, number, minimum=None):
+    values = [value for value in ",".join(args).split(",") if value]
+    if len(values) != 2:
+        raise ValueError(f"шаг {number}: ожидаются координаты x,y")
+    return [parse_macro_int(value, number, minimum) for value in values]
+
+
+def parse_macro_key(key, number, key_names):
+    key = key.lower()
+    if key not in key_names:
+        raise ValueError(f"шаг {number}: неизвестная клавиша '{key}'")
+    return key
+
+
+def parse_macro(text):
+    key_names = set(backends.input.key_names())
+    steps = []
+    total_wait = 0
+    for number, statement in enumerate(split_macro(text), 1):
+        if number > MACRO_MAX_STEPS:
+            raise ValueError(f"слишком много шагов, максимум {MACRO_MAX_STEPS}")
+        try:
+            words = shlex.split(statement)
+        except ValueError as e:
+            raise ValueError(f"шаг {number}: {e}")
+        op, args = words[0].lower(), words[1:]
+
+        if op in ("move", "moveto"):
+            steps.append([op] + parse_macro_point(args, number, 0 if op == "moveto" else None))
+        elif op == "click":
+            button = "left"
+            if args and not args[0].isdigit():
+                button = args.pop(0).lower()
+                if button not in MACRO_MOUSE_BUTTONS:
+                    raise ValueError(f"шаг {number}: неизвестная кнопка мыши '{button}'")
+            count = parse_macro_int(args.pop(0), number, 1, MACRO_MAX_REPEAT) if args else 1
+            if args:
+                raise ValueError(f"шаг {number}: лишние аргументы у click")
+            steps.append(["click", button, count])
+        elif op == "scroll":
+            if len(args) != 1:
+                raise ValueError(f"шаг {number}: ожидается scroll N")
+            steps.append(["scroll", parse_macro_int(args[0], number)])
+        elif op == "press":
+            if not 1 <= len(args) <= 2:
+                raise ValueError(f"шаг {number}: ожидается press клавиша [количество]")
+            count = parse_macro_int(args[1], number, 1, MACRO_MAX_REPEAT) if len(args) == 2 else 1
+            steps.append(["press", parse_macro_key(args[0], number, key_names), count])
+        elif op == "hotkey":
+            keys = [key for key in "+".join(args).split("+") if key]
+            if not keys:
+                raise ValueError(f"шаг {number}: ожидается hotkey клавиша+клавиша")
+            steps.append(["hotkey"] + [parse_macro_key(key, number, key_names) for key in keys])
+        elif op == "type":
+            value = " ".join(args)
+            if not value or len(value) > MACRO_MAX_TEXT:
+                raise ValueError(f"шаг {number}: текст должен быть от 1 до {MACRO_MAX_TEXT} символов")
+            steps.append(["type", value])
+        elif op == "wait":
+            try:
+                seconds = float(args[0]) if len(args) == 1 else None
+            except ValueError:
+                seconds = None
+            if seconds is None or not 0 < seconds <= MACRO_MAX_WAIT:
+                raise ValueError(f"шаг {number}: ожидается wait секунды (до {MACRO_MAX_WAIT})")
+            total_wait += seconds
+            steps.append(["wait", seconds])
+        else:
+            raise ValueError(f"шаг {number}: неизвестная команда '{op}'")
+
+    if not steps:
+        raise ValueError("макрос пуст")
+    if total_wait > MACRO_MAX_DURATION:
+        raise ValueError(f"суммарное ожидание больше {MACRO_MAX_DURATION} секунд")
+    return steps
+
+
+def format_macro_step(step):
+    op, args = step[0], step[1:]
+    if op in ("move", "moveto"):
+        return f"{op} {args[0]},{args[1]}"
+    if op == "click":
+        return " ".join(["click"] + ([args[0]] if args[0] != "left" else []) + ([str(args[1])] if args[1] > 1 else []))
+    if op == "press":
+        return f"press {args[0]}" + (f" {args[1]}" if args[1] > 1 else "")
+    if op == "hotkey":
+        return "hotkey " + "+".join(args)
+    if op == "type":
+        return "type " + shlex.quote(args[0])
+    if op == "wait":
+        return f"wait {args[0]:g}"
+    return f"{op} {args[0]}"
+
+
+def format_macro(steps):
+    return "; ".join(format_macro_step(step) for step in steps)
+
+
+def valid_macro_name(name):
+    return bool(MACRO_NAME_PATTERN.fullmatch(name)) and len(name.encode("utf-8")) <= MACRO_NAME_MAX_BYTES
+
+
+def execute_macro_step(step):
+    op, args = step[0], step[1:]
+    if op == "move":
+        backends.input.move(*args)
+    elif op == "moveto":
+        backends.input.move_to(*args)
+    elif op == "click":
+        backends.input.click(button=args[0], clicks=args[1])
+    elif op == "scroll":
+        backends.input.scroll(args[0])
+    elif op == "press":
+        backends.input.press(args[0], presses=args[1])
+    elif op == "hotkey":
+        backends.input.hotkey(*args)
+    elif op == "type":
+        backends.input.write(args[0])
+
+
+class MacroRunner:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.condition = threading.Condition()
+        self.generation = 0
+
+    def submit(self, steps):
+        with self.condition:
+            generation = self.generation
+        return self.executor.submit(self.run, steps, generation)
+
+    def stop(self):
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+
+    def stopped(self, generation, timeout=0):
+        with self.condition:
+            return self.condition.wait_for(lambda: generation != self.generation, timeout)
+
+    def run(self, steps, generation):
+        started = time.time()
+        done = 0
+        for step in steps:
+            if self.stopped(generation, step[1] if step[0] == "wait" else 0):
+                break
+            try:
+                execute_macro_step(step)
+            except Exception as e:
+                raise RuntimeError(f"шаг {done + 1} ({format_macro_step(step)}): {e}")
+            done += 1
+        return done, time.time() - started
+
+
+macro_runner = MacroRunner()
+
+
+class MacroStore:
+    def __init__(self, path=MACRO_FILE):
+        self.path = path
+        self.macros = {}
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def ensure_loaded(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.macros.update(json.load(f))
+        except (OSError, ValueError, TypeError):
+            pass
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.macros, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.error(f"Failed to save macros: {e}")
+
+    def names(self):
+        with self.lock:
+            self.ensure_loaded()
+            return sorted(self.macros)
+
+    def get(self, name):
+        with self.lock:
+            self.ensure_loaded()
+            return self.macros.get(name)
+
+    def put(self, name, text):
+        with self.lock:
+            self.ensure_loaded()
+            self.macros[name] = text
+            self.save()
+
+    def delete(self, name):
+        with self.lock:
+            self.ensure_loaded()
+            if self.macros.pop(name, None) is None:
+                return False
+            self.save()
+            return True
+
+
+macros = MacroStore()
+
+
+def record_macro_step(chat_id, *step):
+    session = get_session(chat_id)
+    with session.lock:
+        steps = session.macro_recording
+        if steps is None:
+            return
+        last = steps[-1] if steps else None
+        if last and step[0] == last[0] == "move":
+            steps[-1] = ["move", last[1] + step[1], last[2] + step[2]]
+        elif last and step[0] == last[0] == "scroll":
+            steps[-1] = ["scroll", last[1] + step[1]]
+        elif last and step[0] == last[0] == "press" and step[1] == last[1] and last[2] < MACRO_MAX_REPEAT:
+            steps[-1] = ["press", last[1], last[2] + 1]
+        elif len(steps) < MACRO_MAX_STEPS:
+            steps.append(list(step))
+
+
+def report_macro(chat_id, label, steps, future):
+    try:
+        done, elapsed = future.result()
+        if done == len(steps):
+            text = f"✅ Макрос {label} выполнен: {done} шагов за {elapsed:.1f} с"
+            log_command("Macro", f"{label}: {len(steps)} steps in {elapsed:.2f}s: {format_macro(steps)}")
+        else:
+            text = f"⛔ Макрос {label} прерван после {done} из {len(steps)} шагов"
+            log_command("Macro", f"{label}: stopped after {done}/{len(steps)} steps: {format_macro(steps)}")
+    except Exception as e:
+        text = f"❌ Ошибка макроса {label}: {str(e)}"
+        log_command("Macro", f"{label}: failed: {e}")
+    try:
+        bot.send_message(chat_id, text)
+    except:
+        pass
+
+
+def run_macro(chat_id, label, text):
+    steps = parse_macro(text)
+    future = macro_runner.submit(steps)
+    future.add_done_callback(lambda future: report_macro(chat_id, label, steps, future))
+    return steps
+
+
+def create_macro_keyboard(chat_id):
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    buttons = [InlineKeyboardButton(f"▶️ {name}", callback_data=f"macro_run_{name}")
+               for name in macros.names()[:MACRO_MENU_LIMIT]]
+    keyboard.add(*buttons)
+    if get_session(chat_id).macro_recording is None:
+        keyboard.add(InlineKeyboardButton("🔴 Записать", callback_data="macro_record"))
+    else:
+        keyboard.add(InlineKeyboardButton("⏹ Остановить запись", callback_data="macro_record_stop"))
+    keyboard.add(InlineKeyboardButton("⛔ Прервать выполнение", callback_data="macro_stop"))
+    keyboard.add(InlineKeyboardButton("🔙 Назад", callback_data="key_emulation"))
+    return keyboard
+
+
+def create_macro_message(chat_id):
+    steps = get_session(chat_id).macro_recording
+    text = "📼 Макросы\n\n"
+    if steps is not None:
+        text += f"🔴 Идет запись: {len(steps)} шагов. Пользуйтесь клавишами и мышью, затем остановите запись.\n\n"
+    text += ("Макрос можно отправить текстом: /macro move 400,-120; click; type \"hello\"; hotkey ctrl+s\n"
+             "Команды: move dx,dy · moveto x,y · click [left|right|middle] [N] · scroll N · press клавиша [N] · "
+             "hotkey a+b · type \"текст\" · wait секунды")
+    return text
+
+
+for lane, lane_name in OUTBOUND_LANE_NAMES.items():
+    metrics.register("telegram_queue_depth", lambda lane=lane: len(bot.outbound.lanes[lane]), lane=lane_name)
+metrics.register("bot_handler_queue_depth", lambda: bot.worker_pool.tasks.qsize())
+metrics.register("sessions_active", lambda: sum(len(entries) for lock, entries in sessions.stripes))
+metrics.register("shell_sessions_active", lambda: len(shell_sessions.sessions))
+metrics.register("cmd_jobs_running", lambda: len(cmd_jobs))
+metrics.register("screen_watches_active", lambda: len(screen_watches))
+metrics.register("notifications_pending", lambda: len(notifications.pending))
+metrics.register("notifications_shown_total", lambda: notifications.shown, "counter")
+metrics.register("keyboard_cache_hits_total", lambda: keyboard_cache.hits, "counter")
+metrics.register("keyboard_cache_misses_total", lambda: keyboard_cache.misses, "counter")
+
+
+def format_latency_table(title, series):
+    rows = sorted(series.items(), key=lambda item: item[1].count, reverse=True)[:STATS_TOP]
+    if not rows:
+        return []
+    lines = [title]
+    for labels, histogram in rows:
+        name = ", ".join(str(value) for key, value in labels) or "-"
+        p50, p95, p99 = (histogram.quantile(fraction) * 1000 for fraction in (0.5, 0.95, 0.99))
+        lines.append(f"• {name}: {p50:.1f} / {p95:.1f} / {p99:.1f} мс, ×{histogram.count}")
+    return lines + [""]
+
+
+def format_stats():
+    uptime = int(time.time() - metrics.started)
+    lines = [f"📈 Статистика за {uptime // 3600} ч {uptime % 3600 // 60} мин (p50 / p95 / p99, количество)", ""]
+    lines += format_latency_table("🔘 Кнопки:", metrics.series("bot_action_seconds"))
+    lines += format_latency_table("💬 Обработчики:", metrics.series("bot_handler_seconds"))
+    lines += format_latency_table("📡 Запросы к Telegram:", metrics.series("telegram_request_seconds"))
+    lines += format_latency_table("⏳ Ожидание в очереди отправки:", metrics.series("telegram_queue_seconds"))
+    lines.append(f"❗ Ошибки: обработчики {metrics.total('bot_handler_errors_total')}, "
+                 f"кнопки {metrics.total('bot_action_errors_total')}, "
+                 f"Telegram {metrics.total('telegram_request_errors_total')}, "
+                 f"повторы после 429: {metrics.total('telegram_retries_total')}")
+    lines.append(f"📤 Отправлено файлов и фото: {format_size(metrics.total('telegram_upload_bytes_total'))}")
+    lines += ["", "📊 Состояние:"]
+    for name, labels, kind, value in sorted(metrics.collect(), key=lambda item: item[:2]):
+        suffix = " " + ", ".join(f"{key}={label}" for key, label in labels) if labels else ""
+        lines.append(f"• {name}{suffix}: {value}")
+    return "\n".join(lines)
+
+
+class ActionRouter:
+    def __init__(self):
+        self.exact = {}
+        self.prefixes = {}
+
+    def action(self, name):
+        def register(handler):
+            self.exact[name] = handler
+            return handler
+        return register
+
+    def prefix(self, prefix):
+        def register(handler):
+            node = self.prefixes
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[None] = handler
+            return handler
+        return register
+
+    def resolve(self, action):
+        handler = self.exact.get(action)
+        if handler is not None:
+            return handler, ()
+
+        node = self.prefixes
+        match = None
+        for index, char in enumerate(action):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                match = (node[None], (action[index + 1:],))
+        return match
+
+    def dispatch(self, call):
+        match = self.resolve(call.data)
+        if match is None:
+            return False
+        handler, args = match
+        action = handler.__name__.replace("action_", "", 1)
+        started = time.perf_counter()
+        try:
+            handler(call, *args)
+        except Exception:
+            metrics.inc("bot_action_errors_total", action=action)
+            raise
+        finally:
+            metrics.observe("bot_action_seconds", time.perf_counter() - started, action=action)
+        return True
+
+
+router = ActionRouter()
+
+
+@bot.message_handler(func=lambda message: message.chat.id != config.CHAT_ID)
+def handle_unauthorized(message):
+    bot.reply_to(message, "⛔ Доступ запрещен")
+
+
+@bot.message_handler(commands=['start', 'help', 'menu'])
+def send_welcome(message):
+    if message.chat.id != config.CHAT_ID:
+        return
+
+    if check_system_uptime():
+        bot.send_message(message.chat.id, "🖥️ Компьютер был запущен недавно")
+
+    help_text = (
+        "🤖 ControlPCbotV2 - Бот управления компьютером\n\n"
+        "Доступные команды:\n"
+        "/menu - Главное меню\n"
+        "/cmd [команда] - Выполнить команду в CMD\n"
+        "/cmd -t [секунды] [команда] - Выполнить с другим таймаутом\n"
+        "/cmdreset - Перезапустить сессию командной строки\n"
+        "/log [N] [type:тип] [from:дата] [to:дата] [текст] - Поиск по логу команд\n"
+        "/log file - Весь лог файлом\n"
+        "/screenshot [jpeg|webp|png] [q=1-100] [max=пиксели] [region=x,y,ширина,высота] - Скриншот с настройками\n"
+        "/watch [секунды] - Наблюдение за экраном, /watch stop - остановить\n"
+        "/find [имя] - Поиск файлов и папок на всех дисках\n"
+        "/macro [шаги|run|save|del|list|stop] - Макросы клавиатуры и мыши\n"
+        "/stats - Статистика времени ответа и очередей\n"
+        "/profile start [sample|cprofile] [секунды], /profile stop - Профилирование обработчиков\n\n"
+        "⚠️ Для выполнения команд требуются права администратора\n\n"
         "Автор: https://github.com/MrachniyTipchek"
     )
     keyboard = create_main_menu()
     bot.send_message(message.chat.id, help_text, reply_markup=keyboard)
 
 
-@bot.message_handler(commands=['control'])
-def show_control_menu(message):
-    if message.chat.id != config.CHAT_ID:
+@bot.message_handler(commands=['control'])
+def show_control_menu(message):
+    if message.chat.id != config.CHAT_ID:
+        return
+    keyboard = create_main_menu()
+    bot.send_message(message.chat.id, "📱 Главное меню управления ControlPCbotV2:", reply_markup=keyboard)
+
+
+@bot.message_handler(commands=['log'])
+def send_log(message):
+    if message.chat.id != config.CHAT_ID:
+        return
+    try:
+        send_log_query(message.chat.id, message.text.replace('/log', '', 1))
+    except Exception as e:
+        bot.reply_to(message, f"⚠️ Ошибка: {str(e)}")
+
+
+@bot.message_handler(commands=['screenshot'])
+def handle_screenshot_command(message):
+    if message.chat.id != config.CHAT_ID:
+        return
+    try:
+        options = parse_screenshot_options(message.text.replace('/screenshot', '', 1))
+    except ValueError as e:
+        bot.reply_to(message, f"ℹ️ Использование: /screenshot [jpeg|webp|png] [q=1-100] [max=пиксели] "
+                              f"[region=x,y,ширина,высота]\n\n❌ {str(e)}")
+        return
+
+    session = get_session(message.chat.id)
+    for key in ("image_format", "quality", "max_size"):
+        if key in options:
+            setattr(session, f"screenshot_{key.replace('image_', '')}", options[key])
+    screenshot_executor.submit(send_screenshot, message.chat.id, **options)
+
+
+@bot.message_handler(commands=['watch'])
+def handle_watch_command(message):
+    if message.chat.id != config.CHAT_ID:
+        return
+    args = message.text.replace('/watch', '', 1).strip()
+    if args == "stop":
+        if not stop_screen_watch(message.chat.id):
+            bot.reply_to(message, "ℹ️ Наблюдение не запущено")
+        return
+    if args and not args.isdigit():
+        bot.reply_to(message, "ℹ️ Использование: /watch [интервал в секундах] или /watch stop")
+        return
+    start_screen_watch(message.chat.id, int(args) if args else WATCH_INTERVAL)
+
+
+@bot.message_handler(commands=['stats'])
+def handle_stats(message):
+    if message.chat.id != config.CHAT_ID:
+        return
+    try:
+        bot.send_message(message.chat.id, format_stats())
+    except Exception as e:
+        bot.reply_to(message, f"⚠️ Ошибка: {str(e)}")
+
+
+@bot.message_handler(commands=['profile'])
+def handle_profile(message):
+    if message.chat.id != config.CHAT_ID:
+        return
+
+    args = message.text.lower().split()[1:]
+    usage = (f"ℹ️ Использование: /profile start [sample|cprofile] [секунды], /profile stop\n"
+             f"sample - сэмплирование стеков раз в {PROFILE_SAMPLE_INTERVAL * 1000:.0f} мс, "
+             f"cprofile - точный профиль каждого вызова. По умолчанию {PROFILE_DEFAULT_SECONDS} с, "
+             f"максимум {PROFILE_MAX_SECONDS} с")
+    if args[:1] == ["stop"]:
+        session = profiler.stop()
+        if session is None:
+            bot.reply_to(message, "ℹ️ Профилирование не запущено")
+        else:
+            send_profile_report(session)
+        return
+    if args[:1] != ["start"]:
+        session = profiler.session
+        if session is not None:
+            bot.reply_to(message, f"⏱ Идет профилирование ({session.mode}): {session.elapsed():.0f} из "
+                                  f"{session.seconds} с\n\n{usage}")
+        else:
+            bot.reply_to(message, usage)
+        return
+
+    mode, seconds = PROFILE_MODES[0], PROFILE_DEFAULT_SECONDS
+    for arg in args[1:]:
+        if arg in PROFILE_MODES:
+            mode = arg
+        elif arg.isdigit() and 0 < int(arg) <= PROFILE_MAX_SECONDS:
+            seconds = int(arg)
+        else:
+            bot.reply_to(message, usage)
+            return
+    if profiler.start(message.chat.id, mode, seconds) is None:
+        bot.reply_to(message, "ℹ️ Профилирование уже запущено, остановите его: /profile stop")
         return
-    keyboard = create_main_menu()
-    bot.send_message(message.chat.id, "📱 Главное меню управления ControlPCbotV2:", reply_markup=keyboard)
+    bot.reply_to(message, f"⏱ Профилирование ({mode}) запущено на {seconds} с. Отчет придет автоматически "
+                          f"или по /profile stop")
+    log_command("Profile", f"Started {mode} for {seconds}s")
 
 
-@bot.message_handler(commands=['log'])
-def send_log(message):
+@bot.message_handler(commands=['find'])
+def handle_find_command(message):
     if message.chat.id != config.CHAT_ID:
         return
-    try:
-        with open("command_log.txt", "rb") as f:
-            bot.send_document(message.chat.id, f, caption="📝 Лог команд")
-    except Exception as e:
-        bot.reply_to(message, f"⚠️ Ошибка: {str(e)}")
+    query = message.text.replace('/find', '', 1).strip()
+    if not query:
+        bot.reply_to(message, "ℹ️ Использование: /find [часть имени файла или папки]")
+        return
+    if not file_index.ready():
+        file_index.refresh_async(max_age=0)
+        bot.reply_to(message, "⏳ Индекс файлов ещё строится, повторите поиск через несколько минут")
+        return
+
+    started = time.perf_counter()
+    results = file_index.search(query)
+    elapsed = (time.perf_counter() - started) * 1000
+    file_index.refresh_async()
+
+    if not results:
+        bot.reply_to(message, f"🔍 Ничего не найдено по запросу «{query}» ({elapsed:.0f} мс)")
+        return
+    session = get_session(message.chat.id)
+    with session.lock:
+        session.find_query = query
+        session.find_results = results
+        session.find_page = 0
+        content = create_find_message(session)
+        keyboard = create_find_keyboard(message.chat.id)
+    bot.send_message(message.chat.id, f"{content}\n\n⏱ {elapsed:.0f} мс", reply_markup=keyboard)
 
 
 @bot.message_handler(commands=['cmd'])
@@ -399,33 +4295,36 @@ def handle_cmd_command(message):
     if not command:
         bot.reply_to(message, "ℹ️ Использование: /cmd [команда]")
         return
+    timeout, command = parse_cmd_timeout(command)
+    job = start_cmd_job(message.chat.id, command, timeout)
+    if job is None:
+        bot.reply_to(message, f"⏳ Уже выполняется {CMD_MAX_JOBS} команд, дождитесь завершения или отмените одну из них")
+        return
+
     show_notification(f"CMD: {command}")
     try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=30,
-            encoding='cp866',
-            cwd=os.path.expanduser("~")
-        )
-        output = result.stdout or result.stderr or "Команда выполнена"
-        log_command(command, output)
-
-        if len(output) > 4000:
-            with open("output.txt", "w", encoding="utf-8") as f:
-                f.write(output)
-            with open("output.txt", "rb") as f:
-                bot.send_document(message.chat.id, f)
-            os.remove("output.txt")
-        else:
-            bot.reply_to(message, f"```\n{output}\n```", parse_mode="Markdown")
+        reply = bot.reply_to(message, format_cmd_output(job, "", "⏳ Выполняется..."),
+                             reply_markup=create_cmd_keyboard(job["id"]), parse_mode="HTML")
+        job["message_id"] = reply.message_id
+        cmd_executor.submit(run_cmd_job, job)
     except Exception as e:
+        with cmd_jobs_lock:
+            cmd_jobs.pop(job["id"], None)
         log_command(command, f"Error: {str(e)}")
         bot.reply_to(message, f"⚠️ Ошибка: {str(e)}")
 
 
+@bot.message_handler(commands=['cmdreset'])
+def handle_cmd_reset(message):
+    if message.chat.id != config.CHAT_ID:
+        return
+    if shell_sessions.reset(message.chat.id):
+        bot.reply_to(message, "🔄 Сессия командной строки перезапущена")
+        log_command("CMD Reset", "Shell session closed")
+    else:
+        bot.reply_to(message, "ℹ️ Активной сессии командной строки нет")
+
+
 @bot.message_handler(commands=['cmdlist'])
 def cmd_list(message):
     if message.chat.id != config.CHAT_ID:
@@ -448,6 +4347,79 @@ def cmd_list(message):
     bot.send_message(message.chat.id, cmd_help, parse_mode="Markdown")
 
 
+@bot.message_handler(commands=['macro'])
+def handle_macro(message):
+    if message.chat.id != config.CHAT_ID:
+        return
+
+    parts = message.text.split(maxsplit=1)
+    argument = parts[1].strip() if len(parts) > 1 else ""
+    words = argument.split(maxsplit=2)
+    subcommand = words[0].lower() if words else ""
+    try:
+        if not argument:
+            bot.send_message(message.chat.id, create_macro_message(message.chat.id),
+                             reply_markup=create_macro_keyboard(message.chat.id))
+        elif subcommand == "list":
+            names = macros.names()
+            if not names:
+                bot.reply_to(message, "ℹ️ Сохраненных макросов нет")
+            else:
+                bot.reply_to(message, "📼 Макросы:\n\n" + "\n".join(f"• {name}: {macros.get(name)}" for name in names))
+        elif subcommand == "stop":
+            macro_runner.stop()
+            bot.reply_to(message, "⛔ Выполнение макросов прервано")
+        elif subcommand in ("run", "del") and len(words) == 2:
+            name = words[1]
+            if subcommand == "del":
+                if macros.delete(name):
+                    bot.reply_to(message, f"🗑 Макрос {name} удален")
+                    log_command("Macro", f"Deleted {name}")
+                else:
+                    bot.reply_to(message, f"❌ Макрос {name} не найден")
+            elif macros.get(name) is None:
+                bot.reply_to(message, f"❌ Макрос {name} не найден")
+            else:
+                steps = run_macro(message.chat.id, name, macros.get(name))
+                bot.reply_to(message, f"▶️ Макрос {name} запущен: {len(steps)} шагов")
+        elif subcommand == "save" and len(words) == 3:
+            name = words[1]
+            if not valid_macro_name(name):
+                bot.reply_to(message, "❌ Имя макроса: буквы, цифры, _ и -, не длиннее 48 байт")
+                return
+            text = format_macro(parse_macro(words[2]))
+            macros.put(name, text)
+            bot.reply_to(message, f"💾 Макрос {name} сохранен: {text}")
+            log_command("Macro", f"Saved {name}: {text}")
+        elif subcommand in ("run", "del", "save"):
+            bot.reply_to(message, "ℹ️ Использование: /macro run имя, /macro del имя, /macro save имя шаги")
+        else:
+            steps = run_macro(message.chat.id, "из сообщения", argument)
+            bot.reply_to(message, f"▶️ Макрос запущен: {len(steps)} шагов")
+    except ValueError as e:
+        bot.reply_to(message, f"❌ Ошибка в макросе: {str(e)}")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Ошибка: {str(e)}")
+
+
+@bot.message_handler(
+    func=lambda message: message.chat.id == config.CHAT_ID and get_session(message.chat.id).waiting_for_macro_name)
+def handle_macro_name(message):
+    session = get_session(message.chat.id)
+    name = (message.text or "").strip()
+    if not valid_macro_name(name):
+        bot.reply_to(message, "❌ Имя макроса: буквы, цифры, _ и -, не длиннее 48 байт. Введите другое имя:")
+        return
+    text = session.consume("waiting_for_macro_name")
+    if text is None:
+        return
+    macros.put(name, text)
+    bot.reply_to(message, f"💾 Макрос {name} сохранен: {text}")
+    log_command("Macro", f"Recorded {name}: {text}")
+    bot.send_message(message.chat.id, create_macro_message(message.chat.id),
+                     reply_markup=create_macro_keyboard(message.chat.id))
+
+
 @bot.message_handler(commands=['autorun'])
 def handle_autorun(message):
     if message.chat.id != config.CHAT_ID:
@@ -465,12 +4437,14 @@ def handle_autorun(message):
 
 
 @bot.message_handler(
-    func=lambda message: user_state.get("waiting_for_emulation_text") and message.chat.id == config.CHAT_ID)
+    func=lambda message: message.chat.id == config.CHAT_ID and get_session(message.chat.id).waiting_for_emulation_text)
 def handle_emulation_text(message):
-    user_state["waiting_for_emulation_text"] = False
+    if not get_session(message.chat.id).consume("waiting_for_emulation_text", False):
+        return
     text = message.text
     try:
-        pyautogui.write(text)
+        backends.input.write(text)
+        record_macro_step(message.chat.id, "type", text)
         bot.reply_to(message, f"✅ Текст введен: '{text}'")
         log_command("Text Emulation", f"Text: {text}")
     except Exception as e:
@@ -480,545 +4454,830 @@ def handle_emulation_text(message):
     bot.send_message(message.chat.id, "📱 Возврат в главное меню:", reply_markup=keyboard)
 
 
-@bot.message_handler(
-    func=lambda message: user_state.get("waiting_for_process_kill") and message.chat.id == config.CHAT_ID)
-def handle_process_kill_input(message):
-    user_state["waiting_for_process_kill"] = False
-    process_number = message.text.strip()
+@bot.message_handler(
+    func=lambda message: message.chat.id == config.CHAT_ID and get_session(message.chat.id).waiting_for_process_kill)
+def handle_process_kill_input(message):
+    session = get_session(message.chat.id)
+    if not session.consume("waiting_for_process_kill", False):
+        return
+    process_list = session.process_list
+    process_number = message.text.strip()
+
+    try:
+        index = int(process_number) - 1
+        if 0 <= index < len(process_list):
+            pid, create_time = process_list[index]
+            try:
+                process = psutil.Process(pid)
+                if create_time is not None and process.create_time() != create_time:
+                    raise psutil.NoSuchProcess(pid, msg="процесс уже завершен, PID занят другим процессом")
+                process_name = process.name()
+                process.terminate()
+                bot.reply_to(message, f"✅ Процесс {process_name} (PID: {pid}) завершен")
+                log_command("Kill Process", f"Terminated {process_name} (PID: {pid})")
+            except Exception as e:
+                bot.reply_to(message, f"❌ Ошибка завершения процесса: {str(e)}")
+        else:
+            bot.reply_to(message, "❌ Неверный номер процесса")
+    except ValueError:
+        bot.reply_to(message, "❌ Введите корректный номер")
+
+    keyboard = create_main_menu()
+    bot.send_message(message.chat.id, "📱 Возврат в главное меню:", reply_markup=keyboard)
+
+
+@bot.callback_query_handler(func=lambda call: call.message.chat.id != config.CHAT_ID)
+def handle_unauthorized_callback(call):
+    bot.answer_callback_query(call.id, "⛔ Доступ запрещен")
+
+
+@router.action("main_menu")
+def action_main_menu(call):
+    keyboard = create_main_menu()
+    try:
+        bot.edit_message_text("📱 Главное меню управления ControlPCbotV2:", call.message.chat.id,
+                              call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("autostart")
+def action_autostart(call):
+    try:
+        if toggle_autostart():
+            status = "добавлен в автозагрузку" if check_autostart() else "удален из автозагрузки"
+            bot.answer_callback_query(call.id, f"✅ Бот {status}")
+            log_command("Autorun", f"Toggled, now: {status}")
+        else:
+            bot.answer_callback_query(call.id, "❌ Ошибка управления автозагрузкой")
+
+        keyboard = create_main_menu()
+        bot.edit_message_text("📱 Главное меню управления ControlPCbotV2:", call.message.chat.id,
+                              call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("shutdown")
+def action_shutdown(call):
+    try:
+        keyboard = InlineKeyboardMarkup()
+        keyboard.add(
+            InlineKeyboardButton("✅ Да, завершить", callback_data="shutdown_confirm"),
+            InlineKeyboardButton("❌ Нет, отмена", callback_data="shutdown_cancel")
+        )
+        bot.edit_message_text("⚠️ Вы уверены, что хотите выключить компьютер?", call.message.chat.id,
+                              call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("shutdown_confirm")
+def action_shutdown_confirm(call):
+    try:
+        bot.edit_message_text("✅ Компьютер будет выключен через 1 минуту!", call.message.chat.id,
+                              call.message.message_id)
+        log_command("System Shutdown", "Initiated by bot")
+        os.system("shutdown /s /t 60")
+    except:
+        pass
+
+
+@router.action("shutdown_cancel")
+def action_shutdown_cancel(call):
+    keyboard = create_main_menu()
+    try:
+        bot.edit_message_text("❌ Выключение отменено", call.message.chat.id,
+                              call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("reboot")
+def action_reboot(call):
+    try:
+        keyboard = InlineKeyboardMarkup()
+        keyboard.add(
+            InlineKeyboardButton("✅ Да, перезагрузить", callback_data="reboot_confirm"),
+            InlineKeyboardButton("❌ Нет, отмена", callback_data="reboot_cancel")
+        )
+        bot.edit_message_text("⚠️ Вы уверены, что хотите перезагрузить компьютер?", call.message.chat.id,
+                              call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("reboot_confirm")
+def action_reboot_confirm(call):
+    try:
+        bot.edit_message_text("✅ Компьютер будет перезагружен через 1 минуту!", call.message.chat.id,
+                              call.message.message_id)
+        log_command("System Reboot", "Initiated by bot")
+        os.system("shutdown /r /t 60")
+    except:
+        pass
+
+
+@router.action("reboot_cancel")
+def action_reboot_cancel(call):
+    keyboard = create_main_menu()
+    try:
+        bot.edit_message_text("❌ Перезагрузка отменена", call.message.chat.id,
+                              call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("screenshot")
+def action_screenshot(call):
+    try:
+        screenshot_executor.submit(send_screenshot, call.message.chat.id)
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+
+
+@router.action("watch_start")
+def action_watch_start(call):
+    try:
+        start_screen_watch(call.message.chat.id)
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+
+
+@router.action("watch_stop")
+def action_watch_stop(call):
+    stop_screen_watch(call.message.chat.id)
+
+
+@router.action("watch_extend")
+def action_watch_extend(call):
+    with screen_watches_lock:
+        watch = screen_watches.get(call.message.chat.id)
+    try:
+        if watch is None:
+            bot.answer_callback_query(call.id, "ℹ️ Наблюдение не запущено")
+        else:
+            watch.touch()
+            bot.answer_callback_query(call.id, f"⏱ Наблюдение продлено на {WATCH_IDLE_TIMEOUT // 60} мин")
+    except:
+        pass
+
+
+@router.action("file_manager")
+def action_file_manager(call):
+    get_session(call.message.chat.id).file_manager_page = 0
+    try:
+        bot.edit_message_text("📁 Управление файлами - выберите диск:", call.message.chat.id,
+                              call.message.message_id,
+                              reply_markup=create_file_manager_keyboard(call.message.chat.id))
+    except:
+        pass
+
+
+@router.prefix("folder_")
+def action_folder(call, value):
+    path = resolve_path_token(call.message.chat.id, value)
+    try:
+        if path is None:
+            bot.answer_callback_query(call.id, "❌ Ссылка устарела, откройте папку заново")
+            return
+
+        if not os.path.exists(path):
+            bot.answer_callback_query(call.id, "❌ Папка не существует")
+            return
+
+        if not os.path.isdir(path):
+            bot.answer_callback_query(call.id, "❌ Это не папка")
+            return
+
+        session = get_session(call.message.chat.id)
+        with session.lock:
+            session.current_directory = path
+            session.file_manager_page = 0
+
+        try:
+            items = listing_cache.get(path, session.file_manager_sort)
+            content = f"📂 Содержимое папки: {path}\n\nНайдено элементов: {len(items)}"
+            bot.edit_message_text(content, call.message.chat.id,
+                                  call.message.message_id,
+                                  reply_markup=create_directory_keyboard(call.message.chat.id, path))
+        except PermissionError:
+            bot.answer_callback_query(call.id, "❌ Нет доступа к папке")
+        except Exception as e:
+            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка доступа: {str(e)}")
+
+
+@router.prefix("file_")
+def action_file(call, value):
+    file_path = resolve_path_token(call.message.chat.id, value)
+    try:
+        if file_path is None:
+            bot.answer_callback_query(call.id, "❌ Ссылка устарела, откройте папку заново")
+        elif os.path.exists(file_path):
+            send_file(call.message.chat.id, file_path)
+        else:
+            bot.answer_callback_query(call.id, "❌ Файл не найден")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка отправки файла: {str(e)}")
+
+
+@router.action("upload_here")
+def action_upload_here(call):
+    session = get_session(call.message.chat.id)
+    current_dir = session.current_directory
+    try:
+        bot.edit_message_text(f"📤 Отправьте файл для загрузки в папку:\n{current_dir}\n\n"
+                              f"💡 С подписью «unzip» ZIP-архив будет распакован", call.message.chat.id,
+                              call.message.message_id)
+        with session.lock:
+            session.waiting_for_path = "upload_file"
+            session.upload_path = current_dir
+    except:
+        pass
+
+
+@router.action("archive_folder")
+def action_archive_folder(call):
+    current_dir = get_session(call.message.chat.id).current_directory
+    try:
+        threading.Thread(target=send_folder_archive, args=(call.message.chat.id, current_dir),
+                         daemon=True).start()
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка архивации: {str(e)}")
+
+
+@router.action("disk_usage")
+def action_disk_usage(call):
+    current_dir = get_session(call.message.chat.id).current_directory
+    try:
+        threading.Thread(target=send_disk_usage, args=(call.message.chat.id, current_dir), daemon=True).start()
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка подсчёта размера: {str(e)}")
+
+
+@router.action("disk_usage_map")
+def action_disk_usage_map(call):
+    summary = get_session(call.message.chat.id).disk_usage
+    try:
+        if summary is None:
+            bot.answer_callback_query(call.id, "❌ Сначала посчитайте размер папки")
+            return
+        bot.send_photo(call.message.chat.id, render_treemap(summary),
+                       caption=f"🗺 {summary['path']}: {format_size(summary['total'])}")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка построения карты: {str(e)}")
+
+
+@router.action("get_file_here")
+def action_get_file_here(call):
+    session = get_session(call.message.chat.id)
+    current_dir = session.current_directory
+    try:
+        bot.edit_message_text(f"📥 Введите имя файла для извлечения из папки:\n{current_dir}", call.message.chat.id,
+                              call.message.message_id)
+        session.waiting_for_path = "get_file"
+    except:
+        pass
+
+
+@router.action("enter_path")
+def action_enter_path(call):
+    try:
+        bot.edit_message_text("⌨️ Введите полный путь к папке:", call.message.chat.id, call.message.message_id)
+        get_session(call.message.chat.id).waiting_for_path = "enter_folder"
+    except:
+        pass
+
+
+@router.action("file_manager_prev")
+def action_file_manager_prev(call):
+    session = get_session(call.message.chat.id)
+    try:
+        with session.lock:
+            if session.file_manager_page > 0:
+                session.file_manager_page -= 1
+            current_dir = session.current_directory
+            items = listing_cache.get(current_dir, session.file_manager_sort)
+            keyboard = create_directory_keyboard(call.message.chat.id, current_dir)
+        content = f"📂 Содержимое папки: {current_dir}\n\nНайдено элементов: {len(items)}"
+        bot.edit_message_text(content, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("file_manager_next")
+def action_file_manager_next(call):
+    session = get_session(call.message.chat.id)
+    try:
+        with session.lock:
+            session.file_manager_page += 1
+            current_dir = session.current_directory
+            items = listing_cache.get(current_dir, session.file_manager_sort)
+            keyboard = create_directory_keyboard(call.message.chat.id, current_dir)
+        content = f"📂 Содержимое папки: {current_dir}\n\nНайдено элементов: {len(items)}"
+        bot.edit_message_text(content, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("find_prev")
+def action_find_prev(call):
+    session = get_session(call.message.chat.id)
+    try:
+        with session.lock:
+            if session.find_page > 0:
+                session.find_page -= 1
+            content = create_find_message(session)
+            keyboard = create_find_keyboard(call.message.chat.id)
+        bot.edit_message_text(content, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("find_next")
+def action_find_next(call):
+    session = get_session(call.message.chat.id)
+    try:
+        with session.lock:
+            if (session.find_page + 1) * FIND_PAGE_SIZE < len(session.find_results):
+                session.find_page += 1
+            content = create_find_message(session)
+            keyboard = create_find_keyboard(call.message.chat.id)
+        bot.edit_message_text(content, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("file_manager_sort")
+def action_file_manager_sort(call):
+    session = get_session(call.message.chat.id)
+    modes = list(LISTING_SORT_MODES)
+    try:
+        with session.lock:
+            session.file_manager_sort = modes[(modes.index(session.file_manager_sort) + 1) % len(modes)]
+            session.file_manager_page = 0
+            current_dir = session.current_directory
+            items = listing_cache.get(current_dir, session.file_manager_sort)
+            keyboard = create_directory_keyboard(call.message.chat.id, current_dir)
+        content = f"📂 Содержимое папки: {current_dir}\n\nНайдено элементов: {len(items)}"
+        bot.edit_message_text(content, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("log")
+def action_log(call):
+    try:
+        send_log_query(call.message.chat.id, "")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"⚠️ Ошибка: {str(e)}")
+
+
+@router.action("kill_menu")
+def action_kill_menu(call):
+    session = get_session(call.message.chat.id)
+    try:
+        with session.lock:
+            process_text, process_list = create_process_list_message(session)
+            session.process_list = process_list
+            session.waiting_for_process_kill = True
+            keyboard = create_process_keyboard(session)
+
+        bot.edit_message_text(process_text, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("toggle_system")
+def action_toggle_system(call):
+    session = get_session(call.message.chat.id)
+    try:
+        with session.lock:
+            session.show_system_processes = not session.show_system_processes
+            process_text, process_list = create_process_list_message(session)
+            session.process_list = process_list
+            keyboard = create_process_keyboard(session)
+
+        bot.edit_message_text(process_text, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("process_sort")
+def action_process_sort(call):
+    session = get_session(call.message.chat.id)
+    modes = list(PROCESS_SORT_MODES)
+    try:
+        with session.lock:
+            session.process_sort = modes[(modes.index(session.process_sort) + 1) % len(modes)]
+            process_text, process_list = create_process_list_message(session)
+            session.process_list = process_list
+            keyboard = create_process_keyboard(session)
+
+        bot.edit_message_text(process_text, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+    except:
+        pass
+
+
+@router.action("volume_control")
+def action_volume_control(call):
+    try:
+        bot.edit_message_text("🔊 Управление громкостью - выберите действие:", call.message.chat.id,
+                              call.message.message_id, reply_markup=create_volume_keyboard())
+    except:
+        pass
+
+
+@router.action("volume_mute")
+def action_volume_mute(call):
+    try:
+        backends.input.press('volumemute')
+        bot.answer_callback_query(call.id, "🔇 Звук отключен")
+        log_command("Volume Control", "Mute")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+
+
+@router.action("volume_up")
+def action_volume_up(call):
+    try:
+        backends.input.press('volumeup')
+        bot.answer_callback_query(call.id, "🔊 Громкость увеличена")
+        log_command("Volume Control", "Volume Up")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+
 
+@router.action("volume_down")
+def action_volume_down(call):
     try:
-        index = int(process_number) - 1
-        if 0 <= index < len(user_state["process_list"]):
-            pid = user_state["process_list"][index]
-            try:
-                process = psutil.Process(pid)
-                process_name = process.name()
-                process.terminate()
-                bot.reply_to(message, f"✅ Процесс {process_name} (PID: {pid}) завершен")
-                log_command("Kill Process", f"Terminated {process_name} (PID: {pid})")
-            except Exception as e:
-                bot.reply_to(message, f"❌ Ошибка завершения процесса: {str(e)}")
-        else:
-            bot.reply_to(message, "❌ Неверный номер процесса")
-    except ValueError:
-        bot.reply_to(message, "❌ Введите корректный номер")
+        backends.input.press('volumedown')
+        bot.answer_callback_query(call.id, "🔈 Громкость уменьшена")
+        log_command("Volume Control", "Volume Down")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    keyboard = create_main_menu()
-    bot.send_message(message.chat.id, "📱 Возврат в главное меню:", reply_markup=keyboard)
 
+@router.action("key_emulation")
+def action_key_emulation(call):
+    try:
+        bot.edit_message_text("⌨️ Выберите тип эмуляции:", call.message.chat.id, call.message.message_id,
+                              reply_markup=create_key_emulation_keyboard())
+    except:
+        pass
 
-@bot.callback_query_handler(func=lambda call: call.message.chat.id != config.CHAT_ID)
-def handle_unauthorized_callback(call):
-    bot.answer_callback_query(call.id, "⛔ Доступ запрещен")
+
+@router.action("emulate_text")
+def action_emulate_text(call):
+    try:
+        bot.edit_message_text("💬 Введите текст для эмуляции ввода:", call.message.chat.id, call.message.message_id)
+        get_session(call.message.chat.id).waiting_for_emulation_text = True
+    except:
+        pass
 
 
-@bot.callback_query_handler(func=lambda call: call.message.chat.id == config.CHAT_ID)
-def handle_control_buttons(call):
+@router.action("special_keys")
+def action_special_keys(call):
     try:
-        bot.answer_callback_query(call.id)
+        bot.edit_message_text("⌨️ Выберите специальную клавишу:", call.message.chat.id, call.message.message_id,
+                              reply_markup=create_special_keys_keyboard())
     except:
         pass
 
-    action = call.data
 
-    if action == "main_menu":
-        keyboard = create_main_menu()
-        try:
-            bot.edit_message_text("📱 Главное меню управления ControlPCbotV2:", call.message.chat.id,
-                                  call.message.message_id, reply_markup=keyboard)
-        except:
-            pass
+@router.action("key_combinations")
+def action_key_combinations(call):
+    try:
+        bot.edit_message_text("⌨️ Выберите сочетание клавиш:", call.message.chat.id, call.message.message_id,
+                              reply_markup=create_key_combinations_keyboard())
+    except:
+        pass
 
-    elif action == "autostart":
-        try:
-            if toggle_autostart():
-                status = "добавлен в автозагрузку" if check_autostart() else "удален из автозагрузки"
-                bot.answer_callback_query(call.id, f"✅ Бот {status}")
-                log_command("Autorun", f"Toggled, now: {status}")
-            else:
-                bot.answer_callback_query(call.id, "❌ Ошибка управления автозагрузкой")
 
-            keyboard = create_main_menu()
-            bot.edit_message_text("📱 Главное меню управления ControlPCbotV2:", call.message.chat.id,
-                                  call.message.message_id, reply_markup=keyboard)
-        except:
-            pass
+@router.prefix("key_")
+def action_key(call, key):
+    try:
+        if key == 'Win':
+            backends.input.press('win')
+        else:
+            backends.input.press(key.lower())
+        record_macro_step(call.message.chat.id, "press", key.lower(), 1)
+        bot.answer_callback_query(call.id, f"✅ Клавиша {key} нажата")
+        log_command("Key Press", f"Key: {key}")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "shutdown":
-        try:
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(
-                InlineKeyboardButton("✅ Да, завершить", callback_data="shutdown_confirm"),
-                InlineKeyboardButton("❌ Нет, отмена", callback_data="shutdown_cancel")
-            )
-            bot.edit_message_text("⚠️ Вы уверены, что хотите выключить компьютер?", call.message.chat.id,
-                                  call.message.message_id, reply_markup=keyboard)
-        except:
-            pass
 
-    elif action == "shutdown_confirm":
-        try:
-            bot.edit_message_text("✅ Компьютер будет выключен через 1 минуту!", call.message.chat.id,
-                                  call.message.message_id)
-            log_command("System Shutdown", "Initiated by bot")
-            os.system("shutdown /s /t 60")
-        except:
-            pass
+@router.prefix("comb_")
+def action_comb(call, comb):
+    try:
+        if comb == "lock":
+            backends.lock.lock()
+            bot.answer_callback_query(call.id, "🔒 Экран заблокирован")
+        elif comb in KEY_COMBINATION_HOTKEYS:
+            name, keys = KEY_COMBINATION_HOTKEYS[comb]
+            backends.input.hotkey(*keys)
+            record_macro_step(call.message.chat.id, "hotkey", *keys)
+            bot.answer_callback_query(call.id, f"✅ {name} выполнено")
+        log_command("Key Combination", f"Combination: {comb}")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "shutdown_cancel":
-        keyboard = create_main_menu()
-        try:
-            bot.edit_message_text("❌ Выключение отменено", call.message.chat.id,
-                                  call.message.message_id, reply_markup=keyboard)
-        except:
-            pass
 
-    elif action == "reboot":
-        try:
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(
-                InlineKeyboardButton("✅ Да, перезагрузить", callback_data="reboot_confirm"),
-                InlineKeyboardButton("❌ Нет, отмена", callback_data="reboot_cancel")
-            )
-            bot.edit_message_text("⚠️ Вы уверены, что хотите перезагрузить компьютер?", call.message.chat.id,
-                                  call.message.message_id, reply_markup=keyboard)
-        except:
-            pass
+@router.action("macro_menu")
+def action_macro_menu(call):
+    try:
+        bot.edit_message_text(create_macro_message(call.message.chat.id), call.message.chat.id,
+                              call.message.message_id, reply_markup=create_macro_keyboard(call.message.chat.id))
+    except:
+        pass
 
-    elif action == "reboot_confirm":
-        try:
-            bot.edit_message_text("✅ Компьютер будет перезагружен через 1 минуту!", call.message.chat.id,
-                                  call.message.message_id)
-            log_command("System Reboot", "Initiated by bot")
-            os.system("shutdown /r /t 60")
-        except:
-            pass
 
-    elif action == "reboot_cancel":
-        keyboard = create_main_menu()
-        try:
-            bot.edit_message_text("❌ Перезагрузка отменена", call.message.chat.id,
-                                  call.message.message_id, reply_markup=keyboard)
-        except:
-            pass
+@router.action("macro_record")
+def action_macro_record(call):
+    session = get_session(call.message.chat.id)
+    with session.lock:
+        if session.macro_recording is None:
+            session.macro_recording = []
+    bot.answer_callback_query(call.id, "🔴 Запись начата")
+    action_macro_menu(call)
 
-    elif action == "screenshot":
-        try:
-            screenshot_path = take_screenshot()
-            if screenshot_path:
-                with open(screenshot_path, 'rb') as photo:
-                    bot.send_photo(call.message.chat.id, photo, caption="📸 Скриншот выполнен успешно")
-                os.unlink(screenshot_path)
-                log_command("Screenshot", "Taken")
-            else:
-                bot.answer_callback_query(call.id, "❌ Ошибка создания скриншота")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "file_manager":
-        user_state["file_manager_page"] = 0
-        try:
-            bot.edit_message_text("📁 Управление файлами - выберите диск:", call.message.chat.id,
-                                  call.message.message_id, reply_markup=create_file_manager_keyboard())
-        except:
-            pass
+@router.action("macro_record_stop")
+def action_macro_record_stop(call):
+    session = get_session(call.message.chat.id)
+    steps = session.consume("macro_recording")
+    if not steps:
+        bot.answer_callback_query(call.id, "ℹ️ Ничего не записано")
+        action_macro_menu(call)
+        return
+    session.waiting_for_macro_name = format_macro(steps)
+    bot.answer_callback_query(call.id, f"⏹ Записано шагов: {len(steps)}")
+    bot.send_message(call.message.chat.id, f"📼 Записано: {session.waiting_for_macro_name}\n\n"
+                                           "Введите имя макроса (буквы, цифры, _ и -):")
 
-    elif action.startswith("folder_"):
-        path = action[7:]
-        try:
-            if not os.path.exists(path):
-                bot.answer_callback_query(call.id, "❌ Папка не существует")
-                return
 
-            if not os.path.isdir(path):
-                bot.answer_callback_query(call.id, "❌ Это не папка")
-                return
+@router.action("macro_stop")
+def action_macro_stop(call):
+    macro_runner.stop()
+    bot.answer_callback_query(call.id, "⛔ Выполнение макросов прервано")
 
-            user_state["current_directory"] = path
-            user_state["file_manager_page"] = 0
 
-            try:
-                items = os.listdir(path)
-                content = f"📂 Содержимое папки: {path}\n\nНайдено элементов: {len(items)}"
-                bot.edit_message_text(content, call.message.chat.id,
-                                      call.message.message_id, reply_markup=create_directory_keyboard(path))
-            except PermissionError:
-                bot.answer_callback_query(call.id, "❌ Нет доступа к папке")
-            except Exception as e:
-                bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+@router.prefix("macro_run_")
+def action_macro_run(call, name):
+    text = macros.get(name)
+    if text is None:
+        bot.answer_callback_query(call.id, f"❌ Макрос {name} не найден")
+        return
+    try:
+        steps = run_macro(call.message.chat.id, name, text)
+        bot.answer_callback_query(call.id, f"▶️ Макрос {name}: {len(steps)} шагов")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка доступа: {str(e)}")
 
-    elif action.startswith("file_"):
-        file_path = action[5:]
-        try:
-            if os.path.exists(file_path):
-                with open(file_path, 'rb') as f:
-                    bot.send_document(call.message.chat.id, f, caption=f"📄 {os.path.basename(file_path)}")
-            else:
-                bot.answer_callback_query(call.id, "❌ Файл не найден")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка отправки файла: {str(e)}")
+@router.action("mouse_emulation")
+def action_mouse_emulation(call):
+    try:
+        bot.edit_message_text("🖱 Управление мышью - выберите действие:", call.message.chat.id,
+                              call.message.message_id,
+                              reply_markup=create_mouse_emulation_keyboard())
+    except:
+        pass
 
-    elif action == "upload_here":
-        current_dir = user_state["current_directory"]
-        try:
-            bot.edit_message_text(f"📤 Отправьте файл для загрузки в папку:\n{current_dir}", call.message.chat.id,
-                                  call.message.message_id)
-            user_state["waiting_for_path"] = "upload_file"
-            user_state["upload_path"] = current_dir
-        except:
-            pass
 
-    elif action == "archive_folder":
-        current_dir = user_state["current_directory"]
-        try:
-            temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-            temp_zip.close()
-            create_zip_archive(current_dir, temp_zip.name)
-            with open(temp_zip.name, 'rb') as zip_file:
-                bot.send_document(call.message.chat.id, zip_file,
-                                  caption=f"📦 Архив папки: {os.path.basename(current_dir)}")
-            os.unlink(temp_zip.name)
-            log_command("Archive Folder", f"Archived: {current_dir}")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка архивации: {str(e)}")
+@router.action("mouse_up")
+def action_mouse_up(call):
+    try:
+        backends.input.move(0, -50)
+        record_macro_step(call.message.chat.id, "move", 0, -50)
+        bot.answer_callback_query(call.id, "✅ Мышь перемещена вверх")
+        log_command("Mouse Control", "Move Up")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "get_file_here":
-        current_dir = user_state["current_directory"]
-        try:
-            bot.edit_message_text(f"📥 Введите имя файла для извлечения из папки:\n{current_dir}", call.message.chat.id,
-                                  call.message.message_id)
-            user_state["waiting_for_path"] = "get_file"
-        except:
-            pass
 
-    elif action == "enter_path":
-        try:
-            bot.edit_message_text("⌨️ Введите полный путь к папке:", call.message.chat.id, call.message.message_id)
-            user_state["waiting_for_path"] = "enter_folder"
-        except:
-            pass
+@router.action("mouse_down")
+def action_mouse_down(call):
+    try:
+        backends.input.move(0, 50)
+        record_macro_step(call.message.chat.id, "move", 0, 50)
+        bot.answer_callback_query(call.id, "✅ Мышь перемещена вниз")
+        log_command("Mouse Control", "Move Down")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "file_manager_prev":
-        if user_state["file_manager_page"] > 0:
-            user_state["file_manager_page"] -= 1
-        current_dir = user_state["current_directory"]
-        try:
-            items = os.listdir(current_dir)
-            content = f"📂 Содержимое папки: {current_dir}\n\nНайдено элементов: {len(items)}"
-            bot.edit_message_text(content, call.message.chat.id,
-                                  call.message.message_id, reply_markup=create_directory_keyboard(current_dir))
-        except:
-            pass
 
-    elif action == "file_manager_next":
-        user_state["file_manager_page"] += 1
-        current_dir = user_state["current_directory"]
-        try:
-            items = os.listdir(current_dir)
-            content = f"📂 Содержимое папки: {current_dir}\n\nНайдено элементов: {len(items)}"
-            bot.edit_message_text(content, call.message.chat.id,
-                                  call.message.message_id, reply_markup=create_directory_keyboard(current_dir))
-        except:
-            pass
+@router.action("mouse_left")
+def action_mouse_left(call):
+    try:
+        backends.input.move(-50, 0)
+        record_macro_step(call.message.chat.id, "move", -50, 0)
+        bot.answer_callback_query(call.id, "✅ Мышь перемещена влево")
+        log_command("Mouse Control", "Move Left")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "log":
-        try:
-            with open("command_log.txt", "rb") as f:
-                bot.send_document(call.message.chat.id, f, caption="📝 Лог команд")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"⚠️ Ошибка: {str(e)}")
 
-    elif action == "kill_menu":
-        try:
-            process_text, process_list = create_process_list_message()
-            user_state["process_list"] = process_list
-            user_state["waiting_for_process_kill"] = True
+@router.action("mouse_right")
+def action_mouse_right(call):
+    try:
+        backends.input.move(50, 0)
+        record_macro_step(call.message.chat.id, "move", 50, 0)
+        bot.answer_callback_query(call.id, "✅ Мышь перемещена вправо")
+        log_command("Mouse Control", "Move Right")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(InlineKeyboardButton("🔄 Обновить список", callback_data="kill_menu"))
-            system_text = "✅ Системные" if user_state["show_system_processes"] else "❌ Системные"
-            keyboard.add(InlineKeyboardButton(f"{system_text} процессы", callback_data="toggle_system"))
-            keyboard.add(InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu"))
 
-            bot.edit_message_text(process_text, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
-        except:
-            pass
+@router.action("mouse_left_click")
+def action_mouse_left_click(call):
+    try:
+        backends.input.click()
+        record_macro_step(call.message.chat.id, "click", "left", 1)
+        bot.answer_callback_query(call.id, "✅ ЛКМ нажата")
+        log_command("Mouse Control", "Left Click")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "toggle_system":
-        user_state["show_system_processes"] = not user_state["show_system_processes"]
-        try:
-            process_text, process_list = create_process_list_message()
-            user_state["process_list"] = process_list
 
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(InlineKeyboardButton("🔄 Обновить список", callback_data="kill_menu"))
-            system_text = "✅ Системные" if user_state["show_system_processes"] else "❌ Системные"
-            keyboard.add(InlineKeyboardButton(f"{system_text} процессы", callback_data="toggle_system"))
-            keyboard.add(InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu"))
+@router.action("mouse_right_click")
+def action_mouse_right_click(call):
+    try:
+        backends.input.click(button='right')
+        record_macro_step(call.message.chat.id, "click", "right", 1)
+        bot.answer_callback_query(call.id, "✅ ПКМ нажата")
+        log_command("Mouse Control", "Right Click")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-            bot.edit_message_text(process_text, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
-        except:
-            pass
 
-    elif action == "volume_control":
-        try:
-            bot.edit_message_text("🔊 Управление громкостью - выберите действие:", call.message.chat.id,
-                                  call.message.message_id, reply_markup=create_volume_keyboard())
-        except:
-            pass
+@router.action("mouse_middle_click")
+def action_mouse_middle_click(call):
+    try:
+        backends.input.click(button='middle')
+        record_macro_step(call.message.chat.id, "click", "middle", 1)
+        bot.answer_callback_query(call.id, "✅ СКМ нажата")
+        log_command("Mouse Control", "Middle Click")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "volume_mute":
-        try:
-            pyautogui.press('volumemute')
-            bot.answer_callback_query(call.id, "🔇 Звук отключен")
-            log_command("Volume Control", "Mute")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "volume_up":
-        try:
-            pyautogui.press('volumeup')
-            bot.answer_callback_query(call.id, "🔊 Громкость увеличена")
-            log_command("Volume Control", "Volume Up")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+@router.action("mouse_scroll_up")
+def action_mouse_scroll_up(call):
+    try:
+        backends.input.scroll(100)
+        record_macro_step(call.message.chat.id, "scroll", 100)
+        bot.answer_callback_query(call.id, "✅ Прокрутка вверх")
+        log_command("Mouse Control", "Scroll Up")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "volume_down":
-        try:
-            pyautogui.press('volumedown')
-            bot.answer_callback_query(call.id, "🔈 Громкость уменьшена")
-            log_command("Volume Control", "Volume Down")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "key_emulation":
-        try:
-            bot.edit_message_text("⌨️ Выберите тип эмуляции:", call.message.chat.id, call.message.message_id,
-                                  reply_markup=create_key_emulation_keyboard())
-        except:
-            pass
+@router.action("mouse_scroll_down")
+def action_mouse_scroll_down(call):
+    try:
+        backends.input.scroll(-100)
+        record_macro_step(call.message.chat.id, "scroll", -100)
+        bot.answer_callback_query(call.id, "✅ Прокрутка вниз")
+        log_command("Mouse Control", "Scroll Down")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "emulate_text":
-        try:
-            bot.edit_message_text("💬 Введите текст для эмуляции ввода:", call.message.chat.id, call.message.message_id)
-            user_state["waiting_for_emulation_text"] = True
-        except:
-            pass
 
-    elif action == "special_keys":
-        try:
-            bot.edit_message_text("⌨️ Выберите специальную клавишу:", call.message.chat.id, call.message.message_id,
-                                  reply_markup=create_special_keys_keyboard())
-        except:
-            pass
+@router.action("mouse_target")
+def action_mouse_target(call):
+    bot.answer_callback_query(call.id, "🎯 Делаю скриншот с сеткой...")
+    screenshot_executor.submit(send_screen_target, call.message.chat.id)
 
-    elif action == "key_combinations":
-        try:
-            bot.edit_message_text("⌨️ Выберите сочетание клавиш:", call.message.chat.id, call.message.message_id,
-                                  reply_markup=create_key_combinations_keyboard())
-        except:
-            pass
 
-    elif action.startswith("key_"):
-        key = action[4:]
-        try:
-            if key == 'Win':
-                pyautogui.press('win')
-            else:
-                pyautogui.press(key.lower())
-            bot.answer_callback_query(call.id, f"✅ Клавиша {key} нажата")
-            log_command("Key Press", f"Key: {key}")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+@router.action("target_refresh")
+def action_target_refresh(call):
+    target = get_session(call.message.chat.id).target
+    bot.answer_callback_query(call.id, "🔄 Обновляю...")
+    screenshot_executor.submit(send_screen_target, call.message.chat.id, target, call.message.message_id)
 
-    elif action.startswith("comb_"):
-        comb = action[5:]
-        try:
-            if comb == "lock":
-                ctypes.windll.user32.LockWorkStation()
-                bot.answer_callback_query(call.id, "🔒 Экран заблокирован")
-            elif comb == "alt_tab":
-                pyautogui.hotkey('alt', 'tab')
-                bot.answer_callback_query(call.id, "✅ Alt+Tab выполнено")
-            elif comb == "ctrl_c":
-                pyautogui.hotkey('ctrl', 'c')
-                bot.answer_callback_query(call.id, "✅ Ctrl+C выполнено")
-            elif comb == "ctrl_v":
-                pyautogui.hotkey('ctrl', 'v')
-                bot.answer_callback_query(call.id, "✅ Ctrl+V выполнено")
-            elif comb == "ctrl_z":
-                pyautogui.hotkey('ctrl', 'z')
-                bot.answer_callback_query(call.id, "✅ Ctrl+Z выполнено")
-            elif comb == "ctrl_a":
-                pyautogui.hotkey('ctrl', 'a')
-                bot.answer_callback_query(call.id, "✅ Ctrl+A выполнено")
-            elif comb == "ctrl_s":
-                pyautogui.hotkey('ctrl', 's')
-                bot.answer_callback_query(call.id, "✅ Ctrl+S выполнено")
-            elif comb == "win_e":
-                pyautogui.hotkey('win', 'e')
-                bot.answer_callback_query(call.id, "✅ Win+E выполнено")
-            elif comb == "win_r":
-                pyautogui.hotkey('win', 'r')
-                bot.answer_callback_query(call.id, "✅ Win+R выполнено")
-            elif comb == "win_d":
-                pyautogui.hotkey('win', 'd')
-                bot.answer_callback_query(call.id, "✅ Win+D выполнено")
-            elif comb == "ctrl_shift_esc":
-                pyautogui.hotkey('ctrl', 'shift', 'esc')
-                bot.answer_callback_query(call.id, "✅ Ctrl+Shift+Esc выполнено")
-            elif comb == "alt_f4":
-                pyautogui.hotkey('alt', 'f4')
-                bot.answer_callback_query(call.id, "✅ Alt+F4 выполнено")
-            log_command("Key Combination", f"Combination: {comb}")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "mouse_emulation":
-        try:
-            bot.edit_message_text("🖱 Управление мышью - выберите действие:", call.message.chat.id,
-                                  call.message.message_id,
-                                  reply_markup=create_mouse_emulation_keyboard())
-        except:
-            pass
+@router.action("target_full")
+def action_target_full(call):
+    bot.answer_callback_query(call.id, "🖥 Весь экран")
+    screenshot_executor.submit(send_screen_target, call.message.chat.id, None, call.message.message_id)
 
-    elif action == "mouse_up":
-        try:
-            pyautogui.move(0, -50)
-            bot.answer_callback_query(call.id, "✅ Мышь перемещена вверх")
-            log_command("Mouse Control", "Move Up")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "mouse_down":
-        try:
-            pyautogui.move(0, 50)
-            bot.answer_callback_query(call.id, "✅ Мышь перемещена вниз")
-            log_command("Mouse Control", "Move Down")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+@router.action("target_close")
+def action_target_close(call):
+    get_session(call.message.chat.id).target = None
+    try:
+        bot.edit_message_caption("🎯 Прицел закрыт", call.message.chat.id, call.message.message_id)
+    except:
+        pass
 
-    elif action == "mouse_left":
-        try:
-            pyautogui.move(-50, 0)
-            bot.answer_callback_query(call.id, "✅ Мышь перемещена влево")
-            log_command("Mouse Control", "Move Left")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "mouse_right":
-        try:
-            pyautogui.move(50, 0)
-            bot.answer_callback_query(call.id, "✅ Мышь перемещена вправо")
-            log_command("Mouse Control", "Move Right")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+@router.action("lock_screen")
+def action_lock_screen(call):
+    try:
+        backends.lock.lock()
+        bot.send_message(call.message.chat.id, "🔒 Экран заблокирован")
+        log_command("Lock Screen", "Screen locked")
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "mouse_left_click":
-        try:
-            pyautogui.click()
-            bot.answer_callback_query(call.id, "✅ ЛКМ нажата")
-            log_command("Mouse Control", "Left Click")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "mouse_right_click":
-        try:
-            pyautogui.click(button='right')
-            bot.answer_callback_query(call.id, "✅ ПКМ нажата")
-            log_command("Mouse Control", "Right Click")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+@router.action("cmdlist")
+def action_cmdlist(call):
+    cmd_help = (
+        "📋 Основные CMD команды:\n\n"
+        "• `cd` - Сменить директорию\n"
+        "• `dir` - Показать содержимое папки\n"
+        "• `ipconfig` - Информация о сетевых подключениях\n"
+        "• `ping` - Проверить доступность хоста\n"
+        "• `shutdown /s /t 0` - Немедленное выключение\n"
+        "• `shutdown /r /t 0` - Немедленная перезагрузка\n"
+        "• `tasklist` - Список процессов\n"
+        "• `taskkill /F /PID <pid>` - Завершить процесс\n"
+        "• `systeminfo` - Информация о системе\n"
+        "• `curl` - Загрузка файлов из интернета\n\n"
+        "Для выполнения команд используйте /cmd [команда]"
+    )
+    bot.send_message(call.message.chat.id, cmd_help, parse_mode="Markdown")
 
-    elif action == "mouse_middle_click":
-        try:
-            pyautogui.click(button='middle')
-            bot.answer_callback_query(call.id, "✅ СКМ нажата")
-            log_command("Mouse Control", "Middle Click")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "mouse_scroll_up":
-        try:
-            pyautogui.scroll(100)
-            bot.answer_callback_query(call.id, "✅ Прокрутка вверх")
-            log_command("Mouse Control", "Scroll Up")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+@router.prefix("cmd_cancel_")
+def action_cmd_cancel(call, job_id):
+    with cmd_jobs_lock:
+        job = cmd_jobs.get(job_id)
 
-    elif action == "mouse_scroll_down":
-        try:
-            pyautogui.scroll(-100)
-            bot.answer_callback_query(call.id, "✅ Прокрутка вниз")
-            log_command("Mouse Control", "Scroll Down")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+    try:
+        if job is None:
+            bot.answer_callback_query(call.id, "ℹ️ Команда уже завершена")
+            return
+
+        job["cancelled"] = True
+        if job["session"] is not None:
+            job["session"].interrupt(job_id)
+        bot.answer_callback_query(call.id, "⛔ Команда отменена")
+        log_command("CMD Cancel", job["command"])
+    except:
+        pass
 
-    elif action == "lock_screen":
-        try:
-            ctypes.windll.user32.LockWorkStation()
-            bot.send_message(call.message.chat.id, "🔒 Экран заблокирован")
-            log_command("Lock Screen", "Screen locked")
-        except Exception as e:
-            bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-    elif action == "cmdlist":
-        cmd_help = (
-            "📋 Основные CMD команды:\n\n"
-            "• `cd` - Сменить директорию\n"
-            "• `dir` - Показать содержимое папки\n"
-            "• `ipconfig` - Информация о сетевых подключениях\n"
-            "• `ping` - Проверить доступность хоста\n"
-            "• `shutdown /s /t 0` - Немедленное выключение\n"
-            "• `shutdown /r /t 0` - Немедленная перезагрузка\n"
-            "• `tasklist` - Список процессов\n"
-            "• `taskkill /F /PID <pid>` - Завершить процесс\n"
-            "• `systeminfo` - Информация о системе\n"
-            "• `curl` - Загрузка файлов из интернета\n\n"
-            "Для выполнения команд используйте /cmd [команда]"
-        )
-        bot.send_message(call.message.chat.id, cmd_help, parse_mode="Markdown")
+@router.action("noop")
+def action_noop(call):
+    pass
+
 
-    elif action == "noop":
+@bot.callback_query_handler(func=lambda call: call.message.chat.id == config.CHAT_ID)
+def handle_control_buttons(call):
+    try:
+        bot.answer_callback_query(call.id)
+    except:
         pass
 
+    router.dispatch(call)
+
 
-@bot.message_handler(content_types=['document'],
-                     func=lambda message: message.chat.id == config.CHAT_ID and user_state.get("upload_path"))
+@bot.message_handler(
+    content_types=['document'],
+    func=lambda message: message.chat.id == config.CHAT_ID and get_session(message.chat.id).upload_path)
 def handle_file_upload(message):
+    upload_dir = get_session(message.chat.id).consume("upload_path")
+    if not upload_dir:
+        return
     try:
         file_info = bot.get_file(message.document.file_id)
-        downloaded_file = bot.download_file(file_info.file_path)
 
-        upload_dir = user_state["upload_path"]
-        filename = message.document.file_name
+        filename = os.path.basename(message.document.file_name or file_info.file_path)
         file_path = os.path.join(upload_dir, filename)
 
         if not os.path.exists(upload_dir):
             os.makedirs(upload_dir)
 
-        with open(file_path, 'wb') as new_file:
-            new_file.write(downloaded_file)
+        extract, expected_sha256 = parse_upload_caption(message.caption)
+        file_path, digest, size, extracted = receive_upload(file_info, file_path, extract, expected_sha256)
 
-        bot.reply_to(message, f"✅ Файл успешно загружен по пути:\n{file_path}")
-        log_command("File Upload", f"Uploaded to: {file_path}")
+        checksum = f"🔒 SHA-256: {digest}" + (" (совпадает с подписью)" if expected_sha256 else "")
+        if extracted:
+            bot.reply_to(message, f"✅ Архив распакован в папку:\n{file_path}\n\n{checksum}")
+        else:
+            bot.reply_to(message, f"✅ Файл успешно загружен по пути:\n{file_path}\n\n{checksum}")
+        log_command("File Upload", f"Uploaded to: {file_path} ({size} bytes, sha256 {digest})")
     except Exception as e:
         bot.reply_to(message, f"❌ Ошибка загрузки файла: {str(e)}")
         log_command("File Upload Error", str(e))
     finally:
-        user_state["upload_path"] = None
         keyboard = create_main_menu()
         bot.send_message(message.chat.id, "📱 Возврат в главное меню:", reply_markup=keyboard)
 
 
-@bot.message_handler(func=lambda message: user_state.get("waiting_for_path") and message.chat.id == config.CHAT_ID)
+@bot.message_handler(
+    func=lambda message: message.chat.id == config.CHAT_ID and get_session(message.chat.id).waiting_for_path)
 def handle_path_input(message):
     path = message.text.strip()
-    action = user_state["waiting_for_path"]
-    user_state["waiting_for_path"] = None
+    session = get_session(message.chat.id)
+    action = session.consume("waiting_for_path")
 
     if action == "get_file":
         try:
@@ -1027,8 +5286,7 @@ def handle_path_input(message):
             elif os.path.isdir(path):
                 bot.reply_to(message, "❌ Указанный путь является папкой, а не файлом")
             else:
-                with open(path, 'rb') as f:
-                    bot.send_document(message.chat.id, f, caption=f"📄 {os.path.basename(path)}")
+                send_file(message.chat.id, path)
         except Exception as e:
             bot.reply_to(message, f"⚠️ Ошибка: {str(e)}")
         finally:
@@ -1037,12 +5295,13 @@ def handle_path_input(message):
 
     elif action == "enter_folder":
         if os.path.exists(path) and os.path.isdir(path):
-            user_state["current_directory"] = path
-            user_state["file_manager_page"] = 0
+            with session.lock:
+                session.current_directory = path
+                session.file_manager_page = 0
             try:
-                items = os.listdir(path)
+                items = listing_cache.get(path, session.file_manager_sort)
                 content = f"📂 Содержимое папки: {path}\n\nНайдено элементов: {len(items)}"
-                bot.reply_to(message, content, reply_markup=create_directory_keyboard(path))
+                bot.reply_to(message, content, reply_markup=create_directory_keyboard(message.chat.id, path))
             except PermissionError:
                 bot.reply_to(message, "❌ Нет доступа к папке")
                 keyboard = create_main_menu()
@@ -1057,9 +5316,29 @@ def handle_path_input(message):
             bot.send_message(message.chat.id, "📱 Возврат в главное меню:", reply_markup=keyboard)
 
 
-if __name__ == "__main__":
-    if not os.path.exists("command_log.txt"):
-        open("command_log.txt", 'w').close()
+@bot.message_handler(
+    func=lambda message: message.chat.id == config.CHAT_ID and bool(message.text)
+    and TARGET_CELL_PATTERN.fullmatch(message.text) is not None and is_screen_target_reply(message))
+def handle_target_cell(message):
+    try:
+        result = apply_screen_target(message.chat.id, message.text)
+        if result:
+            bot.reply_to(message, result)
+    except Exception as e:
+        bot.reply_to(message, f"❌ Ошибка: {str(e)}")
+
+
+def run_bot():
+    if not os.path.exists(LOG_FILE):
+        open(LOG_FILE, 'w').close()
+
+    file_index.refresh_async()
+
+    if METRICS_PORT:
+        try:
+            start_metrics_server()
+        except OSError as e:
+            logger.error(f"Failed to start metrics endpoint on port {METRICS_PORT}: {e}")
 
     if check_system_uptime():
         try:
@@ -1081,4 +5360,8 @@ if __name__ == "__main__":
         bot.infinity_polling(timeout=60, long_polling_timeout=30)
     except Exception as e:
         print(f"\nОшибка: {str(e)}")
-        print("Перезапустите бот")
\ No newline at end of file
+        print("Перезапустите бот")
+
+
+if __name__ == "__main__":
+    run_bot()
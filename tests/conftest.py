@@ -0,0 +1,20 @@
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+config = types.ModuleType("config")
+config.TOKEN = "100000:TEST-TOKEN"
+config.CHAT_ID = 424242
+sys.modules.setdefault("config", config)
+
+import main as main_module
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return main_module
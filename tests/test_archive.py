@@ -0,0 +1,55 @@
+import os
+import zipfile
+
+
+def make_tree(root, files):
+    for name, data in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def read_volumes(volumes):
+    contents = {}
+    for index, last, path in volumes:
+        with zipfile.ZipFile(path) as archive:
+            assert archive.testzip() is None
+            for name in archive.namelist():
+                contents[name] = archive.read(name)
+    return contents
+
+
+def test_volumes_are_packed_by_compressed_size(main, tmp_path):
+    files = {f"dir{index // 10}/file{index}.txt": (f"line {index}\n" * 2000).encode() + os.urandom(3000)
+             for index in range(40)}
+    files["photo.jpg"] = os.urandom(30000)
+    files["кириллица.txt"] = b"x" * 100
+    make_tree(tmp_path / "src", files)
+    output = tmp_path / "out"
+    output.mkdir()
+
+    volumes = list(main.iter_archive_volumes(str(tmp_path / "src"), str(output), volume_size=40000, workers=3))
+    assert read_volumes(volumes) == files
+    assert [index for index, last, path in volumes] == list(range(1, len(volumes) + 1))
+    assert [last for index, last, path in volumes] == [False] * (len(volumes) - 1) + [True]
+    assert all(os.path.basename(path) == f"src.part{index:03d}.zip" for index, last, path in volumes)
+    sizes = [os.path.getsize(path) for index, last, path in volumes]
+    assert max(sizes) <= 40000
+    assert 1 < len(volumes) <= 6
+    assert sorted(os.listdir(output)) == sorted(os.path.basename(path) for index, last, path in volumes)
+
+
+def test_large_files_get_their_own_volume(main, tmp_path):
+    files = {"a.txt": b"a" * 100, "big.bin": os.urandom(5000), "c.txt": b"c" * 100}
+    make_tree(tmp_path / "src", files)
+    volumes = list(main.iter_archive_volumes(str(tmp_path / "src"), str(tmp_path), volume_size=4000, workers=2))
+    assert read_volumes(volumes) == files
+    with zipfile.ZipFile(volumes[1][2]) as archive:
+        assert archive.namelist() == ["big.bin"]
+
+
+def test_single_volume_is_named_after_the_folder(main, tmp_path):
+    make_tree(tmp_path / "src", {"a.txt": b"a"})
+    volumes = list(main.iter_archive_volumes(str(tmp_path / "src"), str(tmp_path)))
+    assert [(index, last, os.path.basename(path)) for index, last, path in volumes] == [(1, True, "src.zip")]
+    assert list(main.iter_archive_volumes(str(tmp_path / "missing"), str(tmp_path))) == []
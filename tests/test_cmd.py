@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import Future
+
+
+def make_job(command="echo `<x>`"):
+    return {"id": "1", "command": command, "chat_id": 1, "message_id": 2}
+
+
+def test_cmd_output_is_html_escaped(main):
+    text = main.format_cmd_output(make_job(), "a < b && `c` *d*", "✅")
+    assert text == "✅\n<pre>&gt; echo `&lt;x&gt;`\n\na &lt; b &amp;&amp; `c` *d*</pre>"
+
+
+def test_failed_cmd_edit_falls_back_to_plain_text(main, monkeypatch):
+    edits = []
+
+    def edit_message_text(text, chat_id, message_id, reply_markup=None, parse_mode=None):
+        edits.append((text, parse_mode))
+        future = Future()
+        if parse_mode:
+            future.set_exception(RuntimeError("Bad Request: can't parse entities"))
+        else:
+            future.set_result(True)
+        return future
+
+    monkeypatch.setattr(main.bot, "edit_message_text", edit_message_text)
+    main.edit_cmd_message(make_job(), "output", "✅")
+    assert [parse_mode for text, parse_mode in edits] == ["HTML", None]
+    assert edits[1][0] == "✅\n> echo `<x>`\n\noutput"
+
+
+def test_long_command_and_escaped_output_fit_one_message(main):
+    for command, output in (("x" * 3990, "y" * 5000), ("<" * 3990, "&" * 5000), ("echo", "<" * 3000 + "tail")):
+        for markup in (True, False):
+            text = main.format_cmd_output(make_job(command), output, "✅ Команда выполнена (код 0)", markup)
+            assert len(text) <= main.CMD_MESSAGE_LIMIT
+            assert len(text) > main.CMD_MESSAGE_LIMIT - 10 or "\n\n...\n" not in text
+            assert text.endswith(("tail</pre>", "tail", "&amp;</pre>", "&", "y</pre>", "y"))
+    text = main.format_cmd_output(make_job("x" * 3990), "y" * 5000, "✅")
+    assert "x" * main.CMD_COMMAND_PREVIEW + "...\n" in text and "\n...\ny" in text
+
+
+def test_throttled_output_is_flushed_after_the_interval(main, monkeypatch):
+    edits = []
+    monkeypatch.setattr(main, "CMD_EDIT_INTERVAL", 0.2)
+    monkeypatch.setattr(main, "edit_cmd_message", lambda job, output, status, reply_markup=None: edits.append(
+        (output, status)))
+    monkeypatch.setattr(main, "log_command", lambda *args: None)
+
+    class Session:
+        def reserve(self):
+            return True
+
+        def run(self, command, tag, on_output, timeout):
+            on_output("first\n")
+            time.sleep(0.4)
+            on_output("second\n")
+            time.sleep(0.4)
+            return 0, False
+
+    monkeypatch.setattr(main.shell_sessions, "get", lambda chat_id: Session())
+    job = main.start_cmd_job(1, "build", 30)
+    main.run_cmd_job(job)
+    time.sleep(0.3)
+    assert edits == [("first\n", "⏳ Выполняется..."), ("first\nsecond\n", "⏳ Выполняется..."),
+                     ("first\nsecond", "✅ Команда выполнена (код 0)")]
@@ -0,0 +1,34 @@
+def test_summary_ranks_root_files_among_folders(main, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DU_TOP", 3)
+    root = tmp_path / "root"
+    root.mkdir()
+    for index in range(6):
+        folder = root / f"dir{index}"
+        folder.mkdir()
+        (folder / "data.bin").write_bytes(b"x" * (10 + index))
+        (folder / "nested").mkdir()
+        (folder / "nested" / "more.bin").write_bytes(b"x" * 5)
+    (root / "big.bin").write_bytes(b"x" * 100)
+    (root / "medium.bin").write_bytes(b"x" * 16)
+    (root / "small.bin").write_bytes(b"x")
+
+    summary = main.DiskUsageAnalyzer(workers=2).analyze(str(root))
+    assert summary["complete"]
+    assert summary["files"] == 15
+    assert summary["dirs"] == 12
+    assert summary["total"] == 100 + 16 + 1 + sum(10 + index + 5 for index in range(6))
+    assert summary["items"] == [("big.bin", 100, False), ("dir5", 20, True), ("dir4", 19, True)]
+
+
+def test_small_root_files_still_show_next_to_large_folders(main, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DU_TOP", 2)
+    root = tmp_path / "root"
+    root.mkdir()
+    for index in range(4):
+        (root / f"dir{index}").mkdir()
+    (root / "dir0" / "data.bin").write_bytes(b"x" * 50)
+    (root / "a.bin").write_bytes(b"x" * 3)
+    (root / "b.bin").write_bytes(b"x" * 2)
+
+    summary = main.DiskUsageAnalyzer(workers=2).analyze(str(root))
+    assert summary["items"] == [("dir0", 50, True), ("a.bin", 3, False)]
@@ -0,0 +1,83 @@
+import io
+import types
+
+import pytest
+
+
+def make_error(main, code, description):
+    return main.apihelper.ApiTelegramException("sendDocument", None, {"error_code": code, "description": description})
+
+
+@pytest.fixture
+def telegram(main, tmp_path, monkeypatch):
+    sent = []
+    errors = []
+
+    def send_document(chat_id, document, **kwargs):
+        sent.append(document if isinstance(document, str) else "upload")
+        if errors:
+            raise errors.pop(0)
+        return types.SimpleNamespace(document=types.SimpleNamespace(file_id=f"id{len(sent)}"))
+
+    monkeypatch.setattr(main, "file_id_cache", main.FileIdCache(str(tmp_path / "cache.json")))
+    monkeypatch.setattr(main.bot, "send_document", send_document)
+    return types.SimpleNamespace(sent=sent, errors=errors)
+
+
+def open_document():
+    return io.BytesIO(b"data")
+
+
+def test_cached_file_id_is_reused(main, telegram):
+    main.send_cached_document(1, "digest", open_document)
+    main.send_cached_document(1, "digest", open_document)
+    assert telegram.sent == ["upload", "id1"]
+
+
+def test_visible_file_name_is_part_of_the_key(main, telegram):
+    main.send_cached_document(1, "digest", open_document, visible_file_name="a.txt")
+    main.send_cached_document(1, "digest", open_document, visible_file_name="b.txt")
+    main.send_cached_document(1, "digest", open_document, visible_file_name="a.txt")
+    assert telegram.sent == ["upload", "upload", "id1"]
+
+
+def test_only_stale_file_id_errors_drop_the_cache(main, telegram):
+    main.send_cached_document(1, "digest", open_document)
+    telegram.errors.append(make_error(main, 429, "Too Many Requests: retry after 1"))
+    with pytest.raises(main.apihelper.ApiTelegramException):
+        main.send_cached_document(1, "digest", open_document)
+    assert main.file_id_cache.get("digest") == "id1"
+
+    telegram.errors.append(make_error(main, 400, "Bad Request: wrong file identifier/HTTP URL specified"))
+    main.send_cached_document(1, "digest", open_document)
+    assert telegram.sent[-1] == "upload"
+    assert main.file_id_cache.get("digest") == "id4"
+
+
+def test_unchanged_folder_archive_reuses_its_upload(main, telegram, tmp_path, monkeypatch):
+    monkeypatch.setattr(main.bot, "send_message", lambda *args, **kwargs: types.SimpleNamespace(message_id=1))
+    monkeypatch.setattr(main.bot, "edit_message_text", lambda *args, **kwargs: None)
+    folder = tmp_path / "folder"
+    folder.mkdir()
+    (folder / "a.txt").write_bytes(b"a" * 1000)
+
+    main.send_folder_archive(1, str(folder))
+    main.send_folder_archive(1, str(folder))
+    assert telegram.sent == ["upload", "id1"]
+    assert not main.file_id_cache.paths
+
+    (folder / "a.txt").write_bytes(b"b" * 1000)
+    main.send_folder_archive(1, str(folder))
+    assert telegram.sent[-1] == "upload"
+
+
+def test_log_file_is_reused_until_it_changes(main, telegram, tmp_path):
+    log = tmp_path / "command_log.txt"
+    log.write_bytes(b"one\n")
+    main.send_path_document(1, str(log))
+    main.send_path_document(1, str(log))
+    assert telegram.sent == ["upload", "id1"]
+    with open(log, "ab") as f:
+        f.write(b"two\n")
+    main.send_path_document(1, str(log))
+    assert telegram.sent[-1] == "upload"
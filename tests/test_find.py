@@ -0,0 +1,52 @@
+import os
+import types
+
+
+def build_index(main, dirs):
+    index = main.FilenameIndex(index_path=None)
+    index.build(dirs)
+    return index
+
+
+def test_exact_and_prefix_matches_rank_first_beyond_the_limit(main):
+    files = [f"old_report_{number}.txt" for number in range(50)]
+    index = build_index(main, {
+        "/data/archive": (0, files, []),
+        "/data": (0, ["report_2024.xlsx", "report"], ["reports"]),
+    })
+
+    results = index.search("Report", limit=5)
+    assert results[0] == ("/data/report", False)
+    assert results[1:3] == [("/data/reports", True), ("/data/report_2024.xlsx", False)]
+    assert len(results) == 5
+    assert all("report" in path for path, is_dir in results[3:])
+
+
+def test_short_queries_scan_all_names(main):
+    index = build_index(main, {"/x": (0, ["ab.txt", "cab", "zz"], ["a"])})
+    assert [path for path, is_dir in index.search("ab")] == ["/x/ab.txt", "/x/cab"]
+    assert index.search("missing") == []
+
+
+def test_search_roots_are_mountpoints_without_pseudo_filesystems(main, monkeypatch):
+    def partition(device, mountpoint, fstype, opts="rw"):
+        return types.SimpleNamespace(device=device, mountpoint=mountpoint, fstype=fstype, opts=opts)
+
+    monkeypatch.setattr(main.psutil, "disk_partitions", lambda: [
+        partition("/dev/sda1", "/", "ext4"), partition("/dev/sda2", "/home", "ext4"),
+        partition("/dev/loop0", "/snap/core/1", "squashfs"), partition("/dev/sr0", "/media/cd", "iso9660"),
+        partition("D:\\", "D:\\", "", "cdrom"), partition("/dev/sda1", "/", "ext4")
+    ])
+    assert main.get_search_roots() == ["/", "/home"]
+    monkeypatch.setattr(main.psutil, "disk_partitions", lambda: [])
+    assert main.get_search_roots() == [os.path.abspath(os.sep)]
+
+
+def test_crawl_indexes_the_roots(main, tmp_path):
+    (tmp_path / "docs" / "deep").mkdir(parents=True)
+    (tmp_path / "docs" / "deep" / "notes.txt").write_text("x")
+    index = main.FilenameIndex(index_path=None)
+    dirs = index.crawl([str(tmp_path)])
+    index.build(dirs)
+    assert index.search("notes") == [(str(tmp_path / "docs" / "deep" / "notes.txt"), False)]
+    assert index.scan_directory(str(tmp_path / "docs"), None, device=-1) is None
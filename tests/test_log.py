@@ -0,0 +1,10 @@
+import os
+
+
+def test_rotation_leaves_an_empty_log(main):
+    main.CommandLogWriter.write([(1700000000.0, "Test", "output")])
+    main.rotate_log()
+    log_path, index_path = main.log_paths()
+    assert os.path.getsize(log_path) == 0
+    assert os.path.getsize(index_path) == 0
+    assert os.path.getsize(main.log_paths(1)[0]) > 0
@@ -0,0 +1,44 @@
+import pytest
+
+
+def test_quantile_interpolates_inside_a_bucket(main):
+    histogram = main.Histogram(buckets=(1, 2, 4))
+    for value in (0.5, 1.5, 1.5, 3):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.quantile(0.25) == pytest.approx(1)
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    assert histogram.quantile(1) == pytest.approx(3)
+
+
+def test_quantile_above_the_last_bucket_is_the_max(main):
+    histogram = main.Histogram(buckets=(1,))
+    for value in (0.5, 7, 9):
+        histogram.observe(value)
+    assert histogram.quantile(0.99) == 9
+    assert main.Histogram().quantile(0.5) == 0
+
+
+def test_exposition_formats_all_metric_kinds(main):
+    registry = main.MetricsRegistry()
+    registry.inc("requests_total", method="sendMessage", code=429)
+    registry.inc("requests_total", method="sendMessage", code="400")
+    registry.inc("requests_total", 2, method="sendMessage", code=429)
+    registry.inc("odd_total", label='say "hi"\n')
+    registry.register("queue_length", lambda: 5, lane="bulk")
+    registry.register("broken", lambda: 1 / 0)
+    registry.observe("handler_seconds", 0.003, handler="start")
+
+    lines = registry.exposition().splitlines()
+    assert lines.count("# TYPE requests_total counter") == 1
+    assert 'requests_total{code="400",method="sendMessage"} 1' in lines
+    assert 'requests_total{code="429",method="sendMessage"} 3' in lines
+    assert 'odd_total{label="say \\"hi\\"\\n"} 1' in lines
+    assert "# TYPE queue_length gauge" in lines
+    assert 'queue_length{lane="bulk"} 5' in lines
+    assert not any(line.startswith("broken") for line in lines)
+    assert 'handler_seconds_bucket{handler="start",le="0.0025"} 0' in lines
+    assert 'handler_seconds_bucket{handler="start",le="0.005"} 1' in lines
+    assert 'handler_seconds_bucket{handler="start",le="+Inf"} 1' in lines
+    assert 'handler_seconds_count{handler="start"} 1' in lines
+    assert registry.total("requests_total") == 4
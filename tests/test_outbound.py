@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def clock(main, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_bucket_allows_a_burst_then_waits_for_refill(main, clock):
+    bucket = main.TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        assert bucket.delay() == 0
+        bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+    clock[0] += 0.25
+    assert bucket.delay() == pytest.approx(0.25)
+    clock[0] += 0.25
+    assert bucket.delay() == 0
+
+
+def test_bucket_never_refills_above_capacity(main, clock):
+    bucket = main.TokenBucket(rate=10, capacity=2)
+    clock[0] += 60
+    bucket.delay()
+    assert bucket.tokens == 2
+
+
+def test_reserve_keeps_tokens_for_other_lanes(main, clock):
+    bucket = main.TokenBucket(rate=1, capacity=3)
+    bucket.take()
+    assert bucket.delay(reserve=2) == pytest.approx(1)
+    assert bucket.delay() == 0
+
+
+def test_pause_delays_until_retry_after(main, clock):
+    bucket = main.TokenBucket(rate=1, capacity=5)
+    bucket.pause(4)
+    bucket.pause(2)
+    assert bucket.delay() == pytest.approx(4)
+    clock[0] += 4
+    assert bucket.delay() == 0
+
+
+def test_superseded_edit_does_not_inherit_the_newer_result(main, monkeypatch):
+    monkeypatch.setattr(main, "metrics", main.MetricsRegistry())
+    dispatcher = main.OutboundDispatcher()
+    dispatcher.limited = False
+    release = threading.Event()
+
+    def blocker():
+        release.wait(5)
+
+    def edit(text):
+        raise ValueError(text)
+
+    dispatcher.submit(main.OUTBOUND_NORMAL, blocker, (), {})
+    old = dispatcher.submit(main.OUTBOUND_NORMAL, edit, ("old",), {}, key="edit")
+    new = dispatcher.submit(main.OUTBOUND_NORMAL, edit, ("new",), {}, key="edit")
+    assert old.result(timeout=1) == main.OUTBOUND_SUPERSEDED
+    release.set()
+    with pytest.raises(ValueError, match="new"):
+        new.result(timeout=5)
@@ -0,0 +1,30 @@
+import threading
+import time
+import types
+
+
+def test_sampler_skips_the_profile_handler_thread(main, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(main.bot, "reply_to", lambda *args, **kwargs: release.wait(5))
+    message = types.SimpleNamespace(chat=types.SimpleNamespace(id=main.config.CHAT_ID), text="/profile")
+
+    profile_thread = threading.Thread(target=main.handle_profile, args=(message,))
+    idle_thread = threading.Thread(target=release.wait, args=(5,))
+    profile_thread.start()
+    idle_thread.start()
+    monkeypatch.setattr(main.bot, "worker_pool", types.SimpleNamespace(workers=[profile_thread, idle_thread]))
+
+    session = main.ProfileSession(main.config.CHAT_ID, "sample", 60)
+    sampler = threading.Thread(target=session.sample_forever)
+    sampler.start()
+    time.sleep(0.2)
+    session.stop_event.set()
+    sampler.join()
+    release.set()
+    profile_thread.join()
+    idle_thread.join()
+
+    assert session.threads == 2
+    assert session.samples > 0
+    assert session.busy == 0
+    assert "сэмплов рабочих потоков" in session.sample_report()
@@ -0,0 +1,55 @@
+import types
+
+import pytest
+
+
+def test_exact_action_wins_over_prefix(main):
+    for action in ("file_manager", "file_manager_sort", "file_manager_next", "file_manager_prev"):
+        handler, args = main.router.resolve(action)
+        assert handler.__name__ == "action_" + action
+        assert args == ()
+
+
+def test_prefix_action_gets_the_rest_of_the_data(main):
+    handler, args = main.router.resolve("file_1a")
+    assert handler is main.action_file
+    assert args == ("1a",)
+
+
+def test_longest_prefix_wins_and_dispatch_passes_the_rest(main, monkeypatch):
+    monkeypatch.setattr(main, "metrics", main.MetricsRegistry())
+    router = main.ActionRouter()
+    calls = []
+
+    @router.prefix("key_")
+    def action_key(call, rest):
+        calls.append(("key", rest))
+
+    @router.prefix("key_combo_")
+    def action_key_combo(call, rest):
+        calls.append(("combo", rest))
+
+    @router.action("key_menu")
+    def action_key_menu(call):
+        calls.append(("menu",))
+
+    for data in ("key_enter", "key_combo_ctrl+c", "key_menu", "key_"):
+        assert router.dispatch(types.SimpleNamespace(data=data))
+    assert not router.dispatch(types.SimpleNamespace(data="unknown"))
+    assert not router.dispatch(types.SimpleNamespace(data="ke"))
+    assert calls == [("key", "enter"), ("combo", "ctrl+c"), ("menu",), ("key", "")]
+    assert set(main.metrics.series("bot_action_seconds")) == {
+        (("action", "key"),), (("action", "key_combo"),), (("action", "key_menu"),)}
+
+
+def test_dispatch_counts_handler_errors(main, monkeypatch):
+    monkeypatch.setattr(main, "metrics", main.MetricsRegistry())
+    router = main.ActionRouter()
+
+    @router.action("broken")
+    def action_broken(call):
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        router.dispatch(types.SimpleNamespace(data="broken"))
+    assert main.metrics.total("bot_action_errors_total") == 1
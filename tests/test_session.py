@@ -0,0 +1,55 @@
+def test_path_tokens_from_another_process_are_rejected(main):
+    registry = main.PathTokenRegistry(epoch="abc")
+    token = registry.token("/tmp/a")
+    assert token.startswith("abc.")
+    assert registry.resolve(token) == "/tmp/a"
+    assert registry.token("/tmp/a") == token
+
+    restarted = main.PathTokenRegistry(epoch="xyz")
+    restarted.token("/tmp/b")
+    assert restarted.resolve(token) is None
+    assert restarted.resolve("1") is None
+
+
+def test_evicted_path_tokens_stop_resolving(main):
+    registry = main.PathTokenRegistry(limit=2, epoch="e")
+    first = registry.token("/a")
+    registry.token("/b")
+    registry.token("/c")
+    assert registry.resolve(first) is None
+    assert registry.token("/a") != first
+
+
+def test_restore_keeps_defaults_for_invalid_fields(main, tmp_path):
+    session = main.ChatSession(1)
+    session.restore({
+        "process_sort": "bogus", "file_manager_sort": ["size"], "file_manager_page": -3,
+        "screenshot_format": "bmp", "screenshot_quality": 500, "screenshot_max_size": "1920",
+        "show_system_processes": "yes", "current_directory": str(tmp_path / "missing")
+    })
+    defaults = main.ChatSession(2)
+    for field in main.ChatSession.PERSISTENT_FIELDS:
+        assert getattr(session, field) == getattr(defaults, field), field
+
+
+def test_restore_applies_valid_fields(main, tmp_path):
+    session = main.ChatSession(1)
+    session.restore({
+        "process_sort": "cpu", "file_manager_sort": "mtime", "file_manager_page": 2, "screenshot_format": "png",
+        "screenshot_quality": 55, "screenshot_max_size": 800, "show_system_processes": True,
+        "current_directory": str(tmp_path)
+    })
+    assert (session.process_sort, session.file_manager_sort, session.file_manager_page) == ("cpu", "mtime", 2)
+    assert (session.screenshot_format, session.screenshot_quality, session.screenshot_max_size) == ("png", 55, 800)
+    assert session.show_system_processes and session.current_directory == str(tmp_path)
+
+
+def test_corrupted_snapshot_entries_are_ignored(main, tmp_path):
+    path = tmp_path / "sessions.json"
+    path.write_text('{"1": [], "2": {"last_access": "now"}, "3": {"last_access": 1e18, "process_sort": "cpu"}}')
+    store = main.SessionStore(snapshot_path=str(path))
+    store.load()
+    assert list(store.pending) == ["3"]
+    path.write_text("[1, 2]")
+    store.load()
+    assert list(store.pending) == ["3"]
@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+
+import pytest
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="uses /bin/sh")
+
+
+@pytest.fixture
+def shell(main, tmp_path):
+    session = main.ShellSession(cwd=str(tmp_path))
+    yield session
+    session.close()
+
+
+def run(session, command, timeout=10):
+    lines = []
+    returncode, interrupted = session.run(command, on_output=lines.append, timeout=timeout)
+    return returncode, interrupted, "".join(lines).strip()
+
+
+def test_state_persists_between_commands(shell, tmp_path):
+    (tmp_path / "sub").mkdir()
+    assert run(shell, "cd sub; CONTROLPC_TEST=42")[:2] == (0, False)
+    assert run(shell, 'pwd; echo "$CONTROLPC_TEST"')[2] == f"{tmp_path / 'sub'}\n42"
+    assert shell.cwd == str(tmp_path / "sub")
+
+
+def test_exit_code_is_reported(shell):
+    assert run(shell, "false")[0] == 1
+    assert run(shell, "sh -c 'exit 7'")[0] == 7
+
+
+def test_command_reading_stdin_gets_end_of_input(shell):
+    started = time.monotonic()
+    returncode, interrupted, output = run(shell, 'read line; echo "got:$line"', timeout=5)
+    assert output == "got:"
+    assert not interrupted
+    assert time.monotonic() - started < 2
+
+
+def test_timeout_interrupts_command(shell):
+    returncode, interrupted, output = run(shell, "echo start; sleep 30", timeout=0.5)
+    assert interrupted
+    assert output.startswith("start")
+
+
+def test_command_started_while_busy_runs_in_one_shot_process(main, shell, tmp_path):
+    assert shell.reserve()
+    assert not shell.reserve()
+    blocker = threading.Thread(target=run, args=(shell, "sleep 1"))
+    blocker.start()
+
+    started = time.monotonic()
+    returncode, interrupted, output = run(main.OneShotCommand(shell.cwd), "pwd; read line; echo done")
+    assert (returncode, interrupted, output) == (0, False, f"{tmp_path}\ndone")
+    assert time.monotonic() - started < 1
+    blocker.join()
+    assert shell.reserve()
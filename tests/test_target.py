@@ -0,0 +1,28 @@
+import types
+
+
+def make_message(main, text, reply_to=None):
+    reply = types.SimpleNamespace(message_id=reply_to) if reply_to is not None else None
+    return types.SimpleNamespace(chat=types.SimpleNamespace(id=main.config.CHAT_ID), text=text,
+                                 reply_to_message=reply)
+
+
+def test_cells_only_count_as_replies_to_the_grid(main, monkeypatch):
+    session = main.ChatSession(main.config.CHAT_ID)
+    monkeypatch.setattr(main, "get_session", lambda chat_id: session)
+    assert not main.is_screen_target_reply(make_message(main, "c3", reply_to=7))
+
+    session.target = main.ScreenTarget((0, 0, 1200, 800), message_id=7)
+    assert main.is_screen_target_reply(make_message(main, "c3", reply_to=7))
+    assert not main.is_screen_target_reply(make_message(main, "c3"))
+    assert not main.is_screen_target_reply(make_message(main, "c3", reply_to=8))
+
+    session.target.shown -= main.TARGET_TTL + 1
+    assert not main.is_screen_target_reply(make_message(main, "c3", reply_to=7))
+    assert session.target is None
+
+
+def test_waiting_handlers_come_before_the_grid(main):
+    names = [handler["function"].__name__ for handler in main.bot.message_handlers]
+    for name in ("handle_emulation_text", "handle_process_kill_input", "handle_path_input", "handle_macro_name"):
+        assert names.index(name) < names.index("handle_target_cell")
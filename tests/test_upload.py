@@ -0,0 +1,102 @@
+import hashlib
+import io
+import os
+import types
+import zipfile
+
+import pytest
+
+from fake_bot_api import FakeBotApi
+
+
+@pytest.fixture(scope="module")
+def server():
+    api = FakeBotApi().start()
+    yield api
+    api.stop()
+
+
+@pytest.fixture
+def api(main, server, monkeypatch):
+    monkeypatch.setattr(main.apihelper, "API_URL", server.url + "/bot{0}/{1}")
+    monkeypatch.setattr(main.apihelper, "FILE_URL", server.url + "/file/bot{0}/{1}")
+    return server
+
+
+@pytest.fixture
+def target(tmp_path):
+    target = tmp_path / "target"
+    target.mkdir()
+    return target
+
+
+def upload(main, api, target, data, name, **kwargs):
+    file_info = main.bot.get_file(api.store_file(data, name)["file_id"])
+    return main.receive_upload(file_info, str(target / name), **kwargs)
+
+
+def test_download_is_streamed_to_disk_with_its_digest(main, api, target):
+    data = os.urandom(main.UPLOAD_CHUNK_SIZE * 2 + 12345)
+    path, digest, size, extracted = upload(main, api, target, data, "data.bin")
+    assert (path, size, extracted) == (str(target / "data.bin"), len(data), False)
+    assert digest == hashlib.sha256(data).hexdigest()
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert os.listdir(target) == ["data.bin"]
+
+
+def test_size_mismatch_and_missing_file_leave_nothing_behind(main, api, target):
+    stored = api.store_file(b"data", "a.txt")
+    file_info = main.bot.get_file(stored["file_id"])
+    with pytest.raises(IOError):
+        main.receive_upload(types.SimpleNamespace(file_path=file_info.file_path, file_size=5), str(target / "a.txt"))
+    with pytest.raises(IOError):
+        main.receive_upload(types.SimpleNamespace(file_path="documents/missing", file_size=None),
+                            str(target / "b.txt"))
+    assert os.listdir(target) == []
+
+
+def test_name_conflicts_get_a_suffix(main, api, target):
+    assert os.path.basename(upload(main, api, target, b"one", "a.txt")[0]) == "a.txt"
+    assert os.path.basename(upload(main, api, target, b"two", "a.txt")[0]) == "a (1).txt"
+    assert sorted(os.listdir(target)) == ["a (1).txt", "a.txt"]
+    assert (target / "a (1).txt").read_bytes() == b"two"
+
+
+def test_sha256_from_caption_is_checked(main, api, target):
+    digest = hashlib.sha256(b"data").hexdigest()
+    assert main.parse_upload_caption(f"unzip {digest.upper()}") == (True, digest)
+    assert main.parse_upload_caption("Unzip") == (True, None)
+
+    assert upload(main, api, target, b"data", "a.txt", expected_sha256=digest)[1] == digest
+    with pytest.raises(IOError):
+        upload(main, api, target, b"data", "b.txt", expected_sha256="0" * 64)
+    assert os.listdir(target) == ["a.txt"]
+
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_archive_is_extracted_within_the_limits(main, api, target):
+    data = make_zip({"one.txt": b"1" * 100, "sub/two.txt": b"2" * 100})
+    path, digest, size, extracted = upload(main, api, target, data, "archive.zip", extract=True)
+    assert extracted and path == str(target / "archive")
+    assert (target / "archive" / "sub" / "two.txt").read_bytes() == b"2" * 100
+    assert sorted(os.listdir(target)) == ["archive"]
+
+
+def test_archive_over_the_limits_is_rejected(main, api, target, monkeypatch):
+    data = make_zip({"bomb.txt": b"0" * 200000, "small.txt": b"1"})
+    monkeypatch.setattr(main, "UPLOAD_EXTRACT_MAX_BYTES", 100000)
+    with pytest.raises(IOError):
+        upload(main, api, target, data, "archive.zip", extract=True)
+    monkeypatch.setattr(main, "UPLOAD_EXTRACT_MAX_BYTES", 10 ** 9)
+    monkeypatch.setattr(main, "UPLOAD_EXTRACT_MAX_FILES", 1)
+    with pytest.raises(IOError):
+        upload(main, api, target, data, "archive.zip", extract=True)
+    assert os.listdir(target) == []
@@ -0,0 +1,35 @@
+import types
+
+from PIL import Image, ImageDraw
+
+
+def make_frame(*boxes):
+    frame = Image.new("RGB", (320, 180))
+    draw = ImageDraw.Draw(frame)
+    for box in boxes:
+        draw.rectangle(box, fill=(255, 255, 255))
+    return frame
+
+
+def test_watch_edits_only_changed_frames(main, monkeypatch):
+    sent = []
+    edits = []
+    monkeypatch.setattr(main.bot, "send_photo", lambda chat_id, photo, caption=None, reply_markup=None: (
+        sent.append(caption), types.SimpleNamespace(message_id=5))[1])
+    monkeypatch.setattr(main.bot, "edit_message_media", lambda media, chat_id, message_id, reply_markup=None: (
+        edits.append((media.caption, message_id))))
+
+    frames = iter([make_frame(), make_frame(), make_frame((0, 0, 39, 39), (200, 100, 279, 159))])
+    watch = main.ScreenWatch(1, capture=lambda: next(frames))
+
+    assert watch.step()
+    assert "изменено: весь экран" in sent[0]
+    assert not watch.step()
+    assert edits == []
+
+    assert watch.step()
+    assert len(edits) == 1
+    caption, message_id = edits[0]
+    assert message_id == 5
+    assert "кадр 2, изменено: 2 обл." in caption
+    assert watch.frames == 2 and watch.bytes_sent > 0